@@ -0,0 +1,160 @@
+import argparse
+import glob
+import os
+import time
+
+from sqlalchemy import text
+
+from database_utils import DatabaseConnector, get_connector
+
+# Materialised summary views the analysis queries read from, one definition per file in SUMMARIES_DIR.
+# Each file creates the view named after the file and the unique index needed to refresh it concurrently
+SUMMARIES_DIR = os.path.join('sql', 'aggregates')
+
+# Analysis queries run by run_analysis_queries, each file holds one query followed by its expected output
+ANALYSIS_QUERIES_DIR = os.path.join('sql', 'analysis_queries')
+
+def _read_statements(sql_file:str):
+    """
+    Split the SQL script 'sql_file' into its statements, leaving out the comment lines
+    """
+    with open(sql_file, 'r') as file:
+        lines = [line for line in file.read().splitlines() if not line.lstrip().startswith('--')]
+    return [statement.strip() for statement in '\n'.join(lines).split(';') if statement.strip()]
+
+def _read_query(sql_file:str):
+    """
+    Read the analysis query from 'sql_file', i.e. the text before its OUTPUT marker line, without the final ';'
+    """
+    with open(sql_file, 'r') as file:
+        lines = file.read().splitlines()
+    marker = next((i for i, line in enumerate(lines) if 'OUTPUT' in line and line.lstrip().startswith('--')), len(lines))
+    return '\n'.join(lines[:marker]).strip().rstrip(';')
+
+def build_summaries(db_connector:DatabaseConnector, summaries_dir:str=SUMMARIES_DIR):
+    """
+    Create the materialised summary views that don't exist and refresh the ones that do
+
+    The views are dropped before the tables they are built on are replaced (see drop_summaries), so after a full load 
+    they are created again from the new tables. After an incremental load they still exist and are refreshed
+    CONCURRENTLY, which recomputes them without blocking the queries reading them.
+    A view that can't be built, e.g. because one of its tables hasn't been loaded yet, is reported and skipped
+
+    Parameters:
+    ----------
+    db_connector: DatabaseConnector
+        Instance of DatabaseConnector to connect to the local DB
+
+    summaries_dir: string
+        Directory holding one SQL file per view, named after the view
+
+    Returns:
+    --------
+    dict
+        'created', 'refreshed' or the error, for each view
+    """
+    results = {}
+
+    with db_connector.engine.execution_options(isolation_level='AUTOCOMMIT').connect() as conn:
+        existing = set(conn.execute(text('SELECT matviewname FROM pg_matviews')).scalars())
+
+        for sql_file in sorted(glob.glob(os.path.join(summaries_dir, '*.sql'))):
+            view_name = os.path.splitext(os.path.basename(sql_file))[0]
+            start = time.perf_counter()
+            try:
+                if view_name in existing:
+                    conn.execute(text(f'REFRESH MATERIALIZED VIEW CONCURRENTLY "{view_name}"'))
+                    results[view_name] = 'refreshed'
+                else:
+                    # AUTOCOMMIT runs each statement on its own, so drop what a failed definition left behind
+                    try:
+                        for statement in _read_statements(sql_file):
+                            conn.execute(text(statement))
+                    except Exception:
+                        conn.execute(text(f'DROP MATERIALIZED VIEW IF EXISTS "{view_name}"'))
+                        raise
+                    results[view_name] = 'created'
+                print(f"{view_name}: {results[view_name]} in {time.perf_counter() - start:.2f}s")
+            except Exception as e:
+                results[view_name] = f"{type(e).__name__}: {e}"
+                print(f"{view_name}: could not be built ({results[view_name]})")
+
+    return results
+
+def drop_summaries(db_connector:DatabaseConnector, summaries_dir:str=SUMMARIES_DIR):
+    """
+    Drop the materialised summary views, before the tables they are built on are replaced
+
+    Parameters:
+    ----------
+    db_connector: DatabaseConnector
+        Instance of DatabaseConnector to connect to the local DB
+
+    summaries_dir: string
+        Directory holding one SQL file per view, named after the view
+
+    Returns:
+    --------
+    list of string
+        Names of the views dropped
+    """
+    view_names = [os.path.splitext(os.path.basename(sql_file))[0] for sql_file in sorted(glob.glob(os.path.join(summaries_dir, '*.sql')))]
+
+    with db_connector.engine.begin() as conn:
+        existing = set(conn.execute(text('SELECT matviewname FROM pg_matviews')).scalars())
+        dropped = [view_name for view_name in view_names if view_name in existing]
+        for view_name in dropped:
+            conn.execute(text(f'DROP MATERIALIZED VIEW "{view_name}"'))
+    return dropped
+
+def run_analysis_queries(db_connector:DatabaseConnector, query_dir:str=ANALYSIS_QUERIES_DIR, show_rows:bool=True):
+    """
+    Run every analysis query in 'query_dir' in order and print its rows and how long it took
+
+    Parameters:
+    ----------
+    db_connector: DatabaseConnector
+        Instance of DatabaseConnector to connect to the local DB
+
+    query_dir: string
+        Directory holding the task*.sql files
+
+    show_rows: bool
+        If True, print the rows returned by each query, otherwise only the timings
+
+    Returns:
+    --------
+    list of dict
+        Result of each query with keys 'task', 'rows' and 'seconds'
+    """
+    results = []
+
+    with db_connector.engine.connect() as conn:
+        for sql_file in sorted(glob.glob(os.path.join(query_dir, 'task*.sql')), key=lambda path: int(os.path.basename(path)[4:].split('_')[0])):
+            task = os.path.splitext(os.path.basename(sql_file))[0]
+            query = _read_query(sql_file)
+
+            start = time.perf_counter()
+            rows = conn.execute(text(query)).fetchall()
+            elapsed = time.perf_counter() - start
+            results.append({'task': task, 'rows': len(rows), 'seconds': elapsed})
+
+            print(f"{task}: {len(rows)} rows in {elapsed * 1000:.2f}ms")
+            if show_rows:
+                for row in rows:
+                    print('    ' + '\t'.join(str(value) for value in row))
+
+    print(f"Ran {len(results)} queries in {sum(result['seconds'] for result in results) * 1000:.2f}ms")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the summary views and run the analysis queries against the local PostgreSQL instance")
+    parser.add_argument('--creds', default='db_creds_local.yaml', help="Credentials file of the local PostgreSQL instance")
+    parser.add_argument('--refresh', action='store_true', help="Create or refresh the summary views before running the queries")
+    parser.add_argument('--quiet', action='store_true', help="Only print the timings, not the rows")
+    args = parser.parse_args()
+
+    db_conn_local = get_connector(args.creds)
+    if args.refresh:
+        build_summaries(db_conn_local)
+    run_analysis_queries(db_conn_local, show_rows=not args.quiet)
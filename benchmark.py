@@ -0,0 +1,635 @@
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+import argparse
+import gzip
+import io
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from analysis import drop_summaries
+from data_cleaning import DataCleaning
+from data_extraction import S3_COMPRESSIONS, DataExtractor
+from database_utils import DatabaseConnector
+from local_sources import StoresAPIServer
+from partitioned_load import load_orders_partitioned
+from synthetic_data import GENERATORS, SyntheticExtractor, generate_stores
+
+# Cleaning method of each table, timed by benchmark_pipeline
+CLEAN_METHODS = {
+    'dim_users': 'clean_user_data',
+    'dim_card_details': 'clean_card_data',
+    'dim_store_details': 'clean_store_data',
+    'dim_products': 'clean_products_data',
+    'orders_table': 'clean_orders_data',
+    'dim_date_times': 'clean_time_detail',
+}
+
+# Tables read from the RDS, which can be streamed in chunks
+CHUNKED_TABLES = ['dim_users', 'orders_table']
+
+def make_upload_frame(num_rows:int, seed:int=0):
+    """
+    Build a synthetic DataFrame shaped like orders_table to benchmark the upload paths
+
+    Parameters:
+    ----------
+    num_rows: int
+        Number of rows in the generated DataFrame
+
+    seed: int
+        Seed for the random number generator, so runs are comparable
+
+    Returns:
+    -------
+    <class 'pandas.core.frame.DataFrame'>
+        DataFrame with uuid, code and quantity columns
+    """
+    rng = np.random.default_rng(seed)
+    uuids = pd.Series([f"{value:032x}" for value in rng.integers(0, 2**63, size=num_rows)], dtype='string')
+
+    return pd.DataFrame({
+        'index': np.arange(num_rows, dtype='int32'),
+        'date_uuid': uuids,
+        'user_uuid': uuids.str[::-1],
+        'card_number': pd.Series(rng.integers(10**15, 10**16, size=num_rows).astype(str), dtype='string'),
+        'store_code': pd.Series([f"WEB-{value:08x}" for value in rng.integers(0, 450, size=num_rows)], dtype='string'),
+        'product_code': pd.Series([f"A8-{value:07d}" for value in rng.integers(0, 2000, size=num_rows)], dtype='string'),
+        'product_quantity': rng.integers(1, 14, size=num_rows),
+    })
+
+def benchmark_upload(creds_file:str, num_rows:int, chunksize:int, methods):
+    """
+    Time DatabaseConnector.upload_to_db for each of the upload 'methods' on the same synthetic DataFrame
+
+    Parameters:
+    ----------
+    creds_file: string
+        Credentials file of the (local) PostgreSQL instance to upload to
+
+    num_rows: int
+        Number of rows to upload
+
+    chunksize: int
+        Rows per chunk passed to upload_to_db
+
+    methods: list of string
+        Upload methods to compare, 'copy' and/or 'to_sql'
+    """
+    db_connector = DatabaseConnector(creds_file)
+    df = make_upload_frame(num_rows)
+
+    for method in methods:
+        start = time.perf_counter()
+        db_connector.upload_to_db(df, f"benchmark_upload_{method}", method=method, chunksize=chunksize)
+        elapsed = time.perf_counter() - start
+        print(f"upload_to_db method={method}: {num_rows} rows in {elapsed:.2f}s ({num_rows / elapsed:,.0f} rows/s)")
+
+def convert_product_weights_rowwise(products_df):
+    """
+    Reference row-by-row implementation of DataCleaning.convert_product_weights,
+    kept to check the vectorised version gives exactly the same output
+    """
+    def convert_to_kg(weight_str):
+        match = re.match(r'([\d.]+)\s*x?\s*([\d.]+)?\s*([\w]+)', weight_str)
+        if match:
+            value1, value2, unit = match.groups()
+            value = float(value1) * float(value2) if value2 else float(value1)
+            if unit == 'kg':
+                return value
+            elif unit == 'g':
+                return value / 1000
+            elif unit == 'oz':
+                return value * 0.0283495
+            elif unit == 'ml':
+                return value / 1000
+            else:
+                return value
+        else:
+            return None
+
+    products_df['weight'] = products_df['weight'].apply(lambda x: convert_to_kg(x) if pd.notna(x) else x)
+    return products_df
+
+def make_products_frame(num_rows:int, seed:int=0):
+    """
+    Build a synthetic products DataFrame with a 'weight' column in the formats found in products.csv,
+    including multiples, unsupported units, unrecognised strings and missing values
+    """
+    rng = np.random.default_rng(seed)
+    samples = np.array(['1.6kg', '0.45kg', '590g', '100g', '16oz', '400ml', '12 x 100g', '8 x 150g', '3 x 2g',
+                        '77g .', '1000', '9GO5DH8', np.nan, '2.5 kg', '1kg', '113g', '32oz', '15g'], dtype=object)
+    return pd.DataFrame({'weight': samples[rng.integers(0, len(samples), size=num_rows)]})
+
+def benchmark_weights(num_rows:int):
+    """
+    Check the vectorised DataCleaning.convert_product_weights matches the row-by-row reference 
+    on a synthetic products DataFrame, and time both
+    """
+    df = make_products_frame(num_rows)
+
+    start = time.perf_counter()
+    expected = convert_product_weights_rowwise(df.copy())['weight']
+    rowwise_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = DataCleaning().convert_product_weights(df.copy())['weight']
+    vectorised_time = time.perf_counter() - start
+
+    pd.testing.assert_series_equal(result, expected, check_exact=True)
+    print(f"convert_product_weights on {num_rows} rows: row-wise {rowwise_time:.2f}s, vectorised {vectorised_time:.2f}s, outputs identical")
+
+def read_s3_buffered(s3, bucket_name:str, file_key:str):
+    """
+    Reference implementation of the previous S3 read, which read the whole object into memory before parsing it.
+    Handles the same file types and compressions as DataExtractor.extract_from_s3
+    """
+    file_name, compression_extension = os.path.splitext(file_key.lower())
+    compression = S3_COMPRESSIONS.get(compression_extension)
+    if compression is None:
+        file_name = file_key.lower()
+    file_extension = os.path.splitext(file_name)[1]
+
+    body = io.BytesIO(s3.get_object(Bucket=bucket_name, Key=file_key)['Body'].read())
+    if file_extension == '.csv':
+        return pd.read_csv(body, index_col=0, header=0, compression=compression)
+    return pd.read_json(body, lines=file_extension != '.json', compression=compression)
+
+def benchmark_s3(sizes_mb:list):
+    """
+    Compare the time and peak memory (tracked by tracemalloc) of the buffered and the streaming S3 reads
+    of products-like CSV objects of increasing size, against an in-process S3 mocked with moto.
+    Both reads build the whole DataFrame, as clean_products_data does, and their results are checked to be equal
+    """
+    import boto3
+    try:
+        from moto import mock_aws
+    except ImportError:
+        # moto < 5
+        from moto import mock_s3 as mock_aws
+
+    with mock_aws():
+        s3 = boto3.client('s3', region_name='eu-west-1')
+        s3.create_bucket(Bucket='benchmark', CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+        extractor = DataExtractor(s3_client=s3)
+
+        for size_mb in sizes_mb:
+            row = "0,Product name,£9.99,1.6kg,homeware,7425710935115,2005-12-02,a1b2c3d4-e5f6-4a5b-8c7d-9e0f1a2b3c4d,Still_avaliable,R7-3126933h\n"
+            header = ",product_name,product_price,weight,category,EAN,date_added,uuid,removed,product_code\n"
+            data = (header + row * (size_mb * 2**20 // len(row))).encode()
+
+            for file_key, body in (('products.csv', data), ('products.csv.gz', gzip.compress(data))):
+                s3.put_object(Bucket='benchmark', Key=file_key, Body=body)
+
+                results = {}
+                for name, read in (('buffered', lambda: read_s3_buffered(s3, 'benchmark', file_key)),
+                                   ('streaming', lambda: extractor.extract_from_s3('benchmark', file_key))):
+                    tracemalloc.start()
+                    start = time.perf_counter()
+                    with redirect_stdout(io.StringIO()):
+                        results[name] = read()
+                    elapsed = time.perf_counter() - start
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                    print(f"{file_key} {size_mb}MB {name}: peak {peak / 2**20:.1f}MB, {elapsed:.2f}s")
+
+                pd.testing.assert_frame_equal(results['streaming'], results['buffered'])
+
+def _measure(function):
+    """
+    Call 'function' and measure its wall and CPU time and its peak memory (tracked by tracemalloc)
+
+    Returns:
+    --------
+    tuple
+        The result of 'function', the wall time and the CPU time in seconds and the peak memory in MB
+    """
+    tracemalloc.start()
+    start, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        result = function()
+        elapsed, elapsed_cpu = time.perf_counter() - start, time.process_time() - start_cpu
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, elapsed_cpu, peak / 2**20
+
+def _git_commit():
+    """
+    Short hash of the checked out commit, or None outside a git repository
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _read_results(results_file:str):
+    """
+    Latest stored result of each (table, stage, rows, chunksize) measurement in the JSON lines file 'results_file'
+    """
+    latest = {}
+    if os.path.exists(results_file):
+        with open(results_file, 'r') as file:
+            for line in file:
+                if line.strip():
+                    result = json.loads(line)
+                    latest[(result['table'], result['stage'], result['rows'], result.get('chunksize'))] = result
+    return latest
+
+def benchmark_pipeline(scales:list, table_names:list, creds_file:str=None, chunksize:int=None, seed:int=0,
+                       results_file:str='benchmark_results.jsonl', threshold:float=0.2):
+    """
+    Time each DataCleaning.clean_* method, and optionally the upload, on synthetic sources of increasing size
+
+    The sources are generated upfront by SyntheticExtractor, so the generation is not timed, except for
+    the RDS tables streamed in chunks (with 'chunksize') which are generated on the fly as they are cleaned.
+    Each measurement (wall and CPU time, rows in and out, throughput and peak memory) is appended to 'results_file'
+    as a JSON line and compared to the previous measurement of the same table, stage, scale and chunksize in that file
+
+    Parameters:
+    ----------
+    scales: list of int
+        Number of rows of the generated sources, one run per scale
+
+    table_names: list of string
+        Tables whose cleaning is timed
+
+    creds_file: string
+        Credentials file of the (local) PostgreSQL instance to time the upload to, no upload if None.
+        The rows are uploaded to 'benchmark_<table>' tables
+
+    chunksize: int
+        If given, 'dim_users' and 'orders_table' are generated, cleaned and uploaded in chunks of 'chunksize' rows
+
+    seed: int
+        Seed for the generated sources, so runs are comparable
+
+    results_file: string
+        JSON lines file the results are appended to
+
+    threshold: float
+        Throughput drop, compared to the previous result, above which a measurement is reported as a regression
+
+    Returns:
+    --------
+    list of dict
+        The results of this run
+    """
+    run = {'run_id': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': _git_commit(), 
+           'pandas': pd.__version__, 'chunksize': chunksize}
+    previous = _read_results(results_file)
+    db_connector = DatabaseConnector(creds_file) if creds_file else None
+    results = []
+
+    for num_rows in scales:
+        for table_name in table_names:
+            chunked = chunksize is not None and table_name in CHUNKED_TABLES
+            extractor = SyntheticExtractor(num_rows, seed=seed, tables=[] if chunked else [table_name])
+            # The synthetic extractor serves the RDS tables itself, so it also stands in for the RDS connector
+            data_cleaning = DataCleaning(rds_connector=extractor, data_extractor=extractor)
+            clean = getattr(data_cleaning, CLEAN_METHODS[table_name])
+
+            def run_clean():
+                with redirect_stdout(io.StringIO()):
+                    if chunked:
+                        return sum(len(chunk) for chunk in clean(chunksize=chunksize))
+                    return clean()
+
+            stages = [('clean', run_clean)]
+            if db_connector is not None:
+                if chunked:
+                    # The chunks are cleaned as they are uploaded, so the stage includes the cleaning
+                    def run_upload():
+                        with redirect_stdout(io.StringIO()):
+                            rows = 0
+                            def counted(chunks):
+                                nonlocal rows
+                                for chunk in chunks:
+                                    rows += len(chunk)
+                                    yield chunk
+                            db_connector.upload_to_db(counted(clean(chunksize=chunksize)), f"benchmark_{table_name}")
+                            return rows
+                    stages.append(('clean_upload', run_upload))
+                else:
+                    stages.append(('upload', lambda: db_connector.upload_to_db(cleaned, f"benchmark_{table_name}") or len(cleaned)))
+
+            for stage, function in stages:
+                output, elapsed, elapsed_cpu, peak_mb = _measure(function)
+                if stage == 'clean' and not chunked:
+                    cleaned = output
+                rows_out = output if isinstance(output, int) else len(output)
+
+                result = dict(run, table=table_name, stage=stage, rows=num_rows, rows_out=rows_out, seconds=round(elapsed, 4),
+                              cpu_seconds=round(elapsed_cpu, 4), rows_per_second=round(num_rows / elapsed, 1), peak_mb=round(peak_mb, 1))
+                results.append(result)
+
+                line = (f"{table_name:<18} {stage:<13} {num_rows:>11} rows -> {rows_out:>11} {elapsed:>9.2f}s "
+                        f"{result['rows_per_second']:>13,.0f} rows/s peak {peak_mb:>9.1f}MB")
+                last = previous.get((table_name, stage, num_rows, chunksize))
+                if last is not None:
+                    change = result['rows_per_second'] / last['rows_per_second'] - 1
+                    line += f"  {change:+.0%} vs {last['run_id']}" + ("  REGRESSION" if change < -threshold else "")
+                print(line)
+
+    with open(results_file, 'a') as file:
+        for result in results:
+            file.write(json.dumps(result) + '\n')
+    print(f"Results appended to {results_file}")
+
+    return results
+
+def benchmark_stores(num_stores:int, workers:list, latency:float, jitter:float, error_rate:float, max_retries:int=5, seed:int=0):
+    """
+    Time DataExtractor.get_stores against a local StoresAPIServer for each number of concurrent 'workers',
+    with a fixed latency and error rate per request, and report the requests made and the stores lost
+    """
+    with StoresAPIServer(generate_stores(num_stores, seed=seed), latency=latency, jitter=jitter, error_rate=error_rate, seed=seed) as server:
+        for max_workers in workers:
+            # A fresh extractor per run so the keep-alive pool is sized for the number of workers
+            extractor = DataExtractor(max_workers=max_workers, max_retries=max_retries, backoff_factor=0.01,
+                                      api_creds_file=None, stores_api_url=server.url)
+            requests_before, errors_before = server.request_count, server.error_count
+
+            start = time.perf_counter()
+            with redirect_stdout(io.StringIO()):
+                df = extractor.get_stores()
+            elapsed = time.perf_counter() - start
+
+            print(f"get_stores workers={max_workers:<3} {len(df)}/{num_stores} stores in {elapsed:.2f}s ({len(df) / elapsed:,.0f} stores/s), "
+                  f"{server.request_count - requests_before} requests, {server.error_count - errors_before} failed and retried")
+
+def benchmark_orders(source_creds:str, target_creds:str, partitions:list, split:str='range', partitioned_table:bool=False, chunksize:int=None):
+    """
+    Time the single-stream load of orders_table (clean_orders_data and upload_to_db) and the partitioned load
+    for each number of 'partitions', and check they load the same number of rows
+
+    Parameters:
+    ----------
+    source_creds: string
+        Credentials file of the database holding the source 'orders_table', e.g. one written by local_sources.py
+
+    target_creds: string
+        Credentials file of the (local) PostgreSQL instance to load into
+
+    partitions: list of int
+        Numbers of partitions to time the partitioned load with
+
+    split, partitioned_table, chunksize:
+        Options of the partitioned load, see load_orders_partitioned
+    """
+    target = DatabaseConnector(target_creds)
+    # orders_table is replaced without CASCADE, see run_pipeline
+    target.drop_foreign_keys(['orders_table'])
+    drop_summaries(target)
+
+    start = time.perf_counter()
+    data_cleaning = DataCleaning(rds_connector=DatabaseConnector(source_creds))
+    df = data_cleaning.clean_orders_data()
+    target.upload_to_db(df, 'orders_table')
+    baseline = time.perf_counter() - start
+    print(f"single stream: {len(df)} rows in {baseline:.2f}s ({len(df) / baseline:,.0f} rows/s)")
+
+    for num_partitions in partitions:
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            rows = load_orders_partitioned(source_creds, target_creds, num_partitions=num_partitions, split=split,
+                                           partitioned_table=partitioned_table, chunksize=chunksize)
+        elapsed = time.perf_counter() - start
+        with target.engine.connect() as conn:
+            loaded = conn.execute(text('SELECT COUNT(*) FROM "orders_table"')).scalar()
+        print(f"partitions={num_partitions:<3} {rows} rows in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s), {baseline / elapsed:.2f}x"
+              + ("" if loaded == len(df) else f"  MISMATCH: {loaded} rows in the table, {len(df)} expected"))
+
+# Client libraries imported lazily by DataExtractor, reported when a startup imports them
+LAZY_PACKAGES = ['boto3', 'botocore', 'requests', 'tabula', 'jpype']
+
+def _import_times(module:str):
+    """
+    Import 'module' in a new interpreter with -X importtime
+
+    Returns:
+    --------
+    tuple
+        Cumulative import time in seconds of each module imported by name, and the direct imports of 'module'
+        as a list of (name, seconds)
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, check=True).stderr
+    times, direct, children = {}, [], []
+    # Lines look like 'import time:       123 |        456 |     pandas.core', the nesting is in the indentation of the name.
+    # A module is listed after the modules it imports, so the direct imports of 'module' are the modules one level
+    # deeper listed since the previous top-level module
+    for line in output.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)', line)
+        if match:
+            name, seconds, depth = match.group(4), int(match.group(2)) / 1e6, len(match.group(3))
+            times[name] = seconds
+            if depth == 1:
+                if name == module:
+                    direct = children
+                children = []
+            elif depth == 3:
+                children.append((name, seconds))
+    return times, direct
+
+def benchmark_startup(table_names:list, repeats:int=5, results_file:str='benchmark_results.jsonl', threshold:float=0.2):
+    """
+    Measure the startup of process_and_upload.py: the import time of the module and its heaviest direct imports
+    (with python -X importtime), and the wall time of a --dry-run selecting each of 'table_names' on its own.
+    Results are appended to 'results_file' and compared with the previous run, increases of more than 'threshold'
+    are reported as regressions
+    """
+    run = {'run_id': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': _git_commit(), 'pandas': pd.__version__}
+    previous = _read_results(results_file)
+    results = []
+
+    times, direct = _import_times('process_and_upload')
+    total = times['process_and_upload']
+    direct = sorted(direct, key=lambda item: -item[1])
+    print(f"import process_and_upload: {total * 1000:.0f}ms, heaviest imports: "
+          + ', '.join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in direct[:8]))
+    lazy = [package for package in LAZY_PACKAGES if package in times]
+    print(f"Lazily imported packages imported at startup: {', '.join(lazy) if lazy else 'none'}")
+    results.append(dict(run, table='all', stage='import', rows=0, seconds=round(total, 4), lazy_imports=lazy))
+
+    for table_name in table_names:
+        # The dry run exits with 1 when credentials are missing, which doesn't change what it imports
+        command = [sys.executable, 'process_and_upload.py', '--tables', table_name, '--dry-run']
+        elapsed = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run(command, capture_output=True)
+            elapsed.append(time.perf_counter() - start)
+        results.append(dict(run, table=table_name, stage='dry_run', rows=0, seconds=round(statistics.median(elapsed), 4)))
+
+    for result in results:
+        line = f"{result['table']:<18} {result['stage']:<8} {result['seconds'] * 1000:>8.0f}ms"
+        last = previous.get((result['table'], result['stage'], 0, None))
+        if last is not None:
+            change = result['seconds'] / last['seconds'] - 1
+            line += f"  {change:+.0%} vs {last['run_id']}" + ("  REGRESSION" if change > threshold else "")
+        print(line)
+
+    with open(results_file, 'a') as file:
+        for result in results:
+            file.write(json.dumps(result) + '\n')
+    print(f"Results appended to {results_file}")
+
+    return results
+
+# Previous task 9 query, which builds a timestamp from strings for every row and orders the whole table
+TASK9_STRING_QUERY = """
+WITH 
+	cte_get_timestamp AS(
+		SELECT
+		year,
+		to_timestamp(CONCAT(year, '-', month, '-', day, ' ', timestamp), 'YYYY-MM-DD hh24:mi:ss')::timestamp as tt
+	FROM {table}
+	GROUP BY
+		year, month, day, timestamp
+	ORDER BY
+		year, month, day DESC	
+	),
+	cte_time_diff As (
+	SELECT
+		year,
+		LEAD (tt) OVER( ORDER BY tt ) - tt AS diff
+		FROM cte_get_timestamp
+	)
+SELECT year, AVG(diff) as actual_time_taken
+FROM cte_time_diff
+GROUP BY year
+"""
+
+# Task 9 as computed by mv_sale_intervals_by_year, over the stored sale_timestamp column
+TASK9_WINDOW_QUERY = """
+SELECT year, AVG(diff) FILTER (WHERE diff > INTERVAL '0') AS actual_time_taken
+FROM (
+	SELECT year, LEAD(sale_timestamp) OVER (PARTITION BY year ORDER BY sale_timestamp) - sale_timestamp AS diff
+	FROM {table}
+	WHERE sale_timestamp IS NOT NULL
+) AS sale_intervals
+GROUP BY year
+"""
+
+def benchmark_task9(creds_file:str, num_rows:int, table_name:str='benchmark_date_times'):
+    """
+    Generate a dim_date_times-like table of 'num_rows' random sales in the local PostgreSQL instance,
+    with its (year, sale_timestamp) index, then print the EXPLAIN ANALYZE plans of the previous and 
+    the window-function task 9 queries and the largest difference between their results
+
+    The previous query also counts the interval from the last sale of a year to the first sale of the next one,
+    so the averages differ slightly, by about one interval divided by the number of sales in the year
+    """
+    db_connector = DatabaseConnector(creds_file)
+
+    with db_connector.engine.begin() as conn:
+        start = time.perf_counter()
+        conn.execute(text(f'DROP TABLE IF EXISTS "{table_name}"'))
+        conn.execute(text(f"""
+            CREATE TABLE "{table_name}" AS
+            SELECT to_char(sale_timestamp, 'YYYY') AS year, to_char(sale_timestamp, 'FMMM') AS month, 
+                   to_char(sale_timestamp, 'FMDD') AS day, to_char(sale_timestamp, 'HH24:MI:SS') AS timestamp, sale_timestamp
+            FROM (
+                SELECT date_trunc('second', TIMESTAMP '1992-01-01' + random() * (TIMESTAMP '2023-01-01' - TIMESTAMP '1992-01-01')) AS sale_timestamp
+                FROM generate_series(1, :num_rows)
+            ) AS sales
+        """), {'num_rows': num_rows})
+        conn.execute(text(f'CREATE INDEX "ix_{table_name}_year_sale_timestamp" ON "{table_name}" (year, sale_timestamp)'))
+        print(f"Generated {table_name} with {num_rows} rows in {time.perf_counter() - start:.2f}s")
+
+    # VACUUM can't run in a transaction, it sets the visibility map so the index can be scanned without the table
+    with db_connector.engine.execution_options(isolation_level='AUTOCOMMIT').connect() as conn:
+        conn.execute(text(f'VACUUM ANALYZE "{table_name}"'))
+
+        results = {}
+        for name, query in (('string', TASK9_STRING_QUERY), ('window', TASK9_WINDOW_QUERY)):
+            query = query.format(table=table_name)
+            plan = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {query}")).scalars().all()
+            print(f"\n---- {name} query ----")
+            print('\n'.join(plan))
+            results[name] = dict(conn.execute(text(query)).fetchall())
+
+    max_difference = max(abs((results['string'][year] - results['window'][year]).total_seconds()) for year in results['window'])
+    print(f"\nLargest difference between the yearly averages: {max_difference:.3f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the data centralisation pipeline")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    upload_parser = subparsers.add_parser('upload', help="Compare the COPY and to_sql upload paths against a local Postgres")
+    upload_parser.add_argument('--creds', default='db_creds_local.yaml')
+    upload_parser.add_argument('--rows', type=int, default=1000000)
+    upload_parser.add_argument('--chunksize', type=int, default=100000)
+    upload_parser.add_argument('--methods', nargs='+', default=['copy', 'to_sql'])
+
+    weights_parser = subparsers.add_parser('weights', help="Check parity and time the product weight conversion")
+    weights_parser.add_argument('--rows', type=int, default=1000000)
+
+    s3_parser = subparsers.add_parser('s3', help="Compare the peak memory of buffered and streaming S3 reads (needs moto)")
+    s3_parser.add_argument('--sizes-mb', nargs='+', type=int, default=[16, 64, 256])
+
+    pipeline_parser = subparsers.add_parser('pipeline', help="Time the cleaning (and the upload) of synthetic sources at several scales")
+    pipeline_parser.add_argument('--scales', nargs='+', type=int, default=[10000, 100000, 1000000])
+    pipeline_parser.add_argument('--tables', nargs='+', choices=list(GENERATORS), default=list(GENERATORS))
+    pipeline_parser.add_argument('--creds', default=None, help="Credentials file of a local Postgres to also time the upload")
+    pipeline_parser.add_argument('--chunksize', type=int, default=None)
+    pipeline_parser.add_argument('--seed', type=int, default=0)
+    pipeline_parser.add_argument('--results', default='benchmark_results.jsonl', help="JSON lines file the results are appended to")
+    pipeline_parser.add_argument('--threshold', type=float, default=0.2, help="Throughput drop reported as a regression")
+
+    stores_parser = subparsers.add_parser('stores', help="Time get_stores against a local stores API with latency and errors")
+    stores_parser.add_argument('--stores', type=int, default=451)
+    stores_parser.add_argument('--workers', nargs='+', type=int, default=[1, 4, 8, 16, 32])
+    stores_parser.add_argument('--latency', type=float, default=0.05, help="Seconds every request waits")
+    stores_parser.add_argument('--jitter', type=float, default=0.0)
+    stores_parser.add_argument('--error-rate', type=float, default=0.02, help="Probability of a request failing with a 503")
+    stores_parser.add_argument('--max-retries', type=int, default=5)
+
+    task9_parser = subparsers.add_parser('task9', help="EXPLAIN ANALYZE the previous and window-function task 9 queries on a generated table")
+    task9_parser.add_argument('--creds', default='db_creds_local.yaml')
+    task9_parser.add_argument('--rows', type=int, default=5000000)
+
+    startup_parser = subparsers.add_parser('startup', help="Time the imports and a --dry-run of process_and_upload.py per table")
+    startup_parser.add_argument('--tables', nargs='+', default=['dim_store_details', 'dim_products', 'dim_card_details', 'dim_users'])
+    startup_parser.add_argument('--repeats', type=int, default=5)
+    startup_parser.add_argument('--results', default='benchmark_results.jsonl', help="JSON lines file the results are appended to")
+    startup_parser.add_argument('--threshold', type=float, default=0.2, help="Startup time increase reported as a regression")
+
+    orders_parser = subparsers.add_parser('orders', help="Time the single-stream and the partitioned loads of orders_table")
+    orders_parser.add_argument('--source-creds', default='.local_sources/db_creds_sqlite.yaml')
+    orders_parser.add_argument('--creds', default='db_creds_local.yaml')
+    orders_parser.add_argument('--partitions', nargs='+', type=int, default=[1, 2, 4, 8])
+    orders_parser.add_argument('--split', choices=['range', 'hash'], default='range')
+    orders_parser.add_argument('--partitioned-table', action='store_true')
+    orders_parser.add_argument('--chunksize', type=int, default=None)
+
+    args = parser.parse_args()
+
+    match args.benchmark:
+        case 'upload':
+            benchmark_upload(args.creds, args.rows, args.chunksize, args.methods)
+        case 'weights':
+            benchmark_weights(args.rows)
+        case 's3':
+            benchmark_s3(args.sizes_mb)
+        case 'pipeline':
+            benchmark_pipeline(args.scales, args.tables, creds_file=args.creds, chunksize=args.chunksize, seed=args.seed,
+                               results_file=args.results, threshold=args.threshold)
+        case 'stores':
+            benchmark_stores(args.stores, args.workers, args.latency, args.jitter, args.error_rate, max_retries=args.max_retries)
+        case 'task9':
+            benchmark_task9(args.creds, args.rows)
+        case 'startup':
+            benchmark_startup(args.tables, repeats=args.repeats, results_file=args.results, threshold=args.threshold)
+        case 'orders':
+            benchmark_orders(args.source_creds, args.creds, args.partitions, split=args.split, 
+                             partitioned_table=args.partitioned_table, chunksize=args.chunksize)
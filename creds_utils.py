@@ -0,0 +1,54 @@
+import os
+import threading
+import yaml
+
+# Cache of parsed credentials files, keyed by absolute path: {path: (mtime, creds)}
+_creds_cache = {}
+_creds_lock = threading.Lock()
+
+def read_creds(creds_file_name:str, reload_on_change:bool=False):
+    """
+    Read a YAML credentials file and return its contents as a dictionary
+
+    Each file is opened and parsed only once per process, later calls return the cached dictionary.
+    The returned dictionary is shared between callers and should not be modified.
+
+    Parameters:
+    ----------
+    creds_file_name: string
+        Filename of the file to read credentials from
+
+    reload_on_change: bool
+        If True, check the modification time of the file and read it again if it changed since it was cached
+
+    Returns:
+    --------
+    <class 'dict'>
+        A dictionary containing credentials read from 'creds_file_name'
+    """
+    path = os.path.abspath(creds_file_name)
+
+    with _creds_lock:
+        cached = _creds_cache.get(path)
+        if cached is not None and not reload_on_change:
+            return cached[1]
+
+        mtime = os.stat(path).st_mtime_ns
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, 'r') as file:
+            creds = yaml.safe_load(file)
+
+        _creds_cache[path] = (mtime, creds)
+        return creds
+
+def clear_creds_cache():
+    """
+    Forget all the cached credentials, so the next read_creds call reads the files again
+    """
+    with _creds_lock:
+        _creds_cache.clear()
+
+if __name__ == "__main__":
+    pass
@@ -3,12 +3,115 @@ import pandas as pd
 import re
 
 from data_extraction import DataExtractor
-from database_utils import DatabaseConnector
+from data_quality import DataQuality
+from date_parsing import parse_dates
+from instrumentation import instrumented
+from database_utils import DatabaseConnector, get_connector
+
+# Weight units and their conversion to kg as (multiplier, divisor): weight in kg = value * multiplier / divisor
+# Units that are not in the table are kept as they are. Extend with e.g. 'lb': (0.45359237, 1) or 'l': (1, 1)
+WEIGHT_UNITS_TO_KG = {
+    'kg': (1, 1),
+    'g': (1, 1000),
+    'oz': (0.0283495, 1),  # 1 oz is approximately 0.0283495 kg
+    'ml': (1, 1000),  # 1 ml is approximately 1 g
+}
+
+# Digits followed by optional 'x' and more digits followed by unit as 3 groups (example: 10 x 3kg)
+WEIGHT_PATTERN = re.compile(r'^([\d.]+)\s*x?\s*([\d.]+)?\s*([\w]+)')
+
+# Weight classes of the products, by weight in kg: [0, 2) is 'Light', [2, 40) 'Mid_Sized' and so on
+WEIGHT_CLASS_BINS = [-np.inf, 2, 40, 140, np.inf]
+WEIGHT_CLASSES = ['Light', 'Mid_Sized', 'Heavy', 'Truck_Required']
+
+# Default locations of the data sources, each can be overridden per DataCleaning instance
+RDS_CREDS_FILE = 'db_creds.yaml'
+S3_BUCKET = 'data-handling-public'
+CARD_DETAILS_PDF = "https://data-handling-public.s3.eu-west-1.amazonaws.com/card_details.pdf"
+
+# Foreign key columns of orders_table
+ORDERS_KEY_COLUMNS = ['date_uuid', 'user_uuid', 'card_number', 'store_code', 'product_code']
+
+# Target dtype of the columns of each table, applied in a single astype per table by DataCleaning.apply_dtypes
+# 'string' columns use the string dtype the DataCleaning instance was created with (e.g. 'string[pyarrow]')
+TABLE_DTYPES = {
+    'dim_users': {
+        'first_name': 'string', 'last_name': 'string', 'company': 'string', 'email_address': 'string',
+        'address': 'string', 'phone_number': 'string', 'user_uuid': 'string',
+        'country': 'category', 'country_code': 'category',
+    },
+    'dim_card_details': {
+        'card_number': 'string', 'expiry_date': 'string', 'card_provider': 'category',
+    },
+    'dim_store_details': {
+        'index': 'int32', 'address': 'string', 'locality': 'string', 'store_code': 'string',
+        'store_type': 'category', 'country_code': 'category', 'continent': 'category',
+    },
+    'dim_products': {
+        'product_name': 'string', 'EAN': 'string', 'uuid': 'string', 'product_code': 'string', 'category': 'category',
+    },
+    'orders_table': {
+        'date_uuid': 'string', 'user_uuid': 'string', 'card_number': 'string', 'store_code': 'string', 'product_code': 'string',
+    },
+    'dim_date_times': {
+        'date_uuid': 'string', 'time_period': 'category', 'month': 'int16', 'year': 'int16', 'day': 'int16',
+    },
+}
 
 class DataCleaning():
     """
     A utility class with methods to clean data from each of the data sources
     """
+    def __init__(self, rds_connector:DatabaseConnector=None, data_extractor:DataExtractor=None, string_dtype:str='string',
+                 orders_key_dtype:str='string', rds_creds_file:str=RDS_CREDS_FILE, bucket_name:str=S3_BUCKET, 
+                 card_details_pdf:str=CARD_DETAILS_PDF, data_quality:DataQuality=None) -> None:
+        """
+        Parameters:
+        ----------
+        rds_connector: DatabaseConnector
+            Connector to the AWS RDS instance holding 'legacy_users' and 'orders_table'.
+            Defaults to the shared connector for 'rds_creds_file', created the first time it is needed
+
+        data_extractor: DataExtractor
+            Extractor used by all the cleaning methods, a new DataExtractor by default
+
+        string_dtype: string
+            Dtype of the text columns, 'string' or 'string[pyarrow]' (needs pyarrow) to store them in Arrow buffers
+
+        orders_key_dtype: string
+            Dtype of the foreign key columns of 'orders_table' (see ORDERS_KEY_COLUMNS): 'string', or 'category'
+            to dictionary-encode them, as millions of orders repeat a few hundred stores and a few thousand products
+
+        rds_creds_file: string
+            Credentials file of the database holding the RDS tables, its DATABASE_URL can point to a local stand-in
+
+        bucket_name: string
+            S3 bucket holding 'products.csv' and 'date_details.json'
+
+        card_details_pdf: string
+            Link or local path to the card details PDF, or a local CSV standing in for it
+
+        data_quality: DataQuality
+            Checks the rows of each table against its validity rules and quarantines the failing ones.
+            Defaults to a DataQuality that only counts and drops them
+        """
+        self._rds_connector = rds_connector
+        self.data_extractor = data_extractor if data_extractor is not None else DataExtractor()
+        self.string_dtype = string_dtype
+        self.orders_key_dtype = orders_key_dtype
+        self.rds_creds_file = rds_creds_file
+        self.bucket_name = bucket_name
+        self.card_details_pdf = card_details_pdf
+        self.data_quality = data_quality if data_quality is not None else DataQuality()
+
+    @property
+    def rds_connector(self):
+        """
+        The connector to the AWS RDS instance
+        """
+        if self._rds_connector is None:
+            self._rds_connector = get_connector(self.rds_creds_file)
+        return self._rds_connector
 
     def is_within_int32_range(self, column_name, df):
         """
@@ -34,63 +137,147 @@ class DataCleaning():
         max_value = df[column_name].max()
 
         # Check if both min and max values are within the int32 range
-        return np.int32(min_value) >= np.iinfo(np.int32).min and np.int32(max_value) <= np.iinfo(np.int32).max
+        # (compared as they are, casting them to int32 first would wrap out-of-range values around)
+        return min_value >= np.iinfo(np.int32).min and max_value <= np.iinfo(np.int32).max
+
+    def downcast_ints(self, df, columns:list=None):
+        """
+        Method to convert int64 columns to int32 where all their values are within the int32 range, to save memory
+
+        Parameters:
+        ----------
+        df: <class 'pandas.core.frame.DataFrame'>
+            The DataFrame whose columns are converted
+
+        columns: list
+            Columns to check, all the int64 columns by default
+
+        Returns:
+        --------
+        <class 'pandas.core.frame.DataFrame'>
+            DataFrame with the int64 columns that fit converted to int32
+        """
+        if columns is None:
+            columns = df.columns
+        fits = [column for column in columns if df[column].dtype == 'int64' and self.is_within_int32_range(column, df)]
+        return df.astype({column: 'int32' for column in fits}) if fits else df
+
+    def apply_dtypes(self, df, table_name:str, overrides:dict=None):
+        """
+        Method to set the dtypes of the columns of 'df' from the dtype plan of 'table_name' (see TABLE_DTYPES)
+        in a single astype call, then downcast the remaining int64 columns that fit to int32
+
+        Parameters:
+        ----------
+        df: <class 'pandas.core.frame.DataFrame'>
+            The DataFrame whose columns are converted, columns of the plan missing from 'df' are skipped
+
+        table_name: string
+            Name of the table the data is uploaded to
+
+        overrides: dict
+            Dtypes replacing the ones of the plan for some columns, e.g. 'category' for the keys of 'orders_table'
+
+        Returns:
+        --------
+        <class 'pandas.core.frame.DataFrame'>
+            DataFrame with the planned dtypes
+        """
+        dtypes = {**TABLE_DTYPES[table_name], **(overrides or {})}
+        plan = {column: self.string_dtype if dtype == 'string' else dtype 
+                for column, dtype in dtypes.items() if column in df.columns}
+        df = df.astype(plan)
+        return self.downcast_ints(df, [column for column in df.columns if column not in plan])
     
     
-    def clean_user_data(self):
+    @instrumented('clean.clean_user_data')
+    def clean_user_data(self, chunksize:int=None):
         """
         Method for cleaning of the legacy_users data 
         Look for NULL values, errors with dates, incorrectly typed values and rows filled with the wrong information
 
+        Parameters:
+        ----------
+        chunksize: int
+            If given, stream 'legacy_users' from the RDS in chunks of 'chunksize' rows
+            and return an iterator of cleaned chunks instead of a single DataFrame
+
         Returns:
         --------
         <class 'pandas.core.frame.DataFrame'>
-            DataFrame containing cleaned 'legacy_users' data
+            DataFrame containing cleaned 'legacy_users' data, or an iterator of cleaned chunks if 'chunksize' is given
         """
 
-        dbe = DataExtractor()
-        dbc = DatabaseConnector('db_creds.yaml')
+        dbe = self.data_extractor
+        dbc = self.rds_connector
+
+        if chunksize is not None:
+            return self.clean_user_chunks(dbe.read_rds_table(dbc, 'legacy_users', chunksize=chunksize))
 
         # Read contents of the legacy_users table
         df = dbe.read_rds_table(dbc, 'legacy_users')
         print(f"Number of records in the 'legacy_users' table: {len(df)}")
-        # 1. Set correct data types to the columns of the DataFrame
 
-        # Index range for this table is 0 to 15319, but to avoid overflow errors if used on another table, 
-        # check all values are within int32 range and convert type from 64 to 32 to save memory
-        if self.is_within_int32_range('index', df):
-            df['index'] = df['index'].astype('int32')
-
-        # Convert text columns from `object` to `string`
-        # - useful to be able to perform string operations
-        # - string dtype is also more memory-efficient
-        df.first_name = df.first_name.astype('string')
-        df.last_name = df.last_name.astype('string')
-        df.company = df.company.astype('string')
-        df.email_address = df.email_address.astype('string')
-        df.address = df.address.astype('string')
-        df.phone_number = df.phone_number.astype('string')
-        df.user_uuid = df.user_uuid.astype('string')
-
-        # Convert country and country_code to `category`
-        df.country = df.country.astype('category')
-        df.country_code = df.country_code.astype('category')
+        return self.clean_user_frame(df)
 
-        # Convert date fields to date
-        df['date_of_birth'] = pd.to_datetime(df['date_of_birth'], format='mixed', errors='coerce')
+    def clean_user_chunks(self, chunks):
+        """
+        Generator cleaning an iterator of 'legacy_users' DataFrame chunks one chunk at a time
 
-        num_errors = df['date_of_birth'].isna().sum()
-        print(f"Number of records with invalid date_of_birth: {num_errors}")
+        Duplicate user_uuids are removed across chunks, keeping the first occurrence as for a single DataFrame
+
+        Parameters:
+        ----------
+        chunks: iterable of <class 'pandas.core.frame.DataFrame'>
+            Chunks of the 'legacy_users' table
+
+        Returns:
+        --------
+        generator of <class 'pandas.core.frame.DataFrame'>
+            Cleaned chunks
+        """
+        seen_uuids = set()
+        for df in chunks:
+            yield self.clean_user_frame(df, seen_uuids)
+
+    def clean_user_frame(self, df, seen_uuids:set=None):
+        """
+        Clean a DataFrame (or a chunk) of 'legacy_users' data
+
+        Parameters:
+        ----------
+        df: <class 'pandas.core.frame.DataFrame'>
+            Raw 'legacy_users' data
+
+        seen_uuids: set
+            user_uuids kept from previous chunks, rows with these are dropped as duplicates.
+            The user_uuids kept from 'df' are added to the set
+
+        Returns:
+        --------
+        <class 'pandas.core.frame.DataFrame'>
+            DataFrame containing cleaned 'legacy_users' data
+        """
+        # 1. Set correct data types to the columns of the DataFrame
+        # - text columns from `object` to `string`, useful to be able to perform string operations and more memory-efficient
+        # - country and country_code to `category`
+        # - index from int64 to int32 if all values are within the int32 range, to save memory
+        df = self.apply_dtypes(df, 'dim_users')
 
-        # Convert remaining date column to date type
-        df['join_date'] = pd.to_datetime(df['join_date'], format='mixed', errors='coerce')
+        # Convert date fields to date
+        raw_dates = {'date_of_birth': df['date_of_birth'], 'join_date': df['join_date']}
+        df['date_of_birth'] = parse_dates(df['date_of_birth'])
+        df['join_date'] = parse_dates(df['join_date'])
 
-        # 2. Drop all rows where the DOB and all other entries were invalid (36 rows dropped)
-        df = df.dropna(subset=['date_of_birth'])
-        print(f"Records with invalid DOB had other entries invalid too. Number of records after dropping invalid rows: {len(df)}")
+        # 2. Quarantine the rows where the DOB and all other entries were invalid (36 rows)
+        df = self.data_quality.validate(df, 'dim_users', raw_columns=raw_dates)
 
         # 3. Check for duplicate entries
+        if seen_uuids is not None:
+            df = df[~df.user_uuid.isin(seen_uuids)]
         df = df.drop_duplicates(subset='user_uuid', keep='first')
+        if seen_uuids is not None:
+            seen_uuids.update(df.user_uuid)
         print(f"Number of records after removing duplicates: {len(df)}")
 
         # 4. Validate that the join_date is after the date_of_birth
@@ -105,6 +292,7 @@ class DataCleaning():
         print(f"Number of entries with invalid dates: {df['invalid_date_flag'].sum()}")
         return df
 
+    @instrumented('clean.clean_card_data')
     def clean_card_data(self):
         """
         Method for cleaning card data extracted from a PDF
@@ -114,34 +302,20 @@ class DataCleaning():
         <class 'pandas.core.frame.DataFrame'>
             DataFrame containing cleaned 'card_details.pdf' data
         """
-        dbe = DataExtractor()
-        link_to_pdf = "https://data-handling-public.s3.eu-west-1.amazonaws.com/card_details.pdf"
-        
-        df_list = dbe.retrieve_pdf_data(link_to_pdf)
+        dbe = self.data_extractor
+        df_list = dbe.retrieve_pdf_data(self.card_details_pdf)
 
         df = pd.concat(df_list, ignore_index=True)
 
         # 1. Set data types
-        df.card_number = df.card_number.astype('string')
-        df.expiry_date = df.expiry_date.astype('string')
-        df.card_provider = df.card_provider.astype('category')
-
-        # 2. Eliminate invalid rows using expiry date column 
-
-        # Add a new column to look at which 'expiry_date' entries fail to parse to MM/YY format
-        df['invalid_exp_date'] = pd.to_datetime(df.expiry_date, format='%m/%y', errors='coerce')
-        print(f"Number of rows with invalid expiry date: {len(df[df['invalid_exp_date'].isna()])}")
+        df = self.apply_dtypes(df, 'dim_card_details')
 
-        # As all other columns in the filtered set contain invalid data too,
-        # it's safe to drop all rows where the expiry_date is invalid (25 rows dropped)
-        # i.e. where invalid_exp_date is NaT
-        df = df.dropna(subset=['invalid_exp_date'])
-
-        # Delete the temporary column from data frame
-        df = df.drop(['invalid_exp_date'], axis=1)
+        # 2. Quarantine the rows whose expiry date doesn't parse to the MM/YY format,
+        # all their other columns contain invalid data too (25 rows)
+        df = self.data_quality.validate(df, 'dim_card_details')
 
         # 3. Set Data type of the date_payment_confirmed column to datetime
-        df['date_payment_confirmed'] = pd.to_datetime(df.date_payment_confirmed, format='mixed', errors='coerce') 
+        df['date_payment_confirmed'] = parse_dates(df.date_payment_confirmed) 
         print("No payment date entries failed to parse")
 
         # 4. Check for duplicate card_number entries
@@ -153,17 +327,29 @@ class DataCleaning():
 
         return df
     
-    def clean_store_data(self):
+    @instrumented('clean.clean_store_data')
+    def clean_store_data(self, changed_only:bool=False):
         """
         Method for cleaning store data retrieved using an API
+
+        Parameters:
+        ----------
+        changed_only: bool
+            If True, clean only the stores that are new or changed since the last sync (see DataExtractor.sync_stores),
+            the extractor needs a store_sync_dir
+
         Returns:
         --------
         <class 'pandas.core.frame.DataFrame'>
-            DataFrame containing cleaned data of all the stores
+            DataFrame containing cleaned data of all the stores, or of the new and changed ones indexed by store number
+            (the stores failing the validity rules are not in it)
         """
 
-        dbe = DataExtractor()
-        df = dbe.get_stores()
+        dbe = self.data_extractor
+        if changed_only:
+            _, df = dbe.sync_stores()
+        else:
+            df = dbe.get_stores()
 
         # 1. Delete the 'lat' column as it does not seem to contain any valid entries
         
@@ -173,29 +359,16 @@ class DataCleaning():
         
         df = df.drop(['lat'], axis=1)
 
-        # 2. Delete rows containing all NULL strings as values. These rows don't get caught in dropna, so first
-        #    replace 'NULL' string with NaN to be able to delete them using dropna
+        # 2. Quarantine the rows containing all NULL strings as values, and the rows with an invalid opening date
+        #    which contain all other values invalid too. 'NULL' strings are replaced with NaN first to count as nulls
         df.replace('NULL', np.nan, inplace=True)
 
-        # 'thresh' specifies the minimum number of non-null values required for a row to be retained
-        #  we want to retain all rows where even a single column (along with non-NaN index) is non-NaN, so set to '2'
-        df.dropna(thresh=2, inplace=True)
-
-        # 3. Set data types
-        # if self.is_within_int32_range('index', df):
-        df['index'] = df['index'].astype('int32')
-
-        # string columns
-        df.address = df.address.astype('string')
-        df.locality = df.locality.astype('string')
-        df.store_code = df.store_code.astype('string')
-
-        # Rows with invalid opening date contain all other values invalid too, so delete those rows
-        df['opening_dt_tmp'] = pd.to_datetime(df.opening_date, format='mixed', errors='coerce')
-        df = df.dropna(subset=['opening_dt_tmp'])
+        raw_dates = {'opening_date': df['opening_date']}
+        df['opening_date'] = parse_dates(df.opening_date)
+        df = self.data_quality.validate(df, 'dim_store_details', raw_columns=raw_dates)
 
-        # Delete the temp column
-        df = df.drop('opening_dt_tmp', axis=1)
+        # 3. Set data types of the index, string and category columns
+        df = self.apply_dtypes(df, 'dim_store_details')
 
         # Set latitude and longitude to float
         # Replace 'N/A' with pd.NA
@@ -209,15 +382,6 @@ class DataCleaning():
         df['longitude'] = df['longitude'].astype(float)
         df['latitude'] = df['latitude'].astype(float)
 
-        # category columns
-        df.store_type = df.store_type.astype('category')
-        df.country_code = df.country_code.astype('category')
-        df.continent = df.continent.astype('category')
-
-        # numeric
-        df['staff_numbers_tmp'] = pd.to_numeric(df['staff_numbers'], errors='coerce')
-        df[df['staff_numbers_tmp'].isna()]
-
         # 4. Fix typos in the staff_numbers column
         # As rows where staff_numbers column contains alphabets contain valid data in rest of the columns
         # those alphas look like typos, so remove the alphabets to keep only numberic data
@@ -225,68 +389,61 @@ class DataCleaning():
         # then convert dtype to numeric
         df.staff_numbers = df.staff_numbers.astype('int32')
 
-        # delete temp column
-        df = df.drop(['staff_numbers_tmp'], axis=1)
-
         # 5. Fix typos in continent column
         df.continent.unique()
         df.continent = df.continent.replace('eeAmerica', 'America')
         df.continent = df.continent.replace('eeEurope', 'Europe')
         return df
     
-    def convert_product_weights(self, products_df):
+    def convert_product_weights(self, products_df, units_to_kg:dict=None):
         """
         Method to convert varying units to equivalent kg
         
+        The conversion is vectorised: the value(s) and unit are extracted for the whole column with one pattern,
+        and the factor for each unit is looked up from the 'units_to_kg' table
+
         Parameters:
         ----------
         products_df: <class 'pandas.core.frame.DataFrame'>
             DataFrame containing products data with 'weight' column containing varying units 
             like oz, ml, gm, kg and multiples using 'x' (example: 10 x 3kg)
+
+        units_to_kg: dict
+            Table of unit -> (multiplier, divisor) to convert to kg, defaults to WEIGHT_UNITS_TO_KG
         
         Returns:
         --------
         <class 'pandas.core.frame.DataFrame'>
             DataFrame containing 'weight' column converted to kg
         """
+        if units_to_kg is None:
+            units_to_kg = WEIGHT_UNITS_TO_KG
+
+        weights = products_df['weight']
+
+        # Extract numerical values and unit from all the weight strings
+        parts = weights.str.extract(WEIGHT_PATTERN)
+        value1 = parts[0].astype('float64')
+        value2 = parts[1].astype('float64')
+        unit = parts[2]
+
+        # If 'x' is present, calculate the product of the two values
+        value = value1.where(value2.isna(), value1 * value2)
 
-        # Define a function to convert different units to kg
-        def convert_to_kg(weight_str):
-
-            # Extract numerical values and unit from the weight string
-            # Looking for digits followed by optional 'x' and more digits followed by unit as 3 groups
-            match = re.match(r'([\d.]+)\s*x?\s*([\d.]+)?\s*([\w]+)', weight_str)
-            
-            if match:
-                value1, value2, unit = match.groups()
-                value1 = float(value1)
-                
-                # If 'x' is present, calculate the product of the two values
-                if value2:
-                    value2 = float(value2)
-                    value = value1 * value2
-                else:
-                    value = value1
-                
-                # Convert to kg based on unit
-                if unit == 'kg':
-                    return value
-                elif unit == 'g':
-                    return value / 1000
-                elif unit == 'oz':
-                    return value * 0.0283495  # 1 oz is approximately 0.0283495 kg
-                elif unit == 'ml':
-                    return value / 1000  # 1 ml is approximately 1 g
-                else:
-                    return value  # Return value for unsupported units
-            else:
-                return None  # Return None if the format is not recognized
-
-        # Apply the conversion function to the 'weight' column
-        products_df['weight'] = products_df['weight'].apply(lambda x: convert_to_kg(x) if pd.notna(x) else x)
+        # Convert to kg based on unit, values with unsupported units are returned as they are
+        multiplier = unit.map({name: factor[0] for name, factor in units_to_kg.items()}).fillna(1).astype('float64')
+        divisor = unit.map({name: factor[1] for name, factor in units_to_kg.items()}).fillna(1).astype('float64')
+
+        # Report the weights whose format is not recognized, these are set to NaN
+        unmatched = weights.notna() & parts[0].isna()
+        if unmatched.any():
+            print(f"Number of weights in an unrecognised format: {unmatched.sum()}, for example: {list(weights[unmatched].unique()[:5])}")
+
+        products_df['weight'] = value * multiplier / divisor
         
         return products_df
  
+    @instrumented('clean.clean_products_data')
     def clean_products_data(self):
         """
         Method to clean products data
@@ -297,90 +454,143 @@ class DataCleaning():
             DataFrame containing cleaned products data
         """
 
-        dbe = DataExtractor()
+        dbe = self.data_extractor
 
-        bucket_name = 'data-handling-public'
+        bucket_name = self.bucket_name
         file_key = 'products.csv'
 
         df = dbe.extract_from_s3(bucket_name=bucket_name, file_key=file_key)
 
-        # 1. Drop the rows containing all columns with 'NULL'
-        df = df.dropna()
+        # 1. Set string and category dtypes
+        df = self.apply_dtypes(df, 'dim_products')
 
-        # 2. Set string and category dtypes
-        df.product_name = df.product_name.astype('string')
-        df.product_price = df.product_price.astype('string')
-        df.category = df.category.astype('category')
-        df.EAN = df.EAN.astype('string')
-        df.uuid = df.uuid.astype('string')
-        df.removed = df.removed.astype('category')
-        df.product_code = df.product_code.astype('string')
+        # 2. Set date type, then quarantine the rows containing all columns with 'NULL' and the invalid rows
+        raw_dates = {'date_added': df['date_added']}
+        df['date_added'] = parse_dates(df['date_added'])
+        df = self.data_quality.validate(df, 'dim_products', raw_columns=raw_dates)
 
-        # 3. Set date type & eliminate invalid rows
-        df['date_added'] = pd.to_datetime(df['date_added'], format='mixed', errors='coerce')
-        df = df.dropna(subset = ['date_added'])
-
-        # 4. Convert weights to kg
+        # 3. Convert weights to kg
         df = self.convert_product_weights(df)
 
+        # 4. Compute the derived columns, so the table is written once with its final types
+        # Remove the currency symbol from the price
+        df['product_price'] = df['product_price'].str.replace('£', '', regex=False).astype('float64')
+
+        # Classify the products by weight
+        df['weight_class'] = pd.cut(df['weight'], bins=WEIGHT_CLASS_BINS, labels=WEIGHT_CLASSES, right=False)
+
+        # Replace the 'removed' column with a boolean 'still_available' column
+        df['removed'] = df['removed'].map({'Still_avaliable': True, 'Removed': False}).astype('boolean')
+        df = df.rename(columns={'removed': 'still_available'})
+
         return df
 
-    def clean_orders_data(self):
+    @instrumented('clean.clean_orders_data')
+    def clean_orders_data(self, chunksize:int=None):
         """
         Method for cleaning orders data
 
+        Parameters:
+        ----------
+        chunksize: int
+            If given, stream 'orders_table' from the RDS in chunks of 'chunksize' rows
+            and return an iterator of cleaned chunks instead of a single DataFrame
+
         Returns:
         -------
         <class 'pandas.core.frame.DataFrame'>
-            DataFrame containing cleaned orders data
+            DataFrame containing cleaned orders data, or an iterator of cleaned chunks if 'chunksize' is given
         """
 
-        dbe = DataExtractor()
-        dbc = DatabaseConnector('db_creds.yaml')
+        dbe = self.data_extractor
+        dbc = self.rds_connector
+
+        if chunksize is not None:
+            return self.clean_orders_chunks(dbe.read_rds_table(dbc, 'orders_table', chunksize=chunksize))
 
         # Read contents of the orders_table table
         df = dbe.read_rds_table(dbc, 'orders_table')
 
-        # Drop the invalid columns
-        df = df.drop(['1', 'first_name', 'last_name'], axis=1)
+        return self.clean_orders_frame(df)
+
+    def clean_orders_chunks(self, chunks):
+        """
+        Generator cleaning an iterator of 'orders_table' DataFrame chunks one chunk at a time
+
+        Parameters:
+        ----------
+        chunks: iterable of <class 'pandas.core.frame.DataFrame'>
+            Chunks of the 'orders_table' table
+
+        Returns:
+        --------
+        generator of <class 'pandas.core.frame.DataFrame'>
+            Cleaned chunks
+        """
+        for df in chunks:
+            yield self.clean_orders_frame(df)
+
+    def clean_orders_frame(self, df):
+        """
+        Clean a DataFrame (or a chunk) of 'orders_table' data
+
+        Parameters:
+        ----------
+        df: <class 'pandas.core.frame.DataFrame'>
+            Raw 'orders_table' data
+
+        Returns:
+        -------
+        <class 'pandas.core.frame.DataFrame'>
+            DataFrame containing cleaned orders data
+        """
+
+        # Drop the invalid columns, and the 'level_0' index left over from the source
+        df = df.drop(['level_0', '1', 'first_name', 'last_name'], axis=1)
+
+        # Set data types, dictionary-encoding the repeated foreign keys straight from the extracted values
+        # rather than building full string columns first
+        overrides = {column: 'category' for column in ORDERS_KEY_COLUMNS} if self.orders_key_dtype == 'category' else None
+        df = self.apply_dtypes(df, 'orders_table', overrides=overrides)
 
-        # Set data types
-        df.date_uuid = df.date_uuid.astype('string')
-        df.user_uuid = df.user_uuid.astype('string')
-        df.card_number = df.card_number.astype('string')
-        df.store_code = df.store_code.astype('string')
-        df.product_code = df.product_code.astype('string')
-        
         return df
     
-    def clean_time_detail(self):
+    @instrumented('clean.clean_time_detail')
+    def clean_time_detail(self, prefix:str=None):
         """
         Method to clean time detail data
 
+        Parameters:
+        ----------
+        prefix: string
+            If given, extract and combine all the (partitioned) date details files under this S3 prefix 
+            instead of the single 'date_details.json'
+
         Returns:
         -------
         <class 'pandas.core.frame.DataFrame'>
             DataFrame containing cleaned time details data
         """
-        dbe = DataExtractor()
+        dbe = self.data_extractor
 
-        bucket_name = 'data-handling-public'
+        bucket_name = self.bucket_name
         file_key = 'date_details.json'
 
-        df = dbe.extract_from_s3(bucket_name=bucket_name, file_key=file_key)
+        if prefix is None:
+            df = dbe.extract_from_s3(bucket_name=bucket_name, file_key=file_key)
+        else:
+            df = dbe.extract_prefix_from_s3(bucket_name=bucket_name, prefix=prefix)
 
-        # 1. Drop the rows containing 'NULL' or invalid entries using timestamp
-        df['timestamp_temp'] = pd.to_datetime(df['timestamp'], format='mixed', errors='coerce')
-        df = df.dropna(subset=['timestamp_temp'])
-        df = df.drop(['timestamp_temp'], axis=1)
+        # 1. Quarantine the rows containing 'NULL' or invalid entries, found by their timestamp
+        df = self.data_quality.validate(df, 'dim_date_times')
         
         # 2. Set dtypes
-        df.time_period = df.time_period.astype('category')
-        df.date_uuid = df.date_uuid.astype('string')
+        df = self.apply_dtypes(df, 'dim_date_times')
 
-        df.month = df.month.astype('int16')
-        df.year = df.year.astype('int16')
-        df.day = df.day.astype('int16')
+        # 3. Combine the date parts and the time of the sale into a real timestamp, so queries don't build it from strings
+        # Date parts that don't make a valid date (e.g. 30 February) give NaT
+        dates = pd.to_datetime(df[['year', 'month', 'day']], errors='coerce')
+        df['sale_timestamp'] = dates + pd.to_timedelta(df['timestamp'], errors='coerce')
 
         return df
 
@@ -1,20 +1,240 @@
-from io import BytesIO, StringIO
-import boto3
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import hashlib
+import importlib.util
+import io
 import json
 import os
 import pandas as pd
-import requests
-import tabula
-import yaml
+import tempfile
+import threading
 
+from sqlalchemy import text
+
+from creds_utils import read_creds
 from database_utils import DatabaseConnector
+from extract_cache import ExtractCache
+from instrumentation import add_bytes, add_rows, in_current_stage, instrumented
+from store_sync import StoreSync
+
+# boto3, requests and tabula (with its JVM bridge) are imported by the methods using them, so a run only pays
+# for importing the client libraries of the sources of the tables it processes
+
+# Compression of S3 objects by file extension, decompressed while reading
+S3_COMPRESSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+
+# Base URL of the stores API, serving '/number_stores' and '/store_details/{store_number}'
+STORES_API_URL = "https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod"
+
+class _StreamingBodyReader(io.RawIOBase):
+    """
+    Raw binary stream over a botocore StreamingBody, so that pandas handles the body as a binary file
+    (decompressing and decoding it incrementally) instead of reading it whole
+    """
+    def __init__(self, body) -> None:
+        self._body = body
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._body.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._body.close()
+        super().close()
+
+def _read_pdf_pages(pdf_file:str, pages:list):
+    """
+    Parse the tables on 'pages' of a local PDF file, run in the worker processes of retrieve_pdf_data
+
+    With tabula-py's in-process JVM (jpype) each worker process starts the JVM once and reuses it for every range
+    """
+    import tabula
+    return tabula.read_pdf(pdf_file, pages=pages)
+
+def _count_pdf_pages(pdf_file:str):
+    """
+    Count the pages of a PDF file with pypdf, which reads the page tree (including pages kept in compressed object streams)
+    """
+    from pypdf import PdfReader
+    return len(PdfReader(pdf_file).pages)
 
 class DataExtractor:
     """
     This class will work as a utility class and contain methods that help extract data 
     from different data sources like an RDS, CSV files, an API or an S3 bucket
     """
-    def read_rds_table(self, db_connector:DatabaseConnector, table_name:str):
+    def __init__(self, max_workers:int=8, timeout:float=10, max_retries:int=5, backoff_factor:float=0.5,
+                 api_creds_file:str='api_creds.yaml', reload_creds:bool=False,
+                 cache:ExtractCache=None, refresh_cache:bool=False,
+                 pdf_workers:int=1, pdf_pages_per_range:int=10, pdf_cache_dir:str='.pdf_cache',
+                 s3_range_threshold:int=256 * 2**20, s3_range_size:int=16 * 2**20,
+                 stores_api_url:str=STORES_API_URL, s3_endpoint_url:str=None, s3_client=None, store_sync_dir:str=None) -> None:
+        """
+        Parameters:
+        ----------
+        max_workers: int
+            Maximum number of store requests in flight at once in get_stores
+
+        timeout: float
+            Per-request timeout in seconds for the stores API
+
+        max_retries: int
+            Number of retries for a store request that fails with a 429 or 5xx response
+
+        backoff_factor: float
+            Exponential backoff factor (in seconds) between the retries
+
+        api_creds_file: string
+            Filename of the file to read the API key from, None to send no API key (e.g. to a local StoresAPIServer)
+
+        reload_creds: bool
+            If True, the API credentials are read again when the file changes on disk
+
+        cache: ExtractCache
+            If given, the raw DataFrame extracted from each source is cached on disk and reused
+            while the source is unchanged (see ExtractCache)
+
+        refresh_cache: bool
+            If True, ignore the cached extracts and extract every source again, refreshing the cache
+
+        pdf_workers: int
+            Number of worker processes parsing PDF page ranges in retrieve_pdf_data (needs pypdf to count the pages),
+            1 parses the whole PDF in one call
+
+        pdf_pages_per_range: int
+            Number of PDF pages parsed by a worker at a time
+
+        pdf_cache_dir: string
+            Directory the downloaded PDFs and the parsed tables of each page range are kept in
+
+        s3_range_threshold: int
+            Size in bytes above which S3 objects are downloaded in parallel byte ranges
+
+        s3_range_size: int
+            Size in bytes of each byte range
+
+        stores_api_url: string
+            Base URL of the stores API, e.g. the URL of a local StoresAPIServer (see local_sources.py)
+
+        s3_endpoint_url: string
+            Endpoint of an S3-compatible service to use instead of AWS S3, e.g. a moto server or MinIO
+
+        s3_client:
+            Client to use for all the S3 extracts instead of a boto3 client, 
+            e.g. a LocalS3Client serving the objects from a local directory (see local_sources.py)
+
+        store_sync_dir: string
+            If given, the store details are synced with conditional requests instead of downloaded again on
+            every run, keeping the last payload of each store in this directory (see sync_stores)
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.api_creds_file = api_creds_file
+        self.reload_creds = reload_creds
+        self._session = None
+        self._api_creds = None
+        self._api_headers = None
+        self.cache = cache
+        self.refresh_cache = refresh_cache
+        self.pdf_workers = pdf_workers
+        self.pdf_pages_per_range = pdf_pages_per_range
+        self.pdf_cache_dir = pdf_cache_dir
+        self.s3_range_threshold = s3_range_threshold
+        self.s3_range_size = s3_range_size
+        self.stores_api_url = stores_api_url.rstrip('/')
+        self.s3_endpoint_url = s3_endpoint_url
+        self._s3 = s3_client
+        self._s3_lock = threading.Lock()
+        self.store_sync = StoreSync(store_sync_dir) if store_sync_dir is not None else None
+        self._pending_store_sync = None
+
+    def _get_session(self):
+        """
+        Create (once) and return a keep-alive requests.Session shared by all the API calls,
+        with a connection pool sized for max_workers and retry with backoff on 429/5xx responses
+
+        Returns:
+        --------
+        <class 'requests.Session'>
+            Session used for all requests to the stores API
+        """
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            retry = Retry(total=self.max_retries, 
+                          backoff_factor=self.backoff_factor, 
+                          status_forcelist=[429, 500, 502, 503, 504],
+                          allowed_methods=['GET'],
+                          respect_retry_after_header=True,
+                          raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers, max_retries=retry)
+
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+        return self._session
+
+    def _get_s3_client(self):
+        """
+        Create (once) and return the S3 client shared by all the S3 extracts of this extractor
+
+        boto3 clients are thread-safe once created, creating them is not, so creation is guarded by a lock.
+        The connection pool is sized for max_workers concurrent downloads
+
+        Returns:
+        --------
+        <class 'botocore.client.S3'>
+            S3 client
+        """
+        with self._s3_lock:
+            if self._s3 is None:
+                import boto3
+                from botocore.config import Config
+
+                session = boto3.session.Session()
+                self._s3 = session.client('s3', endpoint_url=self.s3_endpoint_url, 
+                                          config=Config(max_pool_connections=max(10, self.max_workers)))
+            return self._s3
+
+    def _cached(self, source_key:str, extract, get_validator=None):
+        """
+        Return the raw DataFrame of a source from the extract cache if it is still valid, otherwise call 'extract'
+
+        Parameters:
+        ----------
+        source_key: string
+            Key identifying the source in the cache
+
+        extract: callable
+            Function with no arguments extracting the raw DataFrame from the source
+
+        get_validator: callable
+            Function with no arguments returning a value identifying the current version of the source.
+            If it fails, the source is extracted again
+        """
+        if self.cache is None:
+            return extract()
+
+        validator = None
+        if get_validator is not None:
+            try:
+                validator = get_validator()
+            except Exception as e:
+                print(f"{source_key}: could not validate the cached extract ({e}), extracting again")
+                return self.cache.cached(source_key, extract, refresh=True)
+
+        return self.cache.cached(source_key, extract, validator=validator, refresh=self.refresh_cache)
+
+    @instrumented('extract.rds', labels=('table_name',))
+    def read_rds_table(self, db_connector:DatabaseConnector, table_name:str, chunksize:int=None):
         """
         Extract the RDS database table to a pandas DataFrame
 
@@ -29,13 +249,82 @@ class DataExtractor:
         table_name: string
             Name of the table to extract data from
 
+        chunksize: int
+            If given, stream the table through a server-side cursor and 
+            return an iterator of DataFrames with at most 'chunksize' rows each
+
         Returns:
         -------
         <class 'pandas.core.frame.DataFrame'>
-            DataFrame containing data from 'table_name'
+            DataFrame containing data from 'table_name', or an iterator of DataFrame chunks if 'chunksize' is given
+        """
+        if chunksize is None:
+            # The row count of the table is used to check the cached extract is still valid
+            def count_rows():
+                with db_connector.engine.connect() as conn:
+                    return conn.exec_driver_sql(f'SELECT COUNT(*) FROM "{table_name}"').scalar()
+
+            source_key = f"rds://{db_connector.engine.url.render_as_string(hide_password=True)}/{table_name}"
+            return self._cached(source_key, lambda: pd.read_sql_table(table_name, db_connector.engine), count_rows)
+        return self._stream_rds_table(db_connector, table_name, chunksize)
+
+    @instrumented('extract.rds_partition', labels=('table_name',))
+    def read_rds_partition(self, db_connector:DatabaseConnector, table_name:str, where:str, params:dict=None, chunksize:int=None):
+        """
+        Extract the rows of the RDS database table matching the condition 'where', e.g. one partition of the table
+        for a partitioned load (see partitioned_load.py). Partitions are not cached
+
+        Parameters:
+        ----------
+        db_connector: DatabaseConnector
+            Instance of the DatabaseConnector class used to connect to the AWS RDS DB
+
+        table_name: string
+            Name of the table to extract data from
+
+        where: string
+            SQL condition selecting the rows, with :name placeholders for 'params'
+
+        params: dict
+            Values of the placeholders in 'where'
+
+        chunksize: int
+            If given, stream the rows through a server-side cursor and 
+            return an iterator of DataFrames with at most 'chunksize' rows each
+
+        Returns:
+        -------
+        <class 'pandas.core.frame.DataFrame'>
+            DataFrame containing the matching rows, or an iterator of DataFrame chunks if 'chunksize' is given
+        """
+        query = text(f'SELECT * FROM "{table_name}" WHERE {where}')
+        if chunksize is None:
+            with db_connector.engine.connect() as conn:
+                return pd.read_sql_query(query, conn, params=params)
+        return self._stream_rds_query(db_connector, query, params, chunksize)
+
+    def _stream_rds_query(self, db_connector:DatabaseConnector, query, params:dict, chunksize:int):
+        """
+        Generator yielding the rows of 'query' in DataFrame chunks of 'chunksize' rows, see _stream_rds_table
         """
-        return pd.read_sql_table(table_name, db_connector.engine)
+        with db_connector.engine.connect() as conn:
+            conn = conn.execution_options(stream_results=True, max_row_buffer=chunksize)
+            for chunk in pd.read_sql_query(query, conn, params=params, chunksize=chunksize):
+                yield chunk
+
+    def _stream_rds_table(self, db_connector:DatabaseConnector, table_name:str, chunksize:int):
+        """
+        Generator yielding 'table_name' in DataFrame chunks of 'chunksize' rows
+
+        stream_results makes psycopg2 use a server-side cursor, so only one chunk is held in memory at a time.
+        The connection stays open until the generator is exhausted or closed
+        """
+        with db_connector.engine.connect() as conn:
+            conn = conn.execution_options(stream_results=True, max_row_buffer=chunksize)
+            for chunk in pd.read_sql_table(table_name, conn, chunksize=chunksize):
+                yield chunk
     
+    @instrumented('extract.pdf')
     def retrieve_pdf_data(self, pdf_path:str):
         """
         This method extracts data from a PDF link and returns a pandas DataFrame
@@ -43,100 +332,505 @@ class DataExtractor:
         Parameters:
         ----------
         pdf_path: string
-            The link to PDF to extract data from
+            The link to PDF to extract data from. A local .csv file is read as the single table of the document,
+            to stand in for the PDF in offline runs (see local_sources.py)
 
         Returns:
         -------
         list of <class 'pandas.core.frame.DataFrame'>
             DataFrame containing data extracted from PDF at the link
         """
+        if pdf_path.lower().endswith('.csv'):
+            return [pd.read_csv(pdf_path, dtype=str, keep_default_na=False)]
 
-        return tabula.read_pdf(pdf_path, pages='all')
+        if self.cache is None:
+            return self._read_pdf_tables(pdf_path)
+
+        # The tables of all the pages are cached as one DataFrame, which concatenates to the same result
+        def url_version():
+            response = self._get_session().head(pdf_path, timeout=self.timeout, allow_redirects=True)
+            response.raise_for_status()
+            return [response.headers.get('ETag'), response.headers.get('Last-Modified')]
+
+        df = self._cached(pdf_path, lambda: pd.concat(self._read_pdf_tables(pdf_path), ignore_index=True), 
+                          url_version if pdf_path.startswith(('http://', 'https://')) else None)
+        return [df]
     
+    def _read_pdf_tables(self, pdf_path:str):
+        """
+        Parse the tables of all the pages of a PDF, in the same order as tabula.read_pdf(pdf_path, pages='all')
+
+        The PDF is downloaded once to 'pdf_cache_dir' and its pages are split into ranges of 'pdf_pages_per_range'.
+        The ranges are parsed in parallel on 'pdf_workers' processes, and the tables of each range are cached
+        by the SHA-256 of the PDF content, so the ranges of an unchanged PDF are never parsed again
+
+        Parameters:
+        ----------
+        pdf_path: string
+            Link or local path to the PDF
+
+        Returns:
+        -------
+        list of <class 'pandas.core.frame.DataFrame'>
+            Tables extracted from the PDF
+        """
+        parallel = self.pdf_workers > 1
+        if parallel and importlib.util.find_spec('pypdf') is None:
+            print(f"{pdf_path}: pypdf is not installed to count the pages, parsing the whole PDF in one call")
+            parallel = False
+        if not parallel:
+            import tabula
+            return tabula.read_pdf(pdf_path, pages='all')
+
+        pdf_file = self._download_pdf(pdf_path)
+        with open(pdf_file, 'rb') as file:
+            content_hash = hashlib.sha256(file.read()).hexdigest()
+
+        num_pages = _count_pdf_pages(pdf_file)
+        if num_pages < 1:
+            raise ValueError(f"{pdf_path}: found no pages to parse in the PDF")
+        page_ranges = [list(range(start, min(start + self.pdf_pages_per_range, num_pages + 1))) 
+                       for start in range(1, num_pages + 1, self.pdf_pages_per_range)]
+
+        ranges_dir = os.path.join(self.pdf_cache_dir, content_hash)
+        os.makedirs(ranges_dir, exist_ok=True)
+        range_files = [os.path.join(ranges_dir, f"pages_{pages[0]}-{pages[-1]}.pkl") for pages in page_ranges]
+
+        # Parse only the ranges that are not cached yet
+        missing = [i for i, range_file in enumerate(range_files) if not os.path.exists(range_file)]
+        if missing:
+            print(f"{pdf_path}: parsing {len(missing)} of {len(page_ranges)} page ranges on {self.pdf_workers} processes")
+            with ProcessPoolExecutor(max_workers=min(self.pdf_workers, len(missing))) as executor:
+                for i, tables in zip(missing, executor.map(_read_pdf_pages, [pdf_file] * len(missing), [page_ranges[i] for i in missing])):
+                    # Written to a temporary file first, so an interrupted run never leaves a partial range behind
+                    pd.to_pickle(tables, range_files[i] + '.tmp')
+                    os.replace(range_files[i] + '.tmp', range_files[i])
+
+        tables = []
+        for range_file in range_files:
+            tables.extend(pd.read_pickle(range_file))
+        return tables
+
+    def _download_pdf(self, pdf_path:str):
+        """
+        Download the PDF at 'pdf_path' to 'pdf_cache_dir' and return the local file name.
+        Local paths are returned as they are. The stored ETag is sent with the request, 
+        so an unchanged PDF is not downloaded again
+        """
+        if not pdf_path.startswith(('http://', 'https://')):
+            return pdf_path
+
+        os.makedirs(self.pdf_cache_dir, exist_ok=True)
+        url_hash = hashlib.sha1(pdf_path.encode()).hexdigest()
+        pdf_file = os.path.join(self.pdf_cache_dir, f"{url_hash}.pdf")
+        etag_file = pdf_file + '.etag'
+
+        headers = {}
+        if os.path.exists(pdf_file) and os.path.exists(etag_file):
+            with open(etag_file, 'r') as file:
+                headers['If-None-Match'] = file.read()
+
+        with self._get_session().get(pdf_path, headers=headers, timeout=self.timeout, stream=True) as response:
+            if response.status_code == 304:
+                return pdf_file
+            response.raise_for_status()
+
+            with open(pdf_file + '.part', 'wb') as file:
+                for block in response.iter_content(chunk_size=1 << 20):
+                    file.write(block)
+                    add_bytes(len(block))
+            os.replace(pdf_file + '.part', pdf_file)
+
+            if 'ETag' in response.headers:
+                with open(etag_file, 'w') as file:
+                    file.write(response.headers['ETag'])
+            elif os.path.exists(etag_file):
+                os.remove(etag_file)
+
+        return pdf_file
+
     def __read_api_creds(self, creds_file_name):
         """
         Read api_creds.yaml file containing the api key
 
+        The file is parsed once per process and cached, see creds_utils.read_creds
+
         Parameters: 
         ----------
         creds_file_name: string
-            Filename of the file to read DB Credentials from
+            Filename of the file to read API Credentials from
 
         Returns:
         --------
         <class 'dict'>
-            A dictionary containing credentials read from db_creds.yaml
+            A dictionary containing credentials read from api_creds.yaml
         """
-        
-        with open(creds_file_name, 'r') as file:
-            return yaml.safe_load(file)
+        return read_creds(creds_file_name, reload_on_change=self.reload_creds)
+
+    def _get_api_headers(self):
+        """
+        Return the request headers for the stores API
+
+        The headers are built once and reused for every request, 
+        they are only rebuilt if reload_creds is set and the credentials file has changed
+        """
+        if self.api_creds_file is None:
+            return {}
+        if self._api_headers is None or self.reload_creds:
+            creds = self.__read_api_creds(self.api_creds_file)
+            if creds is not self._api_creds:
+                self._api_creds = creds
+                self._api_headers = dict(creds)
+        return self._api_headers
     
     def list_number_of_stores(self, stores_count_url:str):
         """
         Method to get the total number of stores
         """
-        header_details = self.__read_api_creds('api_creds.yaml')
-        r = requests.get(stores_count_url, headers=header_details)
+        header_details = self._get_api_headers()
+        r = self._get_session().get(stores_count_url, headers=header_details, timeout=self.timeout)
         return r.json()['number_stores']
     
-    def retrieve_store_data(self, store_by_number_url:str):
+    def retrieve_store_data(self, store_by_number_url:str, etag:str=None):
         """
         Method to retrieve store details for the given store number
+
+        If 'etag' is given, the request is conditional and the API can answer 304 Not Modified
         """
-        header_details = self.__read_api_creds('api_creds.yaml')
-        return requests.get(store_by_number_url, headers=header_details)
+        header_details = self._get_api_headers()
+        if etag is not None:
+            header_details = dict(header_details, **{'If-None-Match': etag})
+        return self._get_session().get(store_by_number_url, headers=header_details, timeout=self.timeout)
     
-    def get_stores(self):
+    def _fetch_store(self, store_by_number_url:str, store_number:int):
+        """
+        Fetch the details of a single store, returning None if the request failed
+        """
+        import requests
+
+        try:
+            response = self.retrieve_store_data(store_by_number_url.replace('{store_number}', str(store_number)))
+        except requests.RequestException as e:
+            print(f"Error for request {store_number}: {e}")
+            return None
+
+        if response.status_code == 200:
+            add_bytes(len(response.content))
+            return json.loads(response.content.decode())
+
+        print(f"Error for request {store_number}: {response.status_code}")
+        return None
+
+    def _sync_store(self, store_by_number_url:str, store_number:int, entry:dict):
+        """
+        Fetch the details of a single store conditionally on its synced 'entry' (None for a new store)
+
+        Returns:
+        --------
+        tuple
+            (True, new entry) if the store is new or changed, (False, entry) if it is unchanged,
+            with its ETag updated, or (False, None) if the request failed
+        """
+        import requests
+
+        try:
+            response = self.retrieve_store_data(store_by_number_url.replace('{store_number}', str(store_number)),
+                                                etag=entry.get('etag') if entry is not None else None)
+        except requests.RequestException as e:
+            print(f"Error for request {store_number}: {e}")
+            return False, None
+
+        if response.status_code == 304 and entry is not None:
+            return False, entry
+        if response.status_code != 200:
+            print(f"Error for request {store_number}: {response.status_code}")
+            return False, None
+
+        add_bytes(len(response.content))
+        content_hash = StoreSync.content_hash(response.content)
+        etag = response.headers.get('ETag')
+        if entry is not None and entry['hash'] == content_hash:
+            # The API doesn't send ETags, or the store was saved again unchanged
+            return False, dict(entry, etag=etag)
+        return True, {'hash': content_hash, 'etag': etag, 'payload': json.loads(response.content.decode())}
+
+    @instrumented('extract.stores_sync')
+    def sync_stores(self, max_workers:int=None):
+        """
+        Sync the store details with the state kept in 'store_sync_dir' and return all the stores and the ones
+        that are new or changed since the last sync
+
+        Each store is requested with the ETag of its last payload, so an API sending ETags can answer 304 Not Modified.
+        Otherwise a store is unchanged if its content hash is the same. Only the new and changed stores are
+        normalised, the others are taken from the normalised table of the last sync. Stores whose request fails
+        keep their last payload, and stores beyond the current number of stores are dropped.
+        The new state is only saved by commit_store_sync, once the changed stores have been loaded
+
+        Parameters:
+        ----------
+        max_workers: int
+            Maximum number of concurrent requests, defaults to the value the extractor was created with
+
+        Returns:
+        -------
+        tuple of <class 'pandas.core.frame.DataFrame'>
+            The details of all the stores as returned by get_stores, and the details of the new and changed stores
+            indexed by store number
+        """
+        if self.store_sync is None:
+            raise ValueError("sync_stores needs a DataExtractor created with a store_sync_dir")
+
+        store_by_number_url = f"{self.stores_api_url}/store_details/{{store_number}}"
+        num_stores = self.list_number_of_stores(f"{self.stores_api_url}/number_stores")
+        if max_workers is None:
+            max_workers = self.max_workers
+
+        synced, table = self.store_sync.load(self.stores_api_url)
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            results = list(executor.map(in_current_stage(lambda i: self._sync_store(store_by_number_url, i, synced.get(i))), range(0, num_stores)))
+
+        stores, changed = {}, {}
+        for store_number, (is_changed, entry) in enumerate(results):
+            if entry is None:
+                entry = synced.get(store_number)
+            if entry is None:
+                continue
+            stores[store_number] = entry
+            if is_changed:
+                changed[store_number] = entry['payload']
+
+        table = self.store_sync.update_table(table, changed, list(stores))
+        self._pending_store_sync = (stores, table, sorted(changed))
+
+        num_failed = sum(entry is None for _, entry in results)
+        num_removed = sum(store_number >= num_stores for store_number in synced)
+        print(f"{self.stores_api_url}: {len(changed)} new or changed stores, {len(stores) - len(changed)} unchanged, "
+              f"{num_failed} failed, {num_removed} removed")
+
+        changed_stores = table.loc[sorted(changed)]
+        add_rows(rows_out=len(changed_stores))
+        return table.reset_index(drop=True), changed_stores
+
+    def commit_store_sync(self, store_numbers=None):
+        """
+        Save the state of the last sync_stores, so the stores it returned as changed are unchanged for the next sync
+
+        Parameters:
+        ----------
+        store_numbers: list of int
+            The new and changed stores that were loaded, defaults to all of them. The other changed stores are
+            saved without their content hash and ETag, so the next sync returns them as changed again
+        """
+        if self._pending_store_sync is not None:
+            stores, table, changed = self._pending_store_sync
+            if store_numbers is not None:
+                loaded = set(store_numbers)
+                stores = dict(stores)
+                for store_number in changed:
+                    if store_number not in loaded:
+                        stores[store_number] = dict(stores[store_number], hash=None, etag=None)
+            self.store_sync.save(self.stores_api_url, stores, table)
+            self._pending_store_sync = None
+
+    @instrumented('extract.stores')
+    def get_stores(self, max_workers:int=None):
         """
         Method to fetch the number of stores and then get the data for each store
         The data is collected in a list and then returned as a DataFrame
+
+        The store details are requested concurrently over a shared keep-alive session, 
+        with at most 'max_workers' requests in flight. Results are collected in store-number order,
+        so the returned DataFrame is the same as when the stores are fetched one at a time
+        With a 'store_sync_dir', the stores are synced instead (see sync_stores) and the state is saved right away
+
+        Parameters:
+        ----------
+        max_workers: int
+            Maximum number of concurrent requests, defaults to the value the extractor was created with.
+            Use 1 to fetch the stores sequentially
+
+        Returns:
+        -------
+        <class 'pandas.core.frame.DataFrame'>
+            DataFrame containing the details of all the stores
         """
         
-        store_by_number_url = "https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/store_details/{store_number}"
-        stores_count_url = "https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/number_stores"
+        store_by_number_url = f"{self.stores_api_url}/store_details/{{store_number}}"
+        stores_count_url = f"{self.stores_api_url}/number_stores"
+
+        if self.store_sync is not None:
+            stores, _ = self.sync_stores(max_workers)
+            self.commit_store_sync()
+            return stores
         
         num_stores = self.list_number_of_stores(stores_count_url)
 
-        stores = []
+        if max_workers is None:
+            max_workers = self.max_workers
 
-        for i in range(0, num_stores):  
-            response = self.retrieve_store_data(store_by_number_url.replace('{store_number}', str(i)))
+        def fetch_stores():
+            # executor.map returns the results in the order of the store numbers, 
+            # regardless of the order in which the requests complete
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                results = executor.map(in_current_stage(lambda i: self._fetch_store(store_by_number_url, i)), range(0, num_stores))
+                stores = [store for store in results if store is not None]
+            
+            return pd.json_normalize(stores)
 
-            if response.status_code == 200:
-                stores.append(json.loads(response.content.decode()))
-            else:
-                print(f"Error for request {i}: {response.status_code}")
-        
-        return pd.json_normalize(stores)
+        # The API has no version information, so the cached stores are reused while the number of stores 
+        # is unchanged and, if the cache has a TTL, until they expire
+        return self._cached(store_by_number_url, fetch_stores, lambda: num_stores)
     
-    def extract_from_s3(self, bucket_name:str, file_key:str):
+    @instrumented('extract.s3', labels=('file_key',))
+    def extract_from_s3(self, bucket_name:str, file_key:str, chunksize:int=None):
         """
-        Method to extract data from a CSV in an S3 bucket
+        Method to extract data from a CSV or JSON file in an S3 bucket
         into a DataFrame and return it
+
+        The object is streamed from S3 straight into the pandas parser, without holding a copy of the whole file 
+        in memory first. Files ending with .gz or .zst are decompressed on the fly. 
+        Objects larger than 's3_range_threshold' are downloaded in parallel byte ranges to a temporary file
+
+        Parameters:
+        ----------
+        bucket_name: string
+            Name of the S3 bucket
+
+        file_key: string
+            Key of a .csv, .json or line-delimited .jsonl/.ndjson object, optionally compressed (.gz, .zst)
+
+        chunksize: int
+            If given, return an iterator of DataFrames with at most 'chunksize' rows each (CSV and line-delimited JSON only)
+
+        Returns:
+        -------
+        <class 'pandas.core.frame.DataFrame'>
+            DataFrame containing the data of the file, or an iterator of DataFrame chunks if 'chunksize' is given
         """
 
-        # Create an S3 client
-        s3 = boto3.client('s3')
+        s3 = self._get_s3_client()
 
-        _, file_extension = os.path.splitext(file_key.lower())
-        
-        if file_extension == '.json':
-            # Read the JSON file from S3
-            obj = s3.get_object(Bucket=bucket_name, Key=file_key)
-            # Load JSON data into Pandas DataFrame
-            df = pd.read_json(StringIO(obj['Body'].read().decode('utf-8')))
-            print(f"{file_key}: data loaded successfully")
-            return df
-        elif file_extension == '.csv':
-            # Read the CSV file from S3
-            obj = s3.get_object(Bucket=bucket_name, Key=file_key)
-            # Load CSV data into Pandas DataFrame
-            df = pd.read_csv(BytesIO(obj['Body'].read()), index_col=0, header=0)
-            print(f"{file_key}: data loaded successfully")
-            return df
-        else:
+        if chunksize is not None:
+            return self._read_s3_object(s3, bucket_name, file_key, chunksize=chunksize)
+
+        # The ETag of the object is used to check the cached extract is still valid
+        def object_version():
+            return s3.head_object(Bucket=bucket_name, Key=file_key)['ETag']
+
+        return self._cached(f"s3://{bucket_name}/{file_key}", lambda: self._read_s3_object(s3, bucket_name, file_key), object_version)
+
+    @instrumented('extract.s3_prefix', labels=('prefix',))
+    def extract_prefix_from_s3(self, bucket_name:str, prefix:str, max_workers:int=None):
+        """
+        Method to extract all the CSV or JSON files under 'prefix' in an S3 bucket
+        (for example daily partitions of date details) into a single DataFrame
+
+        The objects are downloaded concurrently and concatenated in key order
+
+        Parameters:
+        ----------
+        bucket_name: string
+            Name of the S3 bucket
+
+        prefix: string
+            Key prefix of the objects to extract, e.g. 'date_details/'
+
+        max_workers: int
+            Maximum number of objects downloaded at once, defaults to the value the extractor was created with
+
+        Returns:
+        -------
+        <class 'pandas.core.frame.DataFrame'>
+            DataFrame containing the data of all the objects, with a new RangeIndex
+        """
+        s3 = self._get_s3_client()
+        if max_workers is None:
+            max_workers = self.max_workers
+
+        objects = []
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=prefix):
+            objects.extend(obj for obj in page.get('Contents', []) if not obj['Key'].endswith('/'))
+        objects.sort(key=lambda obj: obj['Key'])
+
+        if not objects:
+            print(f"No objects found under s3://{bucket_name}/{prefix}, returning empty DataFrame")
+            return pd.DataFrame()
+
+        # The ETags from the listing validate the cached extracts without a request per object
+        def extract_object(obj):
+            return self._cached(f"s3://{bucket_name}/{obj['Key']}", 
+                                lambda: self._read_s3_object(s3, bucket_name, obj['Key']), lambda: obj['ETag'])
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            frames = list(executor.map(in_current_stage(extract_object), objects))
+
+        print(f"s3://{bucket_name}/{prefix}: {len(objects)} objects loaded successfully")
+        return pd.concat(frames, ignore_index=True)
+
+    def _read_s3_object(self, s3, bucket_name:str, file_key:str, chunksize:int=None):
+        """
+        Read the JSON or CSV object 'file_key' from the S3 bucket into a DataFrame, or an iterator of chunks
+        """
+        file_name, compression_extension = os.path.splitext(file_key.lower())
+        compression = S3_COMPRESSIONS.get(compression_extension)
+        if compression is None:
+            file_name = file_key.lower()
+        _, file_extension = os.path.splitext(file_name)
+
+        if file_extension not in ('.json', '.jsonl', '.ndjson', '.csv'):
             print('Unknown file extension found in file_key, returning empty DataFrame')
             return pd.DataFrame()
+
+        obj = s3.get_object(Bucket=bucket_name, Key=file_key)
+        add_bytes(obj['ContentLength'])
+        if obj['ContentLength'] > self.s3_range_threshold:
+            # Large objects are downloaded with parallel ranged GETs instead of one stream
+            obj['Body'].close()
+            body = self._download_s3_ranges(s3, bucket_name, file_key, obj['ContentLength'])
+        else:
+            body = io.BufferedReader(_StreamingBodyReader(obj['Body']), buffer_size=2**20)
+
+        if file_extension == '.csv':
+            # Load CSV data into Pandas DataFrame, reading the bytes straight from the stream
+            df = pd.read_csv(body, index_col=0, header=0, compression=compression, chunksize=chunksize)
+        elif file_extension == '.json' and chunksize is None:
+            # A JSON document has to be parsed whole, but is read from the stream without an extra decoded copy
+            df = pd.read_json(body, compression=compression)
+        else:
+            # Line-delimited JSON can be read one chunk of lines at a time
+            df = pd.read_json(body, lines=True, compression=compression, chunksize=chunksize)
+
+        if chunksize is None:
+            body.close()
+            print(f"{file_key}: data loaded successfully")
+        return df
+
+    def _download_s3_ranges(self, s3, bucket_name:str, file_key:str, content_length:int):
+        """
+        Download an S3 object with parallel byte-range GETs of 's3_range_size' bytes into a temporary file
+
+        Each part is written at its offset as soon as it arrives, 
+        so at most 's3_range_size' bytes per worker are held in memory
+
+        Returns:
+        -------
+        file object
+            Temporary binary file positioned at the start of the object's content, deleted when closed
+        """
+        temp_file = tempfile.TemporaryFile()
+
+        def download_range(start):
+            end = min(start + self.s3_range_size, content_length) - 1
+            part = s3.get_object(Bucket=bucket_name, Key=file_key, Range=f"bytes={start}-{end}")['Body'].read()
+            os.pwrite(temp_file.fileno(), part, start)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # list() re-raises the first failed download, if any
+            list(executor.map(download_range, range(0, content_length, self.s3_range_size)))
+
+        temp_file.seek(0)
+        return temp_file
     
 
 if __name__ == "__main__":
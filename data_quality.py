@@ -0,0 +1,182 @@
+from datetime import datetime, timezone
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from date_parsing import parse_dates
+
+class Rule:
+    """
+    A validity rule of a table: 'check' returns a boolean mask of the rows that pass it, computed on the whole
+    DataFrame at once. Rows that fail are quarantined with 'reason' as their reason code
+    """
+    def __init__(self, reason:str, check, description:str) -> None:
+        self.reason = reason
+        self.check = check
+        self.description = description
+
+def _has_values(df, min_values:int):
+    """
+    Mask of the rows with at least 'min_values' non-null values
+    """
+    return df.notna().sum(axis=1) >= min_values
+
+def _complete(df, except_columns:list):
+    """
+    Mask of the rows with no null values, outside of 'except_columns' (which have rules of their own)
+    """
+    return df[df.columns.difference(except_columns)].notna().all(axis=1)
+
+# Validity rules of each table, checked by DataQuality.validate once the cleaning method has parsed the columns
+# the rules look at. A row is kept only if it passes all the rules of its table, and is quarantined with the
+# reason code of the first rule it fails otherwise
+TABLE_RULES = {
+    'dim_users': [
+        # Rows with an invalid date of birth have all their other entries invalid too
+        Rule('invalid_date_of_birth', lambda df: df['date_of_birth'].notna(), "date_of_birth is not a valid date"),
+    ],
+    'dim_card_details': [
+        # Rows with an expiry date that isn't MM/YY have all their other entries invalid too
+        Rule('invalid_expiry_date', lambda df: pd.to_datetime(df['expiry_date'], format='%m/%y', errors='coerce').notna(),
+             "expiry_date is not in the MM/YY format"),
+    ],
+    'dim_store_details': [
+        # 'NULL' strings are read as nulls first, the index is always there so a row needs one more value
+        Rule('empty_row', lambda df: _has_values(df, 2), "all the values but the index are null"),
+        # Rows with an invalid opening date have all their other entries invalid too
+        Rule('invalid_opening_date', lambda df: df['opening_date'].notna(), "opening_date is not a valid date"),
+    ],
+    'dim_products': [
+        Rule('missing_values', lambda df: _complete(df, ['date_added']), "one or more values are null"),
+        Rule('invalid_date_added', lambda df: df['date_added'].notna(), "date_added is not a valid date"),
+    ],
+    'dim_date_times': [
+        # Only the rows that fail to parse matter, so times are matched with an exact format
+        Rule('invalid_timestamp', lambda df: parse_dates(df['timestamp'], formats=['%H:%M:%S'], report=False).notna(),
+             "timestamp is not in the HH:MM:SS format"),
+    ],
+}
+
+class DataQuality:
+    """
+    Checks the rows of each table against its validity rules, keeps count of the rows passing and failing
+    each rule, and quarantines the rows that fail instead of dropping them
+    """
+    def __init__(self, rules:dict=None, quarantine_dir:str=None, quarantine_connector=None,
+                 quarantine_suffix:str='_quarantine') -> None:
+        """
+        Parameters:
+        ----------
+        rules: dict
+            List of Rule per table name, defaults to TABLE_RULES
+
+        quarantine_dir: string
+            Directory the failing rows are written to as Parquet files (needs pyarrow), one sub-directory per table
+
+        quarantine_connector: DatabaseConnector
+            Connector to the database the failing rows are appended to, in a table named after the table and 'quarantine_suffix'
+
+        quarantine_suffix: string
+            Suffix of the quarantine tables
+        """
+        self.rules = rules if rules is not None else TABLE_RULES
+        self.quarantine_dir = quarantine_dir
+        self.quarantine_connector = quarantine_connector
+        self.quarantine_suffix = quarantine_suffix
+        # Rows passing and failing each rule, as [passed, failed] per (table name, reason code)
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._run_id = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        self._parts = {}
+
+    def validate(self, df, table_name:str, raw_columns:dict=None):
+        """
+        Check all the rules of 'table_name' on 'df' in one pass and return the rows that pass them all
+
+        Parameters:
+        ----------
+        df: <class 'pandas.core.frame.DataFrame'>
+            The DataFrame (or chunk) to check
+
+        table_name: string
+            Name of the table the data is uploaded to, tables without rules are returned as they are
+
+        raw_columns: dict
+            Values of the columns as extracted, by column name, for the columns the cleaning method has already
+            parsed. The quarantined rows keep these values rather than the NaT they were parsed to
+
+        Returns:
+        --------
+        <class 'pandas.core.frame.DataFrame'>
+            Rows of 'df' that pass all the rules
+        """
+        rules = self.rules.get(table_name, [])
+        if not rules:
+            return df
+
+        masks = [pd.Series(rule.check(df), index=df.index).fillna(False).to_numpy(dtype=bool) for rule in rules]
+        valid = np.logical_and.reduce(masks)
+
+        with self._lock:
+            for rule, mask in zip(rules, masks):
+                counts = self.counts.setdefault((table_name, rule.reason), [0, 0])
+                passed = int(mask.sum())
+                counts[0] += passed
+                counts[1] += len(mask) - passed
+
+        num_failed = len(df) - int(valid.sum())
+        failures = ', '.join(f"{rule.reason}: {len(mask) - mask.sum()}" for rule, mask in zip(rules, masks))
+        print(f"{table_name}: {num_failed} of {len(df)} rows failed the rules ({failures})")
+        if num_failed == 0:
+            return df
+        if self.quarantine_dir is None and self.quarantine_connector is None:
+            return df[valid]
+
+        failed = ~valid
+        quarantined = df[failed].copy()
+        for column, values in (raw_columns or {}).items():
+            quarantined[column] = np.asarray(values)[failed]
+        # Reason code of the first rule each row fails
+        quarantined['reason'] = np.select([~mask[failed] for mask in masks], [rule.reason for rule in rules], default='')
+        quarantined['quarantined_at'] = pd.Timestamp.now(tz='UTC')
+        self.quarantine(quarantined, table_name)
+
+        return df[valid]
+
+    def quarantine(self, df, table_name:str):
+        """
+        Write the failing rows 'df' of 'table_name' to the quarantine Parquet files and/or table, if configured.
+        The files are pickles instead if no Parquet engine is installed
+        """
+        # Values are kept as text, the quarantined values are often the ones that don't fit the column types
+        df = df.astype({column: 'string' for column in df.columns if column != 'quarantined_at'})
+
+        if self.quarantine_dir is not None:
+            table_dir = os.path.join(self.quarantine_dir, table_name)
+            os.makedirs(table_dir, exist_ok=True)
+            with self._lock:
+                part = self._parts[table_name] = self._parts.get(table_name, 0) + 1
+            # Each run and each chunk gets its own file, as Parquet files can't be appended to
+            path = os.path.join(table_dir, f"{self._run_id}_{part:05d}")
+            try:
+                df.to_parquet(path + '.parquet', index=False)
+            except ImportError:
+                # No Parquet engine installed (pyarrow or fastparquet), the rows are still kept for audit
+                df.to_pickle(path + '.pkl')
+
+        if self.quarantine_connector is not None:
+            df.to_sql(table_name + self.quarantine_suffix, self.quarantine_connector.engine, if_exists='append', index=False)
+
+    def report(self):
+        """
+        Print the number of rows that passed and failed each rule
+        """
+        with self._lock:
+            counts = sorted(self.counts.items())
+        if not counts:
+            return
+        print(f"{'table':<20} {'rule':<24} {'passed':>10} {'failed':>10}")
+        for (table_name, reason), (passed, failed) in counts:
+            print(f"{table_name:<20} {reason:<24} {passed:>10} {failed:>10}")
@@ -1,17 +1,109 @@
+from io import StringIO
+import os
+import pandas as pd
 from sqlalchemy import create_engine
 from sqlalchemy import inspect
-import yaml
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.types import BOOLEAN, DATE, FLOAT, SMALLINT, TIMESTAMP, VARCHAR
+import threading
+
+from creds_utils import read_creds
+from instrumentation import add_bytes, count_chunks, instrumented
+
+# Final schema of each table: the SQL types of its columns, its primary key, its foreign keys and its other indexes.
+# Tables are created with these column types (columns not listed get the type pandas infers from the DataFrame),
+# the primary key and indexes are added once the rows are loaded and the foreign keys once all the tables are loaded,
+# so no ALTER TABLE rewrites are needed afterwards
+TABLE_SCHEMAS = {
+    'dim_users': {
+        'columns': {
+            'first_name': VARCHAR(255), 'last_name': VARCHAR(255), 'date_of_birth': DATE(),
+            'country_code': VARCHAR(4), 'user_uuid': UUID(as_uuid=False), 'join_date': DATE(),
+        },
+        'primary_key': 'user_uuid',
+    },
+    'dim_card_details': {
+        'columns': {
+            'card_number': VARCHAR(24), 'expiry_date': VARCHAR(6), 'date_payment_confirmed': DATE(),
+        },
+        'primary_key': 'card_number',
+    },
+    'dim_store_details': {
+        'columns': {
+            'longitude': FLOAT(), 'latitude': FLOAT(), 'locality': VARCHAR(255), 'store_code': VARCHAR(16),
+            'staff_numbers': SMALLINT(), 'opening_date': DATE(), 'store_type': VARCHAR(255),
+            'country_code': VARCHAR(4), 'continent': VARCHAR(255),
+        },
+        'primary_key': 'store_code',
+    },
+    'dim_products': {
+        'columns': {
+            'product_price': FLOAT(), 'weight': FLOAT(), 'EAN': VARCHAR(24), 'product_code': VARCHAR(16),
+            'date_added': DATE(), 'uuid': UUID(as_uuid=False), 'still_available': BOOLEAN(), 'weight_class': VARCHAR(16),
+        },
+        'primary_key': 'product_code',
+    },
+    'dim_date_times': {
+        'columns': {
+            'month': VARCHAR(2), 'year': VARCHAR(4), 'day': VARCHAR(2), 'time_period': VARCHAR(16), 'date_uuid': UUID(as_uuid=False),
+            'sale_timestamp': TIMESTAMP(),
+        },
+        'primary_key': 'date_uuid',
+        # Serves the sale intervals per year (task 9) in index order, without sorting the table
+        'indexes': [['year', 'sale_timestamp']],
+    },
+    'orders_table': {
+        'columns': {
+            'date_uuid': UUID(as_uuid=False), 'user_uuid': UUID(as_uuid=False), 'card_number': VARCHAR(24),
+            'store_code': VARCHAR(16), 'product_code': VARCHAR(16), 'product_quantity': SMALLINT(),
+        },
+        'foreign_keys': {
+            'date_uuid': ('dim_date_times', 'date_uuid'),
+            'user_uuid': ('dim_users', 'user_uuid'),
+            'card_number': ('dim_card_details', 'card_number'),
+            'store_code': ('dim_store_details', 'store_code'),
+            'product_code': ('dim_products', 'product_code'),
+        },
+    },
+}
+
+# Natural key of each table, used to merge rows into the existing table in the 'upsert' load mode
+TABLE_NATURAL_KEYS = {table_name: schema['primary_key'] for table_name, schema in TABLE_SCHEMAS.items() if 'primary_key' in schema}
+
+# Table holding the high-water mark of the last incremental load of each table
+WATERMARKS_TABLE = 'etl_watermarks'
 
 class DatabaseConnector:
     """
     Class to connect to database
+
+    Each instance owns a SQLAlchemy engine with its own connection pool,
+    use get_connector to share one instance per credentials file across the process
     """
-    def __init__(self, creds_file_name) -> None:
-        self.engine = self.__init_db_engine(creds_file_name)
+    def __init__(self, creds_file_name, pool_size:int=5, max_overflow:int=10, pool_pre_ping:bool=False) -> None:
+        """
+        Parameters:
+        ----------
+        creds_file_name: string
+            Filename of the file to read DB Credentials from
+
+        pool_size: int
+            Number of connections kept open in the pool
+
+        max_overflow: int
+            Number of connections that can be opened beyond 'pool_size' when the pool is exhausted
+
+        pool_pre_ping: bool
+            If True, test connections for liveness when they are checked out of the pool
+        """
+        self.creds_file_name = creds_file_name
+        self.engine = self.__init_db_engine(creds_file_name, pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=pool_pre_ping)
         
     def __read_db_creds(self, creds_file_name):
         """
         Read db_creds.yaml file containing the database credentials and return a dictionary of the credentials
+        The file is parsed once per process and cached, see creds_utils.read_creds
 
         Parameters: 
         ----------
@@ -23,11 +115,10 @@ class DatabaseConnector:
         <class 'dict'>
             A dictionary containing credentials read from db_creds.yaml
         """
-        with open(creds_file_name, 'r') as file:
-            return yaml.safe_load(file)
+        return read_creds(creds_file_name)
         
 
-    def __init_db_engine(self, creds_file_name):
+    def __init_db_engine(self, creds_file_name, **pool_options):
         """
         Read database credentials from the credentials file and initialise and return a sqlalchemy database engine
         
@@ -36,6 +127,9 @@ class DatabaseConnector:
         creds_file_name: string
             Filename of the file to read DB Credentials from
 
+        pool_options:
+            Connection pool options passed to create_engine (pool_size, max_overflow, pool_pre_ping)
+
         Returns:
         --------
         <class 'sqlalchemy.engine.base.Engine'>
@@ -43,6 +137,11 @@ class DatabaseConnector:
         """
         db_creds = self.__read_db_creds(creds_file_name)
 
+        # A full database URL takes precedence over the RDS_* fields, e.g. 'sqlite:///local_sources/rds.sqlite' 
+        # to read the source tables from a local stand-in of the RDS
+        if 'DATABASE_URL' in db_creds:
+            return create_engine(db_creds['DATABASE_URL'], **pool_options)
+
         DATABASE_TYPE = 'postgresql'
         DBAPI = 'psycopg2'
         HOST = db_creds['RDS_HOST']
@@ -51,7 +150,7 @@ class DatabaseConnector:
         DATABASE = db_creds['RDS_DATABASE']
         PORT = db_creds['RDS_PORT']
 
-        return create_engine(f"{DATABASE_TYPE}+{DBAPI}://{USER}:{PASSWORD}@{HOST}:{PORT}/{DATABASE}")
+        return create_engine(f"{DATABASE_TYPE}+{DBAPI}://{USER}:{PASSWORD}@{HOST}:{PORT}/{DATABASE}", **pool_options)
 
     def list_db_tables(self):
         """
@@ -65,20 +164,514 @@ class DatabaseConnector:
         inspector = inspect(self.engine)
         return inspector.get_table_names()
         
-    def upload_to_db(self, df, table_name):
+    @instrumented('upload', labels=('table_name', 'mode'))
+    def upload_to_db(self, df, table_name, method='copy', chunksize=100000, mode='replace'):
         """
         This method will upload a Pandas DataFrame 'df' to a table 'table_name'.
 
         Parameter:
-        df: <class 'pandas.core.frame.DataFrame'>
-            The DataFrame from which data will be uploaded
+        df: <class 'pandas.core.frame.DataFrame'> or iterable of DataFrames
+            The DataFrame from which data will be uploaded. An iterator of DataFrame chunks
+            is uploaded one chunk at a time: the first chunk replaces the table and the rest are appended.
+            With no chunks at all, the table is replaced by an empty one.
+            Tables in TABLE_SCHEMAS are created with their final column types and get their primary key 
+            after the rows are loaded. The foreign keys referencing a replaced table and the views built on it 
+            must be dropped first (see drop_foreign_keys and analysis.drop_summaries), as run_pipeline does
 
         table_name: string
             The RDS table to which the data from DataFrame will be uploaded 
+
+        method: string
+            'copy' to bulk load the rows with PostgreSQL COPY FROM STDIN (default),
+            'to_sql' to insert them with pandas DataFrame.to_sql
+
+        chunksize: int
+            Number of rows serialised and sent to the database at a time
+
+        mode: string
+            'replace' to drop and recreate the table with the uploaded rows (default),
+            'upsert' to merge the rows into the existing table on its natural key (see TABLE_NATURAL_KEYS),
+            inserting new rows and updating changed ones. 'upsert' always loads with COPY
+        """
+
+        chunks = count_chunks([df] if isinstance(df, pd.DataFrame) else df)
+
+        if mode == 'upsert':
+            if table_name not in TABLE_NATURAL_KEYS:
+                raise ValueError(f"Table '{table_name}' has no natural key to upsert on, expected one of {list(TABLE_NATURAL_KEYS)}")
+            self.upsert_to_table(chunks, table_name, TABLE_NATURAL_KEYS[table_name], chunksize)
+            return
+        elif mode != 'replace':
+            raise ValueError(f"Unknown upload mode '{mode}', expected 'replace' or 'upsert'")
+
+        match method:
+            case 'copy':
+                with self.engine.begin() as conn:
+                    num_chunks = 0
+                    for num_chunks, chunk in enumerate(chunks, start=1):
+                        # Create (or replace) the empty table with the final column types, then stream the rows in
+                        if num_chunks == 1:
+                            self.__create_table(conn, chunk, table_name)
+                        self.copy_to_table(conn, chunk, table_name, chunksize)
+                    if num_chunks == 0:
+                        self.__empty_table(conn, table_name)
+                    self.__add_primary_key(conn, table_name)
+                    self.__add_indexes(conn, table_name)
+            case 'to_sql':
+                with self.engine.execution_options(isolation_level='AUTOCOMMIT').connect() as conn:
+                    num_chunks = 0
+                    for num_chunks, chunk in enumerate(chunks, start=1):
+                        if num_chunks == 1:
+                            self.__create_table(conn, chunk, table_name)
+                        chunk.to_sql(table_name, conn, if_exists='append', index=False, chunksize=chunksize)
+                    if num_chunks == 0:
+                        self.__empty_table(conn, table_name)
+                    self.__add_primary_key(conn, table_name)
+                    self.__add_indexes(conn, table_name)
+            case _:
+                raise ValueError(f"Unknown upload method '{method}', expected 'copy' or 'to_sql'")
+
+    def __create_table(self, conn, df, table_name):
+        """
+        Drop 'table_name' and create it empty, with the column types from TABLE_SCHEMAS 
+        and the types pandas infers for the other columns of 'df'
+
+        Without CASCADE, so the drop only locks 'table_name' and fails rather than silently dropping 
+        the foreign keys and views that depend on the table
+        """
+        conn.execute(text(f'DROP TABLE IF EXISTS "{table_name}"'))
+        df.head(0).to_sql(table_name, conn, index=False, dtype=self.__column_types(df, table_name))
+
+    def __empty_table(self, conn, table_name):
+        """
+        Replace 'table_name' with no rows, when there are no chunks to create it from: an existing table is emptied
+        and keeps its columns, a table in TABLE_SCHEMAS that doesn't exist is created with the columns listed there
+        """
+        if inspect(conn).has_table(table_name):
+            conn.execute(text(f'TRUNCATE TABLE "{table_name}"'))
+            return
+        columns = TABLE_SCHEMAS.get(table_name, {}).get('columns', {})
+        if columns:
+            empty = pd.DataFrame(columns=list(columns))
+            empty.to_sql(table_name, conn, index=False, dtype=self.__column_types(empty, table_name))
+
+    def __add_primary_key(self, conn, table_name):
+        """
+        Add the primary key from TABLE_SCHEMAS to 'table_name', building its index once over the loaded rows.
+        A table that already has a primary key (e.g. an existing table emptied by __empty_table) is left as it is
+        """
+        key = TABLE_SCHEMAS.get(table_name, {}).get('primary_key')
+        inspector = inspect(conn)
+        if key is None or not inspector.has_table(table_name):
+            return
+        if not inspector.get_pk_constraint(table_name)['constrained_columns']:
+            conn.execute(text(f'ALTER TABLE "{table_name}" ADD PRIMARY KEY ("{key}")'))
+
+    def __add_indexes(self, conn, table_name):
+        """
+        Create the indexes from TABLE_SCHEMAS on 'table_name' that don't exist yet, named 'ix_<table>_<columns>'
+        """
+        if not inspect(conn).has_table(table_name):
+            return
+        for columns in TABLE_SCHEMAS.get(table_name, {}).get('indexes', []):
+            column_list = ', '.join(f'"{column}"' for column in columns)
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS "ix_{table_name}_{"_".join(columns)}" ON "{table_name}" ({column_list})'))
+
+    def add_foreign_keys(self, table_name):
+        """
+        Add the foreign keys from TABLE_SCHEMAS to 'table_name' that don't exist yet, 
+        once the table and the tables it references are loaded
+
+        Parameters:
+        ----------
+        table_name: string
+            Name of the table to add the foreign keys to
+
+        Returns:
+        --------
+        list of string
+            Names of the foreign key constraints added
+        """
+        foreign_keys = TABLE_SCHEMAS.get(table_name, {}).get('foreign_keys', {})
+        added = []
+
+        with self.engine.begin() as conn:
+            inspector = inspect(conn)
+            if not inspector.has_table(table_name):
+                return added
+            existing = {foreign_key['name'] for foreign_key in inspector.get_foreign_keys(table_name)}
+
+            for column, (referenced_table, referenced_column) in foreign_keys.items():
+                constraint = f"fk_{table_name}_{referenced_table}_{column}"
+                if constraint in existing:
+                    continue
+                conn.execute(text(f'''
+                    ALTER TABLE "{table_name}" ADD CONSTRAINT {constraint}
+                    FOREIGN KEY ("{column}") REFERENCES "{referenced_table}" ("{referenced_column}")
+                '''))
+                added.append(constraint)
+        return added
+
+    def drop_foreign_keys(self, table_names:list):
+        """
+        Drop the foreign keys from TABLE_SCHEMAS that are on, or reference, one of 'table_names', 
+        so these tables can be replaced without CASCADE. add_foreign_keys adds them back once the tables are loaded
+
+        Parameters:
+        ----------
+        table_names: list of string
+            Names of the tables about to be replaced
+
+        Returns:
+        --------
+        list of string
+            Names of the foreign key constraints dropped
+        """
+        dropped = []
+
+        with self.engine.begin() as conn:
+            inspector = inspect(conn)
+            for table_name, schema in TABLE_SCHEMAS.items():
+                foreign_keys = schema.get('foreign_keys', {})
+                if not foreign_keys or not inspector.has_table(table_name):
+                    continue
+                existing = {foreign_key['name'] for foreign_key in inspector.get_foreign_keys(table_name)}
+
+                for column, (referenced_table, _) in foreign_keys.items():
+                    constraint = f"fk_{table_name}_{referenced_table}_{column}"
+                    if constraint in existing and (table_name in table_names or referenced_table in table_names):
+                        conn.execute(text(f'ALTER TABLE "{table_name}" DROP CONSTRAINT {constraint}'))
+                        dropped.append(constraint)
+        return dropped
+
+    def __column_types(self, df, table_name):
+        """
+        SQL types from TABLE_SCHEMAS for the columns of 'df', to create 'table_name' with
+        """
+        return {column: column_type for column, column_type in TABLE_SCHEMAS.get(table_name, {}).get('columns', {}).items() if column in df.columns}
+
+    def upsert_to_table(self, chunks, table_name, key, chunksize=100000):
+        """
+        Merge DataFrame chunks into 'table_name' on the column 'key'
+
+        The rows are COPY-loaded into a temporary staging table shaped like the target, 
+        then applied with a single INSERT ... ON CONFLICT (key) DO UPDATE.
+        The target table is created from the first chunk if it does not exist yet, 
+        and a unique index is added on 'key' if the table has no primary key or unique index on it.
+        Columns of TABLE_SCHEMAS that an existing table doesn't have yet (e.g. added since it was loaded) are added to it
+
+        Parameters:
+        ----------
+        chunks: iterable of <class 'pandas.core.frame.DataFrame'>
+            The rows to merge, their columns must exist in 'table_name'
+
+        table_name: string
+            Name of the table to merge the rows into
+
+        key: string
+            Natural key column of the table
+
+        chunksize: int
+            Number of rows per COPY buffer
+        """
+        staging_table = f"{table_name}_staging"
+        columns = None
+
+        with self.engine.begin() as conn:
+            for chunk in chunks:
+                if columns is None:
+                    if not inspect(conn).has_table(table_name):
+                        chunk.head(0).to_sql(table_name, conn, index=False, dtype=self.__column_types(chunk, table_name))
+                    else:
+                        self.__add_missing_columns(conn, chunk, table_name)
+                    self.__add_indexes(conn, table_name)
+                    if not self.__has_unique_key(conn, table_name, key):
+                        conn.execute(text(f'CREATE UNIQUE INDEX "{table_name}_{key}_key" ON "{table_name}" ("{key}")'))
+                    conn.execute(text(f'CREATE TEMPORARY TABLE "{staging_table}" (LIKE "{table_name}" INCLUDING DEFAULTS) ON COMMIT DROP'))
+                    columns = list(chunk.columns)
+
+                self.copy_to_table(conn, chunk, staging_table, chunksize)
+
+            if columns is None:
+                return
+
+            column_list = ', '.join(f'"{column}"' for column in columns)
+            updates = ', '.join(f'"{column}" = EXCLUDED."{column}"' for column in columns if column != key)
+            on_conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+
+            # DISTINCT ON keeps one row per key, as ON CONFLICT cannot update the same row twice in one statement
+            conn.execute(text(f"""
+                INSERT INTO "{table_name}" ({column_list})
+                SELECT DISTINCT ON ("{key}") {column_list} FROM "{staging_table}" ORDER BY "{key}"
+                ON CONFLICT ("{key}") {on_conflict}
+            """))
+
+    def __add_missing_columns(self, conn, df, table_name):
+        """
+        Add the columns of 'df' that the existing 'table_name' doesn't have, with their types from TABLE_SCHEMAS.
+        Rows already in the table get nulls until they are upserted again
         """
+        existing = {column['name'] for column in inspect(conn).get_columns(table_name)}
+        missing = [column for column in df.columns if column not in existing]
+        column_types = self.__column_types(df, table_name)
 
-        with self.engine.execution_options(isolation_level='AUTOCOMMIT').connect() as conn:
-            df.to_sql(table_name, conn, if_exists= 'replace', index=False)
+        unknown = [column for column in missing if column not in column_types]
+        if unknown:
+            raise ValueError(f"Table '{table_name}' has no column {', '.join(unknown)} and TABLE_SCHEMAS has no type for it, "
+                             f"load it with mode='replace' first")
+        for column in missing:
+            column_type = column_types[column].compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE "{table_name}" ADD COLUMN "{column}" {column_type}'))
+            print(f"{table_name}: added the column {column} ({column_type})")
+
+    def __has_unique_key(self, conn, table_name, key):
+        """
+        Check if 'table_name' has a primary key, unique constraint or unique index on exactly the column 'key'
+        """
+        inspector = inspect(conn)
+        if inspector.get_pk_constraint(table_name)['constrained_columns'] == [key]:
+            return True
+        if any(constraint['column_names'] == [key] for constraint in inspector.get_unique_constraints(table_name)):
+            return True
+        return any(index['unique'] and index['column_names'] == [key] for index in inspector.get_indexes(table_name))
+
+    def get_watermark(self, table_name):
+        """
+        Get the high-water mark recorded by the last incremental load of 'table_name'
+
+        Returns:
+        --------
+        <class 'datetime.datetime'>
+            The high-water mark, or None if the table has not been loaded incrementally yet
+        """
+        with self.engine.connect() as conn:
+            if not inspect(conn).has_table(WATERMARKS_TABLE):
+                return None
+            return conn.execute(text(f"SELECT high_water_mark FROM {WATERMARKS_TABLE} WHERE table_name = :table_name"),
+                                {'table_name': table_name}).scalar()
+
+    def set_watermark(self, table_name, column_name, high_water_mark):
+        """
+        Record the high-water mark of 'table_name' after an incremental load
+
+        Parameters:
+        ----------
+        table_name: string
+            Name of the loaded table
+
+        column_name: string
+            Column the high-water mark was taken from
+
+        high_water_mark: <class 'datetime.datetime'>
+            Greatest value of 'column_name' loaded so far
+        """
+        with self.engine.begin() as conn:
+            conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {WATERMARKS_TABLE} (
+                    table_name VARCHAR(64) PRIMARY KEY,
+                    column_name VARCHAR(64) NOT NULL,
+                    high_water_mark TIMESTAMP NOT NULL
+                )
+            """))
+            conn.execute(text(f"""
+                INSERT INTO {WATERMARKS_TABLE} (table_name, column_name, high_water_mark)
+                VALUES (:table_name, :column_name, :high_water_mark)
+                ON CONFLICT (table_name) DO UPDATE SET column_name = EXCLUDED.column_name, high_water_mark = EXCLUDED.high_water_mark
+            """), {'table_name': table_name, 'column_name': column_name, 'high_water_mark': high_water_mark})
+
+    def create_load_tables(self, df, table_name, num_partitions, partition_key=None, bounds=None):
+        """
+        Create the empty tables a partitioned load of 'table_name' is copied into, next to the current table:
+        '<table_name>_load', with the column types from TABLE_SCHEMAS and the types pandas infers for the other columns of 'df'.
+        The current table is only replaced once all the partitions are loaded, see swap_in_load_table
+
+        Without a 'partition_key' the load table is a plain table all the partitions are copied into.
+        With 'bounds', it is partitioned by RANGE on 'partition_key' and each partition is loaded into its own table
+        '<table_name>_load_<i>', with a CHECK constraint on its bounds so it can be attached without a scan (see attach_partitions).
+        A partition with the bounds None holds the rows with a null key, and is attached as the DEFAULT partition.
+        Otherwise it is partitioned by HASH on 'partition_key' into 'num_partitions' partitions, and PostgreSQL routes the rows
+
+        Parameters:
+        ----------
+        df: <class 'pandas.core.frame.DataFrame'>
+            DataFrame (e.g. a sample) with the columns of the cleaned rows
+
+        table_name: string
+            Name of the table being loaded
+
+        num_partitions: int
+            Number of partitions of the load
+
+        partition_key: string
+            Column the PostgreSQL table is partitioned on, None for a plain table
+
+        bounds: list of tuple
+            (lower, upper) bounds of the range of each partition, upper excluded, or None for the rows with a null key
+
+        Returns:
+        --------
+        list of string
+            Name of the table each partition is copied into
+        """
+        load_table = f"{table_name}_load"
+        template = f"{load_table}_template"
+        partition_tables = [f"{load_table}_{i}" for i in range(num_partitions)]
+
+        with self.engine.begin() as conn:
+            # Leftovers of an interrupted load
+            for name in [template, load_table] + partition_tables:
+                conn.execute(text(f'DROP TABLE IF EXISTS "{name}" CASCADE'))
+            df.head(0).to_sql(template, conn, index=False, dtype=self.__column_types(df, table_name))
+
+            if partition_key is None:
+                conn.execute(text(f'CREATE TABLE "{load_table}" (LIKE "{template}" INCLUDING DEFAULTS)'))
+                targets = [load_table] * num_partitions
+            elif bounds is not None:
+                conn.execute(text(f'CREATE TABLE "{load_table}" (LIKE "{template}" INCLUDING DEFAULTS) PARTITION BY RANGE ("{partition_key}")'))
+                for partition, partition_bounds in zip(partition_tables, bounds):
+                    if partition_bounds is None:
+                        check = f'"{partition_key}" IS NULL'
+                    else:
+                        check = f'"{partition_key}" IS NOT NULL AND "{partition_key}" >= {partition_bounds[0]} AND "{partition_key}" < {partition_bounds[1]}'
+                    conn.execute(text(f'CREATE TABLE "{partition}" (LIKE "{template}" INCLUDING DEFAULTS, CONSTRAINT "{partition}_bounds" CHECK ({check}))'))
+                targets = partition_tables
+            else:
+                conn.execute(text(f'CREATE TABLE "{load_table}" (LIKE "{template}" INCLUDING DEFAULTS) PARTITION BY HASH ("{partition_key}")'))
+                for i, partition in enumerate(partition_tables):
+                    conn.execute(text(f'CREATE TABLE "{partition}" PARTITION OF "{load_table}" FOR VALUES WITH (MODULUS {num_partitions}, REMAINDER {i})'))
+                targets = [load_table] * num_partitions
+
+            conn.execute(text(f'DROP TABLE "{template}"'))
+        return targets
+
+    def attach_partitions(self, table_name, bounds):
+        """
+        Attach the range partitions loaded into '<table_name>_load_<i>' to '<table_name>_load', in one transaction
+
+        The CHECK constraint each partition was created with proves its rows are within its bounds,
+        so ATTACH PARTITION doesn't scan them. The constraint is dropped once the partition is attached.
+        The partition of the rows with a null key is attached last, as the DEFAULT partition, since attaching a range
+        partition next to a DEFAULT partition scans it
+
+        Parameters:
+        ----------
+        table_name: string
+            Name of the table being loaded
+
+        bounds: list of tuple
+            (lower, upper) bounds of the range of each partition or None, as passed to create_load_tables
+        """
+        load_table = f"{table_name}_load"
+        # The partition with the bounds None is always the last one (see partitioned_load.partition_predicates)
+        with self.engine.begin() as conn:
+            for i, partition_bounds in enumerate(bounds):
+                partition = f"{load_table}_{i}"
+                values = 'DEFAULT' if partition_bounds is None else f'FOR VALUES FROM ({partition_bounds[0]}) TO ({partition_bounds[1]})'
+                conn.execute(text(f'ALTER TABLE "{load_table}" ATTACH PARTITION "{partition}" {values}'))
+                conn.execute(text(f'ALTER TABLE "{partition}" DROP CONSTRAINT "{partition}_bounds"'))
+
+    def swap_in_load_table(self, table_name, num_partitions=0):
+        """
+        Replace 'table_name' with the loaded '<table_name>_load' (see create_load_tables) in one transaction,
+        renaming its partitions to '<table_name>_<i>', then add the primary key and indexes from TABLE_SCHEMAS.
+        Queries see the previous table until the transaction commits.
+        As in upload_to_db, the foreign keys referencing the table and the views built on it must be dropped first
+
+        Parameters:
+        ----------
+        table_name: string
+            Name of the table being loaded
+
+        num_partitions: int
+            Number of partitions of the load table, 0 if it is a plain table
+        """
+        load_table = f"{table_name}_load"
+        with self.engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS "{table_name}"'))
+            conn.execute(text(f'ALTER TABLE "{load_table}" RENAME TO "{table_name}"'))
+            for i in range(num_partitions):
+                conn.execute(text(f'ALTER TABLE IF EXISTS "{load_table}_{i}" RENAME TO "{table_name}_{i}"'))
+            # A primary key of a partitioned table must include the partition key
+            self.__add_primary_key(conn, table_name)
+            self.__add_indexes(conn, table_name)
+
+    def copy_to_table(self, conn, df, table_name, chunksize=100000):
+        """
+        Stream the rows of 'df' into the existing table 'table_name' using COPY FROM STDIN
+
+        The DataFrame is written to an in-memory CSV buffer 'chunksize' rows at a time,
+        so the whole table is never serialised at once
+
+        Parameters:
+        ----------
+        conn: <class 'sqlalchemy.engine.base.Connection'>
+            Open connection (and transaction) to run the COPY on
+
+        df: <class 'pandas.core.frame.DataFrame'>
+            The DataFrame from which data will be copied
+
+        table_name: string
+            Name of the table to copy the data into, its columns must match the DataFrame columns
+
+        chunksize: int
+            Number of rows per COPY buffer
+        """
+        columns = ', '.join(f'"{column}"' for column in df.columns)
+        copy_sql = f"""COPY "{table_name}" ({columns}) FROM STDIN WITH (FORMAT CSV, NULL '\\N')"""
+
+        # psycopg2 cursor of the DBAPI connection underlying the SQLAlchemy connection
+        with conn.connection.cursor() as cursor:
+            for start in range(0, len(df), chunksize):
+                buffer = StringIO()
+                df.iloc[start:start + chunksize].to_csv(buffer, index=False, header=False, na_rep='\\N')
+                add_bytes(buffer.tell())
+                buffer.seek(0)
+                cursor.copy_expert(copy_sql, buffer)
+
+# One DatabaseConnector (and so one engine and connection pool) per credentials file for the life of the process
+_connectors = {}
+_connectors_lock = threading.Lock()
+
+def get_connector(creds_file_name:str, pool_size:int=5, max_overflow:int=10, pool_pre_ping:bool=True):
+    """
+    Return the shared DatabaseConnector for 'creds_file_name', creating it on first use
+
+    The pool options only apply when the connector is created, later calls return the existing connector
+
+    Parameters:
+    ----------
+    creds_file_name: string
+        Filename of the file to read DB Credentials from
+
+    pool_size: int
+        Number of connections kept open in the pool
+
+    max_overflow: int
+        Number of connections that can be opened beyond 'pool_size' when the pool is exhausted
+
+    pool_pre_ping: bool
+        If True, test connections for liveness when they are checked out of the pool
+
+    Returns:
+    --------
+    DatabaseConnector
+        The connector shared by all callers using the same credentials file
+    """
+    key = os.path.abspath(creds_file_name)
+
+    with _connectors_lock:
+        if key not in _connectors:
+            _connectors[key] = DatabaseConnector(creds_file_name, pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=pool_pre_ping)
+        return _connectors[key]
+
+def dispose_connectors():
+    """
+    Close the connection pools of all the shared connectors and forget them
+    """
+    with _connectors_lock:
+        for connector in _connectors.values():
+            connector.engine.dispose()
+        _connectors.clear()
 
 if __name__ == "__main__":
     dc = DatabaseConnector('db_creds_local.yaml')
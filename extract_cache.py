@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+class ExtractCache:
+    """
+    On-disk cache of the raw DataFrames extracted from each data source
+
+    Each entry is stored as a Parquet snapshot (or a pickle if the raw frame can't be written as Parquet)
+    with a JSON sidecar holding the source key, the time it was written and a validator.
+    The validator is anything that identifies the version of the source, e.g. an S3 ETag,
+    the Last-Modified header of a URL or the row count of a table.
+    An entry is used only if its validator matches the current one and, when a TTL is set, it is not older than the TTL
+    """
+    def __init__(self, cache_dir:str='.extract_cache', ttl:float=None, max_bytes:int=None, max_age:float=None) -> None:
+        """
+        Parameters:
+        ----------
+        cache_dir: string
+            Directory the snapshots are stored in, created if it does not exist
+
+        ttl: float
+            Time in seconds after which an entry is no longer used, None to use entries until their validator changes
+
+        max_bytes: int
+            If set, the oldest entries are evicted after each write until the cache is at most this size
+
+        max_age: float
+            If set, entries older than this many seconds are evicted after each write
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __entry_path(self, source_key:str):
+        """
+        Path of the entry for 'source_key', without extension
+        """
+        return os.path.join(self.cache_dir, hashlib.sha1(source_key.encode()).hexdigest())
+
+    def __read_meta(self, meta_path:str):
+        try:
+            with open(meta_path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, source_key:str, validator=None):
+        """
+        Return the cached DataFrame for 'source_key', or None if there is no valid entry
+
+        Parameters:
+        ----------
+        source_key: string
+            Key identifying the source, e.g. 's3://bucket/key'
+
+        validator:
+            JSON-serialisable value identifying the current version of the source, None if it can't be checked
+
+        Returns:
+        --------
+        <class 'pandas.core.frame.DataFrame'>
+            The cached raw DataFrame, or None
+        """
+        path = self.__entry_path(source_key)
+        meta = self.__read_meta(path + '.json')
+
+        if meta is None or meta['source'] != source_key or meta['validator'] != validator:
+            return None
+        if self.ttl is not None and time.time() - meta['created'] > self.ttl:
+            return None
+
+        try:
+            if meta['format'] == 'parquet':
+                return pd.read_parquet(path + '.parquet')
+            return pd.read_pickle(path + '.pkl')
+        except (OSError, ValueError):
+            return None
+
+    def put(self, source_key:str, df, validator=None):
+        """
+        Store the raw DataFrame 'df' for 'source_key' together with its validator
+
+        Parameters:
+        ----------
+        source_key: string
+            Key identifying the source
+
+        df: <class 'pandas.core.frame.DataFrame'>
+            Raw DataFrame extracted from the source
+
+        validator:
+            JSON-serialisable value identifying the version of the source 'df' was extracted from
+        """
+        path = self.__entry_path(source_key)
+
+        with self._lock:
+            self.__remove(path)
+            try:
+                df.to_parquet(path + '.parquet', index=True)
+                file_format = 'parquet'
+            except (ImportError, ValueError, TypeError):
+                # No Parquet engine installed, or columns with mixed types that Parquet can't store
+                if os.path.exists(path + '.parquet'):
+                    os.remove(path + '.parquet')
+                df.to_pickle(path + '.pkl')
+                file_format = 'pickle'
+
+            with open(path + '.json', 'w') as file:
+                json.dump({'source': source_key, 'created': time.time(), 'validator': validator,
+                           'rows': len(df), 'format': file_format}, file)
+
+        if self.max_bytes is not None or self.max_age is not None:
+            self.evict(max_bytes=self.max_bytes, max_age=self.max_age)
+
+    def cached(self, source_key:str, extract, validator=None, refresh:bool=False):
+        """
+        Return the cached DataFrame for 'source_key' if valid, otherwise call 'extract' and cache its result
+
+        Parameters:
+        ----------
+        source_key: string
+            Key identifying the source
+
+        extract: callable
+            Function with no arguments returning the raw DataFrame from the source
+
+        validator:
+            JSON-serialisable value identifying the current version of the source
+
+        refresh: bool
+            If True, ignore the cached entry and extract again
+
+        Returns:
+        --------
+        <class 'pandas.core.frame.DataFrame'>
+            The raw DataFrame
+        """
+        if not refresh:
+            df = self.get(source_key, validator)
+            if df is not None:
+                print(f"{source_key}: loaded from the extract cache")
+                return df
+
+        df = extract()
+        self.put(source_key, df, validator)
+        return df
+
+    def __entries(self):
+        """
+        List the entries in the cache as (path without extension, metadata, size in bytes)
+        """
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, file_name[:-len('.json')])
+            meta = self.__read_meta(path + '.json')
+            size = sum(os.path.getsize(path + ext) for ext in ('.json', '.parquet', '.pkl') if os.path.exists(path + ext))
+            entries.append((path, meta, size))
+        return entries
+
+    def __remove(self, path:str):
+        for ext in ('.json', '.parquet', '.pkl'):
+            if os.path.exists(path + ext):
+                os.remove(path + ext)
+
+    def evict(self, max_bytes:int=None, max_age:float=None):
+        """
+        Remove entries older than 'max_age' seconds, then the oldest entries until the cache is at most 'max_bytes'
+
+        Returns:
+        --------
+        int
+            Number of entries removed
+        """
+        with self._lock:
+            now = time.time()
+            # Oldest first, entries with unreadable metadata are treated as the oldest
+            entries = sorted(self.__entries(), key=lambda entry: entry[1]['created'] if entry[1] else 0)
+            total_bytes = sum(entry[2] for entry in entries)
+            removed = 0
+
+            for path, meta, size in entries:
+                too_old = max_age is not None and (meta is None or now - meta['created'] > max_age)
+                too_big = max_bytes is not None and total_bytes > max_bytes
+                if too_old or too_big:
+                    self.__remove(path)
+                    total_bytes -= size
+                    removed += 1
+            return removed
+
+    def clear(self):
+        """
+        Remove all the entries from the cache
+        """
+        with self._lock:
+            for path, _, _ in self.__entries():
+                self.__remove(path)
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,497 @@
+from contextlib import contextmanager
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the peak memory of the process is not recorded there
+    resource = None
+
+class StageRecord:
+    """
+    Measurements of one run of a pipeline stage
+
+    rows_in, rows_out and bytes can be set or added to while the stage runs (see add_rows and add_bytes).
+    If rows_in is never set, it is the number of rows returned by the stages nested in this one,
+    e.g. the rows extracted by the extract stage nested in a clean stage
+    """
+    def __init__(self, name:str, labels:dict) -> None:
+        self.name = name
+        self.labels = labels
+        self.started = time.time()
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.rows_in = None
+        self.rows_out = None
+        self.bytes = 0
+        # Peak of the memory allocated while the stage ran, only tracked with trace_memory
+        self.peak_memory_mb = None
+        # Peak resident memory of the whole process so far when the stage finished, a high-water mark of the process
+        # that stays the same for every stage after the largest one
+        self.process_peak_rss_mb = None
+        self.error = None
+        self.child_rows = None
+        # Set when the stage returned an iterator of chunks, the run is then recorded once the chunks are consumed
+        self.deferred = False
+
+    def as_dict(self):
+        return {'stage': self.name, 'labels': self.labels, 'started': self.started, 'seconds': round(self.seconds, 6),
+                'cpu_seconds': round(self.cpu_seconds, 6), 'rows_in': self.rows_in, 'rows_out': self.rows_out,
+                'bytes': self.bytes, 'peak_memory_mb': self.peak_memory_mb, 'process_peak_rss_mb': self.process_peak_rss_mb,
+                'error': self.error}
+
+def _peak_rss_mb():
+    """
+    Peak resident memory of the process so far in MB, None if it can't be read
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10, 1)
+
+def _count_rows(result):
+    """
+    Number of rows in a DataFrame or a list of DataFrames returned by a stage, None for anything else
+    """
+    if isinstance(result, pd.DataFrame):
+        return len(result)
+    if isinstance(result, list) and all(isinstance(item, pd.DataFrame) for item in result):
+        return sum(len(item) for item in result)
+    return None
+
+class Instrumentation:
+    """
+    Records the wall and CPU time, rows in and out, bytes and peak memory of each run of the pipeline stages
+
+    Stages are measured with the 'stage' context manager or the 'instrumented' decorator, which use the
+    active Instrumentation (see configure). Each finished stage is appended as a JSON line to 'jsonl_path',
+    and the totals per stage can be written in the Prometheus text format.
+    Stages can run on several threads at once, each thread has its own stack of nested stages.
+    CPU time is the time of the thread running the stage, which is where pandas does its work
+    """
+    def __init__(self, jsonl_path:str=None, prometheus_path:str=None, trace_memory:bool=False,
+                 profile:str=None, profile_dir:str='.profiles') -> None:
+        """
+        Parameters:
+        ----------
+        jsonl_path: string
+            File each finished stage is appended to as a JSON line, None to only keep the records in memory
+
+        prometheus_path: string
+            File the totals per stage are written to by write_prometheus, e.g. for the node_exporter textfile collector
+
+        trace_memory: bool
+            If True, record the peak of the memory allocated while each top-level stage ran, tracked with
+            tracemalloc (slower, and only meaningful when one stage runs at a time). Every stage records
+            the peak resident memory of the process when it finished either way, which is a process-wide high-water mark
+
+        profile: string
+            'cprofile' or 'pyinstrument' (needs pyinstrument) to profile every stage that is not nested in another one,
+            None not to profile. Only one profiler can run at a time, so a top-level stage starting while another one
+            is profiled is not profiled and is reported. process_and_upload.py runs one table job at a time when profiling
+
+        profile_dir: string
+            Directory the profiles are written to, one file per stage run
+        """
+        if profile not in (None, 'cprofile', 'pyinstrument'):
+            raise ValueError(f"Unknown profiler '{profile}', expected 'cprofile' or 'pyinstrument'")
+
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.records = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profile_count = 0
+        self._profiling = False
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def current(self):
+        """
+        The innermost stage running on this thread, or None
+        """
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def _running(self, record:StageRecord):
+        """
+        Add the time spent in the block to 'record', with 'record' as the current stage of the thread
+        """
+        stack = self._stack()
+        stack.append(record)
+        start, start_cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield record
+        finally:
+            record.seconds += time.perf_counter() - start
+            record.cpu_seconds += time.thread_time() - start_cpu
+            stack.pop()
+
+    def _finish(self, record:StageRecord, parent:StageRecord):
+        """
+        Complete 'record' once the stage is over, pass its rows on to its parent stage and write it out
+        """
+        if record.rows_in is None:
+            record.rows_in = record.child_rows
+        record.process_peak_rss_mb = _peak_rss_mb()
+        if parent is not None and record.rows_out is not None:
+            parent.child_rows = (parent.child_rows or 0) + record.rows_out
+
+        with self._lock:
+            self.records.append(record)
+            if self.jsonl_path is not None:
+                with open(self.jsonl_path, 'a') as file:
+                    file.write(json.dumps(record.as_dict(), default=str) + '\n')
+
+    @contextmanager
+    def _profiled(self, record:StageRecord, nested:bool):
+        """
+        Profile the block with the configured profiler, if any, and write the profile of 'record'
+        """
+        if self.profile is None or nested:
+            yield
+            return
+
+        # Only one profiler can be active in the process, stages starting on other threads meanwhile are not profiled
+        with self._lock:
+            if self._profiling:
+                profiling = False
+            else:
+                profiling = self._profiling = True
+                self._profile_count += 1
+                file_name = os.path.join(self.profile_dir, f"{self._profile_count:04d}_{record.name}")
+        if not profiling:
+            labels = ', '.join(f"{name}={value}" for name, value in record.labels.items())
+            print(f"Not profiling {record.name}" + (f" ({labels})" if labels else "") + ", another stage is being profiled")
+            yield
+            return
+
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            if self.profile == 'cprofile':
+                import cProfile
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+                    profiler.dump_stats(file_name + '.prof')
+            else:
+                from pyinstrument import Profiler
+                profiler = Profiler()
+                profiler.start()
+                try:
+                    yield
+                finally:
+                    profiler.stop()
+                    with open(file_name + '.html', 'w') as file:
+                        file.write(profiler.output_html())
+        finally:
+            self._profiling = False
+
+    @contextmanager
+    def stage(self, name:str, **labels):
+        """
+        Context manager measuring the block as a run of the stage 'name'
+
+        Parameters:
+        ----------
+        name: string
+            Name of the stage, e.g. 'clean.clean_store_data'
+
+        labels:
+            Labels of this run, e.g. table='dim_users'
+
+        Returns:
+        --------
+        StageRecord
+            The record of the run, to set rows_in, rows_out or bytes on
+        """
+        parent = self.current()
+        record = StageRecord(name, labels)
+        trace_memory = self.trace_memory and parent is None
+        if trace_memory:
+            tracemalloc.reset_peak()
+
+        try:
+            with self._profiled(record, nested=parent is not None), self._running(record):
+                yield record
+        except BaseException as e:
+            record.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if not record.deferred:
+                if trace_memory:
+                    record.peak_memory_mb = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+                self._finish(record, parent)
+
+    def chunks(self, name:str, chunks, record:StageRecord=None, **labels):
+        """
+        Generator measuring an iterator of DataFrame chunks as one run of the stage 'name'
+
+        Only the time spent producing the chunks is measured, not the time the consumer spends on them.
+        The rows of each chunk are passed on to the stage that asked for it, and the run is recorded
+        when the iterator is exhausted or closed
+
+        Parameters:
+        ----------
+        name: string
+            Name of the stage
+
+        chunks: iterable of <class 'pandas.core.frame.DataFrame'>
+            The chunks to measure
+
+        record: StageRecord
+            Record of the run to continue, e.g. of the call that returned the chunks, a new one by default
+        """
+        if record is None:
+            record = StageRecord(name, labels)
+        record.rows_out = record.rows_out or 0
+        iterator = iter(chunks)
+        try:
+            while True:
+                with self._running(record):
+                    try:
+                        chunk = next(iterator)
+                    except StopIteration:
+                        break
+                    except Exception as e:
+                        record.error = f"{type(e).__name__}: {e}"
+                        raise
+                    rows = _count_rows(chunk) or 0
+                    record.rows_out += rows
+                    # The chunks may be consumed far from where they were requested, e.g. cleaned chunks by the upload,
+                    # so the rows go to the stage consuming them rather than to the one that created the iterator
+                    stack = self._stack()
+                    consumer = stack[-2] if len(stack) > 1 else None
+                    if consumer is not None:
+                        consumer.child_rows = (consumer.child_rows or 0) + rows
+                yield chunk
+        finally:
+            self._finish(record, None)
+
+    def to_prometheus(self, prefix:str='etl_stage'):
+        """
+        Totals per stage and labels of the recorded runs, in the Prometheus text exposition format
+        """
+        totals = {}
+        with self._lock:
+            for record in self.records:
+                key = (record.name, tuple(sorted((name, str(value)) for name, value in record.labels.items())))
+                total = totals.setdefault(key, {'runs': 0, 'errors': 0, 'seconds': 0.0, 'cpu_seconds': 0.0,
+                                                'rows_in': 0, 'rows_out': 0, 'bytes': 0, 'peak_memory_bytes': 0,
+                                                'process_peak_rss_bytes': 0})
+                total['runs'] += 1
+                total['errors'] += record.error is not None
+                total['seconds'] += record.seconds
+                total['cpu_seconds'] += record.cpu_seconds
+                total['rows_in'] += record.rows_in or 0
+                total['rows_out'] += record.rows_out or 0
+                total['bytes'] += record.bytes
+                total['peak_memory_bytes'] = max(total['peak_memory_bytes'], int((record.peak_memory_mb or 0) * 2**20))
+                total['process_peak_rss_bytes'] = max(total['process_peak_rss_bytes'], int((record.process_peak_rss_mb or 0) * 2**20))
+
+        metrics = [('runs_total', 'counter', 'Number of runs of the stage'),
+                   ('errors_total', 'counter', 'Number of runs of the stage that failed'),
+                   ('seconds_total', 'counter', 'Wall time spent in the stage'),
+                   ('cpu_seconds_total', 'counter', 'CPU time spent in the stage'),
+                   ('rows_in_total', 'counter', 'Rows read by the stage'),
+                   ('rows_out_total', 'counter', 'Rows produced by the stage'),
+                   ('bytes_total', 'counter', 'Bytes read or written by the stage'),
+                   ('peak_memory_bytes', 'gauge', 'Peak memory allocated while the stage ran (tracemalloc, 0 if not traced)'),
+                   ('process_peak_rss_bytes', 'gauge', 'Peak resident memory of the process when a run of the stage finished')]
+        lines = []
+        for metric, metric_type, help_text in metrics:
+            field = metric[:-len('_total')] if metric.endswith('_total') else metric
+            lines.append(f"# HELP {prefix}_{metric} {help_text}")
+            lines.append(f"# TYPE {prefix}_{metric} {metric_type}")
+            for (name, labels), total in totals.items():
+                label_text = ','.join(f'{label}="{value}"' for label, value in (('stage', name),) + labels)
+                lines.append(f"{prefix}_{metric}{{{label_text}}} {total[field]}")
+        return '\n'.join(lines) + '\n'
+
+    def report(self):
+        """
+        Print the totals per stage of the recorded runs, slowest first
+        """
+        totals = {}
+        with self._lock:
+            for record in self.records:
+                total = totals.setdefault(record.name, {'runs': 0, 'seconds': 0.0, 'cpu_seconds': 0.0, 'rows_in': 0, 'rows_out': 0,
+                                                        'mb': 0.0, 'peak_memory_mb': 0.0, 'process_peak_rss_mb': 0.0})
+                total['runs'] += 1
+                total['seconds'] += record.seconds
+                total['cpu_seconds'] += record.cpu_seconds
+                total['rows_in'] += record.rows_in or 0
+                total['rows_out'] += record.rows_out or 0
+                total['mb'] += record.bytes / 2**20
+                total['peak_memory_mb'] = max(total['peak_memory_mb'], record.peak_memory_mb or 0)
+                total['process_peak_rss_mb'] = max(total['process_peak_rss_mb'], record.process_peak_rss_mb or 0)
+
+        # 'peak MB' is the memory allocated by the stage (with trace_memory), 'proc RSS MB' the process high-water mark
+        print(f"{'stage':<32} {'runs':>6} {'seconds':>9} {'cpu':>9} {'rows in':>10} {'rows out':>10} {'MB':>9} {'peak MB':>9} {'proc RSS MB':>11}")
+        for name, total in sorted(totals.items(), key=lambda item: -item[1]['seconds']):
+            print(f"{name:<32} {total['runs']:>6} {total['seconds']:>9.2f} {total['cpu_seconds']:>9.2f} {total['rows_in']:>10} "
+                  f"{total['rows_out']:>10} {total['mb']:>9.1f} {total['peak_memory_mb']:>9.1f} {total['process_peak_rss_mb']:>11.1f}")
+
+    def write_prometheus(self, path:str=None):
+        """
+        Write the totals per stage to 'path' (defaults to 'prometheus_path') in the Prometheus text format, atomically
+        """
+        path = path if path is not None else self.prometheus_path
+        if path is None:
+            return
+        with open(path + '.tmp', 'w') as file:
+            file.write(self.to_prometheus())
+        os.replace(path + '.tmp', path)
+
+# Instrumentation the stages are recorded with, None while instrumentation is off
+_active = None
+
+# Guards the counters of stages updated from several threads, see in_current_stage
+_counters_lock = threading.Lock()
+
+def configure(**options):
+    """
+    Turn the instrumentation on with the options of Instrumentation and return it
+
+    Returns:
+    --------
+    Instrumentation
+        The active instrumentation
+    """
+    global _active
+    _active = Instrumentation(**options)
+    return _active
+
+def get_instrumentation():
+    """
+    The active Instrumentation, None if the instrumentation is off
+    """
+    return _active
+
+@contextmanager
+def stage(name:str, **labels):
+    """
+    Context manager measuring the block as a run of the stage 'name' with the active instrumentation.
+    Yields the StageRecord, or None if the instrumentation is off
+    """
+    if _active is None:
+        yield None
+        return
+    with _active.stage(name, **labels) as record:
+        yield record
+
+def add_rows(rows_in:int=0, rows_out:int=0):
+    """
+    Add to the rows in and out of the stage running on this thread, if any
+    """
+    record = _active.current() if _active is not None else None
+    if record is not None:
+        with _counters_lock:
+            record.rows_in = (record.rows_in or 0) + rows_in
+            record.rows_out = (record.rows_out or 0) + rows_out
+
+def add_bytes(num_bytes:int):
+    """
+    Add to the bytes read or written by the stage running on this thread, if any
+    """
+    record = _active.current() if _active is not None else None
+    if record is not None and num_bytes:
+        with _counters_lock:
+            record.bytes += num_bytes
+
+def in_current_stage(function):
+    """
+    Wrap 'function' so that, when a thread pool calls it on its worker threads, the rows and bytes it records 
+    count towards the stage running on this thread. Returns 'function' as it is if no stage is running
+    """
+    instrumentation = _active
+    record = instrumentation.current() if instrumentation is not None else None
+    if record is None:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        stack = instrumentation._stack()
+        stack.append(record)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stack.pop()
+    return wrapper
+
+def count_chunks(chunks):
+    """
+    Generator passing DataFrame chunks through, counting their rows as rows in and out of the stage consuming them
+    """
+    for chunk in chunks:
+        add_rows(rows_in=len(chunk), rows_out=len(chunk))
+        yield chunk
+
+def instrumented(name:str, labels:tuple=()):
+    """
+    Decorator measuring each call of the function as a run of the stage 'name' with the active instrumentation
+
+    The rows out are counted from the returned DataFrame (or list of DataFrames), other results can count them
+    with add_rows. A returned iterator of chunks
+    is measured as it is consumed, so the time spent cleaning or loading chunks is not counted twice.
+    Without active instrumentation the function is called directly
+
+    Parameters:
+    ----------
+    name: string
+        Name of the stage
+
+    labels: tuple of string
+        Names of the arguments of the function whose values label each run, e.g. ('table_name',)
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            instrumentation = _active
+            if instrumentation is None:
+                return function(*args, **kwargs)
+
+            arguments = signature.bind(*args, **kwargs).arguments
+            run_labels = {label: arguments[label] for label in labels if arguments.get(label) is not None}
+
+            with instrumentation.stage(name, **run_labels) as record:
+                result = function(*args, **kwargs)
+                if inspect.isgenerator(result):
+                    # The chunks are produced as the caller consumes them, the run goes on until they are all consumed
+                    record.deferred = True
+                elif _count_rows(result) is not None:
+                    record.rows_out = _count_rows(result)
+
+            if record.deferred:
+                return instrumentation.chunks(name, result, record=record)
+            return result
+        return wrapper
+    return decorator
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,336 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import pandas as pd
+from sqlalchemy import create_engine
+import yaml
+
+from synthetic_data import DEFAULT_DIRT, generate_cards, generate_date_times, generate_orders, generate_products, generate_stores, generate_users
+
+class _LocalPaginator:
+    """
+    Paginator of LocalS3Client.list_objects_v2, returning all the objects in one page
+    """
+    def __init__(self, client) -> None:
+        self._client = client
+
+    def paginate(self, Bucket:str, Prefix:str=''):
+        yield self._client.list_objects_v2(Bucket=Bucket, Prefix=Prefix)
+
+class LocalS3Client:
+    """
+    Filesystem stand-in for the boto3 S3 client, serving the objects of each bucket from '<root_dir>/<bucket>/<key>'
+
+    It implements the calls DataExtractor makes (get_object with or without a Range, head_object,
+    list_objects_v2 and its paginator) plus put_object, so it can be passed as the 's3_client' of a DataExtractor.
+    The ETag of an object is derived from its size and modification time
+    """
+    def __init__(self, root_dir:str) -> None:
+        """
+        Parameters:
+        ----------
+        root_dir: string
+            Directory holding one sub-directory per bucket
+        """
+        self.root_dir = root_dir
+
+    def __path(self, bucket:str, key:str):
+        return os.path.join(self.root_dir, bucket, *key.split('/'))
+
+    def __etag(self, stat):
+        return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    def head_object(self, Bucket:str, Key:str):
+        stat = os.stat(self.__path(Bucket, Key))
+        return {'ETag': self.__etag(stat), 'ContentLength': stat.st_size, 'LastModified': stat.st_mtime}
+
+    def get_object(self, Bucket:str, Key:str, Range:str=None):
+        path = self.__path(Bucket, Key)
+        stat = os.stat(path)
+        if Range is None:
+            return {'Body': open(path, 'rb'), 'ContentLength': stat.st_size, 'ETag': self.__etag(stat)}
+
+        start, end = (int(value) for value in re.fullmatch(r'bytes=(\d+)-(\d+)', Range).groups())
+        with open(path, 'rb') as file:
+            file.seek(start)
+            part = file.read(end - start + 1)
+        return {'Body': io.BytesIO(part), 'ContentLength': len(part), 'ETag': self.__etag(stat)}
+
+    def put_object(self, Bucket:str, Key:str, Body):
+        path = self.__path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(Body.encode() if isinstance(Body, str) else Body)
+        return {'ETag': self.__etag(os.stat(path))}
+
+    def list_objects_v2(self, Bucket:str, Prefix:str='', **kwargs):
+        bucket_dir = os.path.join(self.root_dir, Bucket)
+        contents = []
+        for dir_path, _, file_names in os.walk(bucket_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                key = os.path.relpath(path, bucket_dir).replace(os.sep, '/')
+                if key.startswith(Prefix):
+                    stat = os.stat(path)
+                    contents.append({'Key': key, 'ETag': self.__etag(stat), 'Size': stat.st_size})
+        contents.sort(key=lambda obj: obj['Key'])
+        return {'Contents': contents, 'KeyCount': len(contents)}
+
+    def get_paginator(self, operation_name:str):
+        if operation_name != 'list_objects_v2':
+            raise ValueError(f"Unsupported paginator '{operation_name}'")
+        return _LocalPaginator(self)
+
+class _StoresRequestHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of StoresAPIServer, the server it belongs to is 'self.server.api'
+    """
+    # Keep-alive connections, as with the API Gateway. The headers and body are sent separately,
+    # so Nagle's algorithm would hold the body back until the client acknowledges the headers
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        api = self.server.api
+        status, payload = api.respond(self.path, self.headers.get('x-api-key'))
+        body = json.dumps(payload).encode()
+
+        etag = None
+        if api.etags and status == 200:
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                status, body = 304, b''
+                api.count_not_modified()
+
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+        if status != 304:
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StoresAPIServer:
+    """
+    Local HTTP server standing in for the stores API, serving '/number_stores' and '/store_details/{store_number}'
+
+    Every request waits 'latency' seconds (plus a random jitter) and fails with a 503 with probability 'error_rate',
+    so the concurrency and retries of DataExtractor.get_stores can be load-tested. The random failures and jitter
+    come from a seeded generator, so a run with one request at a time is reproducible
+    """
+    def __init__(self, stores, host:str='127.0.0.1', port:int=0, latency:float=0.0, jitter:float=0.0, error_rate:float=0.0,
+                 api_key:str=None, seed:int=0, etags:bool=False) -> None:
+        """
+        Parameters:
+        ----------
+        stores: <class 'pandas.core.frame.DataFrame'> or list of dict
+            Details of the stores, one row or dictionary per store number
+
+        host: string
+            Address to listen on
+
+        port: int
+            Port to listen on, 0 to pick a free port
+
+        latency: float
+            Seconds every request waits before it is answered
+
+        jitter: float
+            Maximum number of seconds added at random to the latency of each request
+
+        error_rate: float
+            Probability of a request failing with a 503 Service Unavailable
+
+        api_key: string
+            If given, requests without this 'x-api-key' header are refused with a 403
+
+        seed: int
+            Seed for the random failures and jitter
+
+        etags: bool
+            If True, store details are sent with an ETag and conditional requests with a matching
+            If-None-Match header are answered with 304 Not Modified. The stores API sends no ETags
+        """
+        if isinstance(stores, pd.DataFrame):
+            # Through JSON, so missing values become null as in the API responses
+            stores = json.loads(stores.to_json(orient='records'))
+        self.stores = stores
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.api_key = api_key
+        self.etags = etags
+        self.request_count = 0
+        self.error_count = 0
+        self.not_modified_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        Base URL of the running server, to pass as the 'stores_api_url' of a DataExtractor
+        """
+        return f"http://{self.host}:{self._server.server_port}"
+
+    def respond(self, path:str, api_key:str):
+        """
+        Status code and JSON payload of the response to a GET of 'path'
+        """
+        with self._lock:
+            self.request_count += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.error_count += 1
+        time.sleep(delay)
+
+        if self.api_key is not None and api_key != self.api_key:
+            return 403, {'message': 'Forbidden'}
+        if failed:
+            return 503, {'message': 'Service Unavailable'}
+        if path.rstrip('/').endswith('/number_stores'):
+            return 200, {'statusCode': 200, 'number_stores': len(self.stores)}
+
+        match = re.search(r'/store_details/(\d+)$', path)
+        if match and int(match.group(1)) < len(self.stores):
+            return 200, self.stores[int(match.group(1))]
+        return 404, {'message': 'Not Found'}
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified_count += 1
+
+    def start(self):
+        """
+        Start serving on a background thread
+        """
+        self._server = ThreadingHTTPServer((self.host, self.port), _StoresRequestHandler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the server and close its socket
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def write_local_sources(output_dir:str, num_rows:int, num_stores:int=451, seed:int=0, dirt:float=DEFAULT_DIRT, bucket_name:str='data-handling-public'):
+    """
+    Generate synthetic sources (see synthetic_data.py) and write them as local stand-ins for each data source:
+
+    - 's3/<bucket_name>/products.csv' and 'date_details.json', to serve with a LocalS3Client on '<output_dir>/s3'
+    - 'card_details.csv', read by DataExtractor.retrieve_pdf_data in place of the PDF
+    - 'rds.sqlite' with the 'legacy_users' and 'orders_table' tables, and 'db_creds_sqlite.yaml' pointing to it
+    - 'stores.json' with the store details served by StoresAPIServer, and 'api_creds.yaml' with its API key
+
+    Parameters:
+    ----------
+    output_dir: string
+        Directory the sources are written to, created if it does not exist
+
+    num_rows: int
+        Number of rows of each source except the stores
+
+    num_stores: int
+        Number of stores
+
+    seed: int
+        Seed for the generated sources
+
+    dirt: float
+        Share of the rows with each kind of dirt
+
+    bucket_name: string
+        Name of the bucket directory under '<output_dir>/s3'
+
+    Returns:
+    --------
+    dict
+        Paths of the written sources
+    """
+    output_dir = os.path.abspath(output_dir)
+    s3_dir = os.path.join(output_dir, 's3')
+    s3 = LocalS3Client(s3_dir)
+    paths = {'s3_root': s3_dir, 'card_details': os.path.join(output_dir, 'card_details.csv'),
+             'rds': os.path.join(output_dir, 'rds.sqlite'), 'rds_creds': os.path.join(output_dir, 'db_creds_sqlite.yaml'),
+             'stores': os.path.join(output_dir, 'stores.json'), 'api_creds': os.path.join(output_dir, 'api_creds.yaml')}
+    os.makedirs(output_dir, exist_ok=True)
+
+    s3.put_object(Bucket=bucket_name, Key='products.csv', Body=generate_products(num_rows, seed=seed, dirt=dirt).to_csv())
+    s3.put_object(Bucket=bucket_name, Key='date_details.json', Body=generate_date_times(num_rows, seed=seed, dirt=dirt).to_json())
+    pd.concat(generate_cards(num_rows, seed=seed, dirt=dirt), ignore_index=True).to_csv(paths['card_details'], index=False)
+    generate_stores(num_stores, seed=seed, dirt=dirt).to_json(paths['stores'], orient='records')
+
+    if os.path.exists(paths['rds']):
+        os.remove(paths['rds'])
+    engine = create_engine(f"sqlite:///{paths['rds']}")
+    try:
+        generate_users(num_rows, seed=seed, dirt=dirt).to_sql('legacy_users', engine, index=False, chunksize=100000)
+        generate_orders(num_rows, seed=seed, dirt=dirt).to_sql('orders_table', engine, index=False, chunksize=100000)
+    finally:
+        engine.dispose()
+
+    with open(paths['rds_creds'], 'w') as file:
+        yaml.safe_dump({'DATABASE_URL': f"sqlite:///{paths['rds']}"}, file)
+    with open(paths['api_creds'], 'w') as file:
+        yaml.safe_dump({'x-api-key': 'local'}, file)
+
+    return paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write local stand-ins for the data sources and serve the stores API until interrupted")
+    parser.add_argument('--dir', default='.local_sources', help="Directory the sources are written to")
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--stores', type=int, default=451)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dirt', type=float, default=DEFAULT_DIRT)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds every store request waits")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Maximum random seconds added to the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Probability of a store request failing with a 503")
+    parser.add_argument('--etags', action='store_true', help="Send ETags with the store details and answer conditional requests with 304")
+    args = parser.parse_args()
+
+    paths = write_local_sources(args.dir, args.rows, num_stores=args.stores, seed=args.seed, dirt=args.dirt)
+    with open(paths['stores'], 'r') as file:
+        stores = json.load(file)
+
+    with StoresAPIServer(stores, port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                         api_key='local', seed=args.seed, etags=args.etags) as server:
+        print(f"Stores API serving {len(stores)} stores on {server.url}, run the pipeline against the local sources with:")
+        print(f"python process_and_upload.py --stores-api-url {server.url} --api-creds {paths['api_creds']} "
+              f"--s3-root {paths['s3_root']} --card-details {paths['card_details']} --rds-creds {paths['rds_creds']}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print(f"Served {server.request_count} requests, {server.error_count} failed on purpose, {server.not_modified_count} not modified")
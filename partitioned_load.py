@@ -0,0 +1,178 @@
+from concurrent.futures import ProcessPoolExecutor
+import math
+import multiprocessing
+import os
+import pandas as pd
+import time
+
+from sqlalchemy import text
+
+from data_cleaning import DataCleaning
+from database_utils import DatabaseConnector, get_connector
+
+# Column the source is split on for each split: 'range' splits the integer 'index' column into ranges of equal width,
+# 'hash' splits the rows on a hash of 'date_uuid' (PostgreSQL sources only, it uses hashtext)
+PARTITION_KEYS = {'range': 'index', 'hash': 'date_uuid'}
+
+# Rows of the source cleaned to get the column types of the load tables
+SAMPLE_ROWS = 1000
+
+def partition_predicates(db_connector:DatabaseConnector, table_name:str, num_partitions:int, split:str='range'):
+    """
+    Split 'table_name' into partitions, each selected by a WHERE condition on its partition key (see PARTITION_KEYS)
+
+    Parameters:
+    ----------
+    db_connector: DatabaseConnector
+        Connector to the database holding the source table
+
+    table_name: string
+        Name of the source table
+
+    num_partitions: int
+        Number of partitions, the range split makes fewer if the key has fewer values
+
+    split: string
+        'range' or 'hash'
+
+    Returns:
+    --------
+    tuple
+        List of (where, params) per partition, and the (lower, upper) bounds of each range (None for the hash split).
+        The hash split puts the rows with a null key in the first partition, as PostgreSQL does. The range split puts them
+        in a last partition of their own with the bounds None, as they are in no range (it is the DEFAULT partition of a
+        partitioned table)
+    """
+    key = PARTITION_KEYS[split]
+
+    if split == 'hash':
+        predicates = [(f'mod(abs(hashtext(CAST("{key}" AS text))::bigint), :modulus) = :remainder'
+                       + (f' OR "{key}" IS NULL' if remainder == 0 else ''),
+                       {'modulus': num_partitions, 'remainder': remainder}) for remainder in range(num_partitions)]
+        return predicates, None
+    elif split != 'range':
+        raise ValueError(f"Unknown split '{split}', expected one of {list(PARTITION_KEYS)}")
+
+    with db_connector.engine.connect() as conn:
+        lowest, highest, num_nulls = conn.execute(text(f'SELECT MIN("{key}"), MAX("{key}"), COUNT(*) - COUNT("{key}") FROM "{table_name}"')).one()
+    lowest = int(lowest) if lowest is not None else 0
+    # Upper bounds are excluded
+    highest = int(highest) + 1 if highest is not None else lowest + 1
+
+    num_partitions = min(num_partitions, highest - lowest)
+    width = math.ceil((highest - lowest) / num_partitions)
+    bounds = [(lower, min(lower + width, highest)) for lower in range(lowest, highest, width)]
+
+    predicates = [(f'"{key}" >= :lower AND "{key}" < :upper', {'lower': lower, 'upper': upper}) for lower, upper in bounds]
+    if num_nulls:
+        predicates.append((f'"{key}" IS NULL', {}))
+        bounds.append(None)
+    return predicates, bounds
+
+def _load_partition(job:dict):
+    """
+    Extract, clean and COPY one partition of the source into its load table, in one transaction.
+    Runs in a worker process, with its own connections to the source and the target
+
+    Returns:
+    --------
+    dict
+        Result of the partition with keys 'partition', 'rows' and 'seconds'
+    """
+    start = time.perf_counter()
+    source = DatabaseConnector(job['source_creds'], pool_size=1, max_overflow=0)
+    target = DatabaseConnector(job['target_creds'], pool_size=1, max_overflow=0)
+    data_cleaning = DataCleaning(rds_connector=source, orders_key_dtype=job['orders_key_dtype'])
+    rows = 0
+
+    try:
+        df = data_cleaning.data_extractor.read_rds_partition(source, job['table_name'], job['where'], job['params'], chunksize=job['chunksize'])
+        chunks = [df] if isinstance(df, pd.DataFrame) else df
+        with target.engine.begin() as conn:
+            for chunk in data_cleaning.clean_orders_chunks(chunks):
+                target.copy_to_table(conn, chunk, job['load_table'])
+                rows += len(chunk)
+    finally:
+        source.engine.dispose()
+        target.engine.dispose()
+
+    return {'partition': job['partition'], 'rows': rows, 'seconds': time.perf_counter() - start}
+
+def load_orders_partitioned(source_creds:str, target_creds:str, num_partitions:int=None, split:str='range', partitioned_table:bool=False,
+                            max_workers:int=None, chunksize:int=None, orders_key_dtype:str='string', table_name:str='orders_table'):
+    """
+    Load 'orders_table' from the source into the target database in partitions, each extracted, cleaned
+    and COPY-loaded by its own worker process on its own connections, so the load uses a core and a connection per partition
+
+    The partitions are loaded next to the current table, which is swapped for the loaded table in one transaction once
+    all the partitions are loaded (see DatabaseConnector.create_load_tables). If a partition fails the current table is kept.
+    With 'partitioned_table', the table is a declaratively partitioned PostgreSQL table with a partition per source partition:
+    the range partitions are loaded as tables of their own and attached, the hash partitions are loaded through the parent table
+
+    Parameters:
+    ----------
+    source_creds: string
+        Credentials file of the database holding the source table
+
+    target_creds: string
+        Credentials file of the (local) PostgreSQL database the table is loaded into
+
+    num_partitions: int
+        Number of partitions, the number of CPUs by default
+
+    split: string
+        'range' or 'hash', see PARTITION_KEYS
+
+    partitioned_table: bool
+        If True, load into a table partitioned on the partition key instead of a plain table
+
+    max_workers: int
+        Number of partitions loaded at the same time, 'num_partitions' by default
+
+    chunksize: int
+        If given, each worker streams its partition in chunks of 'chunksize' rows
+
+    orders_key_dtype: string
+        Dtype of the foreign key columns while cleaning, see DataCleaning
+
+    table_name: string
+        Name of the source table and of the table it is loaded into
+
+    Returns:
+    --------
+    int
+        Number of rows loaded
+    """
+    start = time.perf_counter()
+    source = get_connector(source_creds)
+    target = get_connector(target_creds)
+    key = PARTITION_KEYS.get(split)
+
+    predicates, bounds = partition_predicates(source, table_name, num_partitions or os.cpu_count() or 1, split)
+    num_partitions = len(predicates)
+
+    with source.engine.connect() as conn:
+        sample = pd.read_sql_query(text(f'SELECT * FROM "{table_name}" LIMIT {SAMPLE_ROWS}'), conn)
+    sample = DataCleaning(rds_connector=source, orders_key_dtype=orders_key_dtype).clean_orders_frame(sample)
+    load_tables = target.create_load_tables(sample, table_name, num_partitions, partition_key=key if partitioned_table else None,
+                                            bounds=bounds if partitioned_table else None)
+
+    jobs = [{'partition': i, 'source_creds': source_creds, 'target_creds': target_creds, 'table_name': table_name, 'where': where,
+             'params': params, 'load_table': load_table, 'chunksize': chunksize, 'orders_key_dtype': orders_key_dtype}
+            for i, ((where, params), load_table) in enumerate(zip(predicates, load_tables))]
+
+    # Workers are spawned rather than forked, a forked worker would share the parent's pooled connections and the locks
+    # held by its other threads
+    rows = 0
+    with ProcessPoolExecutor(max_workers=max_workers or num_partitions, mp_context=multiprocessing.get_context('spawn')) as executor:
+        for result in executor.map(_load_partition, jobs):
+            print(f"{table_name} partition {result['partition']}: {result['rows']} rows in {result['seconds']:.2f}s")
+            rows += result['rows']
+
+    if partitioned_table and bounds is not None:
+        target.attach_partitions(table_name, bounds)
+    target.swap_in_load_table(table_name, num_partitions if partitioned_table else 0)
+
+    elapsed = time.perf_counter() - start
+    print(f"{table_name}: loaded {rows} rows in {num_partitions} {split} partitions in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s)")
+    return rows
@@ -1,16 +1,113 @@
-from data_cleaning import DataCleaning
-from database_utils import DatabaseConnector
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import importlib.util
+import os
+import pandas as pd
+import time
+
+from analysis import build_summaries, drop_summaries
+from data_cleaning import CARD_DETAILS_PDF, RDS_CREDS_FILE, S3_BUCKET, DataCleaning
+from data_extraction import STORES_API_URL, DataExtractor
+from data_quality import DataQuality
+from database_utils import DatabaseConnector, get_connector, TABLE_NATURAL_KEYS, TABLE_SCHEMAS
+from extract_cache import ExtractCache
+from instrumentation import configure, get_instrumentation, stage
+from partitioned_load import load_orders_partitioned
+
+# Tables uploaded to the local DB, in the order they are reported
+TABLE_NAMES = ['dim_users', 'dim_card_details', 'dim_store_details', 'dim_products', 'orders_table', 'dim_date_times']
+
+# Date column tracked as the high-water mark of each table in the incremental load mode
+# Only rows on or after the high-water mark of the previous load are uploaded for these tables. The columns are dates, so rows
+# on the high-water mark date are uploaded again in case more of them arrived after the previous load (the upsert is idempotent)
+TABLE_WATERMARK_COLUMNS = {
+    'dim_users': 'join_date',
+    'dim_card_details': 'date_payment_confirmed',
+    'dim_products': 'date_added',
+}
+
+def describe_run(table_names:list, data_cleaning:DataCleaning, local_db_creds:str, s3_local:bool=False, chunksize:int=None, mode:str='replace',
+                 quarantine_dir:str=None):
+    """
+    Print the source, the packages and the credentials files each table job needs, and the upload it would do,
+    without extracting anything or connecting to any database (used by --dry-run)
+
+    Parameters:
+    ----------
+    table_names: list of str
+        Tables to process
+
+    data_cleaning: DataCleaning
+        Instance of the DataCleaning class, with the DataExtractor and the source locations of the run
+
+    local_db_creds: str
+        Credentials file of the local DB
+
+    s3_local: bool
+        True if the S3 objects are served by a local client instead of boto3
+
+    chunksize: int
+        Chunk size for streaming the RDS tables, see upload_tables_to_local_db
+
+    mode: str
+        'replace' or 'incremental', see upload_tables_to_local_db
+
+    quarantine_dir: str
+        Directory the rows failing the validity rules are written to, if any
+
+    Returns:
+    -------
+    list of str
+        The packages and files that are needed but missing
+    """
+    data_extractor = data_cleaning.data_extractor
+    rds = (f"RDS ({data_cleaning.rds_creds_file})", ['sqlalchemy'], [data_cleaning.rds_creds_file])
+    card_details = data_cleaning.card_details_pdf
+    s3_packages = [] if s3_local else ['boto3']
+    sources = {
+        'dim_users': rds,
+        'dim_card_details': (card_details, [] if card_details.endswith('.csv') else 
+                             ['tabula'] + (['requests'] if card_details.startswith(('http://', 'https://')) else [])
+                             + (['pypdf'] if data_extractor.pdf_workers > 1 else []), []),
+        'dim_store_details': (data_extractor.stores_api_url, ['requests'], [data_extractor.api_creds_file] if data_extractor.api_creds_file else []),
+        'dim_products': (f"s3://{data_cleaning.bucket_name}/products.csv", s3_packages, []),
+        'orders_table': rds,
+        'dim_date_times': (f"s3://{data_cleaning.bucket_name}/date_details.json", s3_packages, []),
+    }
+
+    missing = [] if os.path.exists(local_db_creds) else [local_db_creds]
+    for table_name in table_names:
+        source, packages, files = sources[table_name]
+        missing_here = [package for package in packages if importlib.util.find_spec(package) is None]
+        missing_here += [file for file in files if not os.path.exists(file)]
+        missing.extend(item for item in missing_here if item not in missing)
+
+        upload = mode if mode == 'replace' or table_name in TABLE_NATURAL_KEYS else 'replace (no natural key)'
+        if chunksize is not None and source is rds:
+            upload += f", in chunks of {chunksize} rows"
+        print(f"{table_name:<20} {source}")
+        print(f"{'':<20} needs {', '.join(packages + files) or 'no other packages'}, uploads with {upload}"
+              + (f"  MISSING {', '.join(missing_here)}" if missing_here else ""))
+
+    if quarantine_dir is not None:
+        parquet = any(importlib.util.find_spec(engine) is not None for engine in ('pyarrow', 'fastparquet'))
+        print(f"Quarantined rows go to {quarantine_dir} as " + ("Parquet files" if parquet else "pickles, no Parquet engine (pyarrow) is installed"))
+
+    print(f"Dry run of {len(table_names)} table(s) into the local DB ({local_db_creds})" 
+          + (f", missing: {', '.join(missing)}" if missing else ", nothing missing"))
+    return missing
 
 def get_db_tables_from_aws_rds():
     """
     Function to use the DatabaseConnector to connect to the RDS instance on AWS 
     and fetch the list of tables in it
     """
-    dbconn = DatabaseConnector('db_creds.yaml')
+    dbconn = get_connector('db_creds.yaml')
     print(dbconn.list_db_tables())
 
 
-def upload_tables_to_local_db(table_name:str, db_connector:DatabaseConnector, data_cleaning:DataCleaning):
+def upload_tables_to_local_db(table_name:str, db_connector:DatabaseConnector, data_cleaning:DataCleaning, chunksize:int=None, mode:str='replace',
+                              orders_partitioning:dict=None):
     """
     Method used to extract data from various sources, clean it and then upload it
     to corresponding tables in the local instance of Postgres DB
@@ -26,42 +123,295 @@ def upload_tables_to_local_db(table_name:str, db_connector:DatabaseConnector, da
     data_cleaning: DataCleaning
         Instance of the DataCleaning class to call the cleaning methods 
         corresponding to each data source
+
+    chunksize: int
+        If given, the RDS tables ('dim_users' and 'orders_table') are streamed through 
+        extract, clean and upload in chunks of 'chunksize' rows, to keep memory bounded
+
+    mode: str
+        'replace' to reload the whole table (default). 'incremental' to upsert the rows on the table's
+        natural key, skipping rows dated before the table's high-water mark (see TABLE_WATERMARK_COLUMNS).
+        Rows on the high-water mark date are upserted again.
+        Tables without a natural key (orders_table) are always replaced
+
+    orders_partitioning: dict
+        If given, 'orders_table' is loaded in partitions by parallel worker processes, with these options of
+        load_orders_partitioned (num_partitions, split, partitioned_table), see partitioned_load.py
+
+    Returns:
+    -------
+    int
+        Number of rows uploaded to 'table_name'
     """
 
     match table_name:
         case 'dim_users':
-            df_users = data_cleaning.clean_user_data()
-            db_connector.upload_to_db(df_users, 'dim_users')
+            df_users = data_cleaning.clean_user_data(chunksize=chunksize)
+            return _upload_and_count(db_connector, df_users, 'dim_users', mode)
 
         case 'dim_card_details':
             df_cards = data_cleaning.clean_card_data()
-            db_connector.upload_to_db(df_cards, 'dim_card_details')
+            return _upload_and_count(db_connector, df_cards, 'dim_card_details', mode)
 
         case 'dim_store_details':
-            df_stores = data_cleaning.clean_store_data()
-            db_connector.upload_to_db(df_stores, 'dim_store_details')
+            # With a store sync, only the stores that are new or changed since the last sync are upserted,
+            # and the sync is saved once they are uploaded. Stores failing the validity rules are not upserted,
+            # so they are not saved as synced and come back as changed next time
+            changed_only = mode == 'incremental' and getattr(data_cleaning.data_extractor, 'store_sync', None) is not None
+            df_stores = data_cleaning.clean_store_data(changed_only=changed_only)
+            num_rows = _upload_and_count(db_connector, df_stores, 'dim_store_details', mode)
+            if changed_only:
+                data_cleaning.data_extractor.commit_store_sync(df_stores.index)
+            return num_rows
 
         case 'dim_products':
             df_products = data_cleaning.clean_products_data()
-            db_connector.upload_to_db(df_products, 'dim_products')
+            return _upload_and_count(db_connector, df_products, 'dim_products', mode)
 
         case 'orders_table':
-            df_orders = data_cleaning.clean_orders_data()
-            db_connector.upload_to_db(df_orders, 'orders_table')
+            if orders_partitioning is not None:
+                # Each partition is extracted, cleaned and loaded by its own process, on its own connections
+                return load_orders_partitioned(data_cleaning.rds_creds_file, db_connector.creds_file_name, chunksize=chunksize,
+                                               orders_key_dtype=data_cleaning.orders_key_dtype, **orders_partitioning)
+            df_orders = data_cleaning.clean_orders_data(chunksize=chunksize)
+            return _upload_and_count(db_connector, df_orders, 'orders_table', mode)
 
         case 'dim_date_times':
             df_timedetails = data_cleaning.clean_time_detail()
-            db_connector.upload_to_db(df_timedetails, 'dim_date_times')
+            return _upload_and_count(db_connector, df_timedetails, 'dim_date_times', mode)
+
+        case _:
+            raise ValueError(f"Unknown table '{table_name}', expected one of {TABLE_NAMES}")
+
+def _upload_and_count(db_connector:DatabaseConnector, df, table_name:str, mode:str):
+    """
+    Upload 'df' (a DataFrame or an iterator of DataFrame chunks) to 'table_name' and return the number of rows uploaded
+
+    In the 'incremental' mode, rows are filtered on the table's high-water mark before the upload
+    and the new high-water mark is recorded once the upload has succeeded
+    """
+    chunks = [df] if isinstance(df, pd.DataFrame) else df
+
+    incremental = mode == 'incremental'
+    if incremental and table_name not in TABLE_NATURAL_KEYS:
+        print(f"{table_name}: no natural key to upsert on, replacing the whole table")
+        incremental = False
+
+    watermark_column = TABLE_WATERMARK_COLUMNS.get(table_name) if incremental else None
+    high_water_mark = db_connector.get_watermark(table_name) if watermark_column else None
+    new_high_water_mark = high_water_mark
+    num_rows = 0
+
+    def new_rows(chunks):
+        nonlocal num_rows, new_high_water_mark
+        for chunk in chunks:
+            if watermark_column:
+                # Rows without a valid date can't be compared to the high-water mark, so they are always upserted
+                if high_water_mark is not None:
+                    chunk = chunk[chunk[watermark_column].isna() | (chunk[watermark_column] >= high_water_mark)]
+                chunk_max = chunk[watermark_column].max()
+                if pd.notna(chunk_max) and (new_high_water_mark is None or chunk_max > new_high_water_mark):
+                    new_high_water_mark = chunk_max
+            num_rows += len(chunk)
+            yield chunk
+
+    db_connector.upload_to_db(new_rows(chunks), table_name, mode='upsert' if incremental else 'replace')
+
+    if watermark_column and new_high_water_mark is not None:
+        # The high-water mark is still the recorded datetime if no row was after it
+        db_connector.set_watermark(table_name, watermark_column, pd.Timestamp(new_high_water_mark).to_pydatetime())
+    return num_rows
+
+def run_table_job(table_name:str, db_connector:DatabaseConnector, data_cleaning:DataCleaning, chunksize:int=None, mode:str='replace',
+                  orders_partitioning:dict=None):
+    """
+    Run extract -> clean -> upload for one table, catching any failure so the other tables still run
+
+    Returns:
+    -------
+    dict
+        Result of the job with keys 'table', 'rows', 'seconds' and 'error' (None if the job succeeded)
+    """
+    start = time.perf_counter()
+    rows, error = None, None
+    with stage('table', table=table_name) as record:
+        try:
+            rows = upload_tables_to_local_db(table_name, db_connector, data_cleaning, chunksize=chunksize, mode=mode,
+                                             orders_partitioning=orders_partitioning)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        if record is not None:
+            record.rows_out, record.error = rows, error
+    return {'table': table_name, 'rows': rows, 'seconds': time.perf_counter() - start, 'error': error}
+
+def run_pipeline(table_names:list, db_connector:DatabaseConnector, data_cleaning:DataCleaning, max_workers:int=6, chunksize:int=None, mode:str='replace',
+                 orders_partitioning:dict=None):
+    """
+    Run the table jobs concurrently on a thread pool and print a per-table report
+
+    The tables come from independent sources (RDS, PDF, the stores API and S3), so their jobs can overlap.
+    A failing table is reported and does not stop the others
+
+    Parameters:
+    ----------
+    table_names: list of str
+        Tables to process
+
+    db_connector: DatabaseConnector
+        Instance of DatabaseConnector to connect to the local DB
+
+    data_cleaning: DataCleaning
+        Instance of the DataCleaning class to call the cleaning methods
+
+    max_workers: int
+        Number of table jobs run at the same time, 1 runs them one after another
+
+    chunksize: int
+        Chunk size for streaming the RDS tables, see upload_tables_to_local_db
+
+    mode: str
+        'replace' or 'incremental', see upload_tables_to_local_db
+
+    orders_partitioning: dict
+        Options of the partitioned load of 'orders_table', see upload_tables_to_local_db
+
+    Returns:
+    -------
+    list of dict
+        Result of each table job, in the order of 'table_names'
+    """
+    start = time.perf_counter()
+
+    # Tables are replaced without CASCADE: dropping the foreign keys and views that depend on them inside each job
+    # would lock the tables the other jobs are replacing at the same time. They are dropped once here instead, 
+    # and built again once all the tables are loaded
+    replaced = [table_name for table_name in table_names if mode == 'replace' or table_name not in TABLE_NATURAL_KEYS]
+    if replaced:
+        with stage('drop_dependents'):
+            try:
+                dropped = db_connector.drop_foreign_keys(replaced) + drop_summaries(db_connector)
+                if dropped:
+                    print(f"Dropped {', '.join(dropped)} before replacing {', '.join(replaced)}")
+            except Exception as e:
+                print(f"Could not drop the foreign keys and summary views ({type(e).__name__}: {e})")
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = list(executor.map(lambda table_name: run_table_job(table_name, db_connector, data_cleaning, chunksize, mode, orders_partitioning),
+                                    table_names))
+
+    # Build the foreign keys once all the tables are loaded
+    with stage('foreign_keys'):
+        for table_name, schema in TABLE_SCHEMAS.items():
+            if schema.get('foreign_keys'):
+                try:
+                    added = db_connector.add_foreign_keys(table_name)
+                    if added:
+                        print(f"{table_name}: added foreign keys {', '.join(added)}")
+                except Exception as e:
+                    print(f"{table_name}: could not add foreign keys ({type(e).__name__}: {e})")
+
+    # Rebuild the summary views the analysis queries read from
+    with stage('summaries'):
+        try:
+            build_summaries(db_connector)
+        except Exception as e:
+            print(f"Could not build the summary views ({type(e).__name__}: {e})")
+
+    for result in results:
+        if result['error'] is None:
+            print(f"{result['table']:<20} {result['rows']:>10} rows {result['seconds']:>8.2f}s")
+        else:
+            print(f"{result['table']:<20} {'FAILED':>10} {result['seconds']:>13.2f}s  {result['error']}")
+    print(f"Pipeline finished in {time.perf_counter() - start:.2f}s, {sum(result['error'] is not None for result in results)} table(s) failed")
+    data_cleaning.data_quality.report()
+
+    instrumentation = get_instrumentation()
+    if instrumentation is not None:
+        instrumentation.report()
+        instrumentation.write_prometheus()
+
+    return results
 
 if __name__ == "__main__":
-    
-    data_cleaning = DataCleaning()
-    db_conn_local = DatabaseConnector('db_creds_local.yaml')
+    parser = argparse.ArgumentParser(description="Extract, clean and upload the tables to the local PostgreSQL instance")
+    parser.add_argument('--tables', nargs='+', choices=TABLE_NAMES, default=TABLE_NAMES, help="Tables to process, all by default")
+    parser.add_argument('--workers', type=int, default=len(TABLE_NAMES), help="Number of tables processed at the same time")
+    parser.add_argument('--chunksize', type=int, default=None, help="Stream the RDS tables in chunks of this many rows")
+    parser.add_argument('--mode', choices=['replace', 'incremental'], default='replace', 
+                        help="Reload the tables, or upsert only the rows dated on or after the last load's high-water mark")
+    parser.add_argument('--orders-keys', choices=['string', 'category'], default='string',
+                        help="Dtype of the foreign keys of orders_table while cleaning, 'category' to dictionary-encode them")
+    parser.add_argument('--cache-dir', default=None, help="Cache the raw extracts of each source in this directory and reuse them while the source is unchanged")
+    parser.add_argument('--cache-ttl', type=float, default=None, help="Seconds after which a cached extract is extracted again")
+    parser.add_argument('--refresh-cache', action='store_true', help="Extract every source again and refresh the cache")
+    parser.add_argument('--orders-partitions', type=int, default=None, 
+                        help="Load orders_table in this many partitions, each extracted, cleaned and loaded by its own process")
+    parser.add_argument('--orders-split', choices=['range', 'hash'], default='range',
+                        help="Split orders_table into ranges of its index, or on a hash of date_uuid (PostgreSQL sources only)")
+    parser.add_argument('--orders-partitioned-table', action='store_true', 
+                        help="Load orders_table into a PostgreSQL table partitioned like the source split")
+    parser.add_argument('--store-sync-dir', default=None, 
+                        help="Sync the store details with conditional requests, keeping the last payload of each store in this directory. "
+                             "With --mode incremental only the new and changed stores are cleaned and upserted")
+    # Source endpoints, to run against local stand-ins of the sources (see local_sources.py)
+    parser.add_argument('--stores-api-url', default=STORES_API_URL, help="Base URL of the stores API")
+    parser.add_argument('--api-creds', default='api_creds.yaml', help="Credentials file with the API key of the stores API")
+    parser.add_argument('--s3-endpoint-url', default=None, help="Endpoint of an S3-compatible service, e.g. a moto server")
+    parser.add_argument('--s3-root', default=None, help="Serve the S3 objects from this local directory, one sub-directory per bucket")
+    parser.add_argument('--bucket', default=S3_BUCKET, help="S3 bucket holding products.csv and date_details.json")
+    parser.add_argument('--pdf-workers', type=int, default=1, 
+                        help="Parse the card details PDF in page ranges on this many processes (needs pypdf), 1 parses it in one call")
+    parser.add_argument('--card-details', default=CARD_DETAILS_PDF, help="Link or path to the card details PDF, or a CSV standing in for it")
+    parser.add_argument('--rds-creds', default=RDS_CREDS_FILE, help="Credentials file of the database holding the RDS tables")
+    # Rows failing the validity rules of their table, see data_quality.py
+    parser.add_argument('--quarantine-dir', default=None, help="Write the rows failing the validity rules to Parquet files (pickles without pyarrow) in this directory")
+    parser.add_argument('--quarantine-db', action='store_true', help="Append the rows failing the validity rules to <table>_quarantine tables in the local DB")
+    # Per-stage metrics, see instrumentation.py
+    parser.add_argument('--metrics-jsonl', default=None, help="Append a JSON line per pipeline stage run to this file")
+    parser.add_argument('--metrics-prom', default=None, help="Write the totals per stage to this file in the Prometheus text format")
+    parser.add_argument('--trace-memory', action='store_true', help="Record the peak memory allocated in each stage with tracemalloc, slows the pipeline down")
+    parser.add_argument('--profile', choices=['cprofile', 'pyinstrument'], default=None,
+                        help="Profile each table job with this profiler, the tables are then processed one at a time")
+    parser.add_argument('--profile-dir', default='.profiles', help="Directory the profiles are written to")
+    parser.add_argument('--dry-run', action='store_true', 
+                        help="Print what each table job would extract and upload, and check its packages and credentials files, without running it")
+    args = parser.parse_args()
+
+    # Only one profiler can run in the process, so every table job is profiled only if they run one after another
+    if args.profile and args.workers > 1:
+        print(f"--profile runs one table job at a time instead of {args.workers}")
+        args.workers = 1
+
+    if args.metrics_jsonl or args.metrics_prom or args.trace_memory or args.profile:
+        configure(jsonl_path=args.metrics_jsonl, prometheus_path=args.metrics_prom, trace_memory=args.trace_memory,
+                  profile=args.profile, profile_dir=args.profile_dir)
+
+    s3_client = None
+    if args.s3_root:
+        from local_sources import LocalS3Client
+        s3_client = LocalS3Client(args.s3_root)
+
+    cache = ExtractCache(args.cache_dir, ttl=args.cache_ttl) if args.cache_dir else None
+    data_extractor = DataExtractor(cache=cache, refresh_cache=args.refresh_cache, stores_api_url=args.stores_api_url, api_creds_file=args.api_creds,
+                                   s3_endpoint_url=args.s3_endpoint_url, s3_client=s3_client, store_sync_dir=args.store_sync_dir,
+                                   pdf_workers=args.pdf_workers)
+    data_cleaning = DataCleaning(data_extractor=data_extractor, orders_key_dtype=args.orders_keys, rds_creds_file=args.rds_creds,
+                                 bucket_name=args.bucket, card_details_pdf=args.card_details)
+
+    if args.dry_run:
+        missing = describe_run(args.tables, data_cleaning, 'db_creds_local.yaml', s3_local=s3_client is not None, 
+                               chunksize=args.chunksize, mode=args.mode, quarantine_dir=args.quarantine_dir)
+        raise SystemExit(1 if missing else 0)
+
+    # One pooled engine for the local DB, with a connection per concurrent table job
+    db_conn_local = get_connector('db_creds_local.yaml', pool_size=args.workers)
+    data_cleaning.data_quality = DataQuality(quarantine_dir=args.quarantine_dir, quarantine_connector=db_conn_local if args.quarantine_db else None)
 
-    upload_tables_to_local_db('dim_users', db_conn_local, data_cleaning)
-    upload_tables_to_local_db('dim_card_details', db_conn_local, data_cleaning)
-    upload_tables_to_local_db('dim_store_details', db_conn_local, data_cleaning)
-    upload_tables_to_local_db('dim_products', db_conn_local, data_cleaning)
-    upload_tables_to_local_db('orders_table', db_conn_local, data_cleaning)
-    upload_tables_to_local_db('dim_date_times', db_conn_local, data_cleaning)
+    orders_partitioning = None
+    if args.orders_partitions:
+        orders_partitioning = {'num_partitions': args.orders_partitions, 'split': args.orders_split, 'partitioned_table': args.orders_partitioned_table}
 
+    results = run_pipeline(args.tables, db_conn_local, data_cleaning, max_workers=args.workers, chunksize=args.chunksize, mode=args.mode,
+                           orders_partitioning=orders_partitioning)
+    if any(result['error'] is not None for result in results):
+        raise SystemExit(1)
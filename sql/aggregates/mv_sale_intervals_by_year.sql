@@ -0,0 +1,23 @@
+-- Average time between consecutive sales in each year, behind task 9
+-- A single pass over the sales in (year, sale_timestamp) order, which the index on dim_date_times provides.
+-- Sales at the same time as the next one give a zero interval and are left out of the average,
+-- so the average is taken over the distinct sale times, as when grouping the rows by their time
+
+CREATE MATERIALIZED VIEW mv_sale_intervals_by_year AS
+SELECT
+	year,
+	AVG(diff) FILTER (WHERE diff > INTERVAL '0') AS actual_time_taken
+FROM (
+	SELECT
+		year,
+		LEAD(sale_timestamp) OVER (PARTITION BY year ORDER BY sale_timestamp) - sale_timestamp AS diff
+	FROM
+		dim_date_times
+	WHERE
+		sale_timestamp IS NOT NULL
+) AS sale_intervals
+GROUP BY
+	year;
+
+-- A unique index lets the view be refreshed CONCURRENTLY, without blocking the queries reading it
+CREATE UNIQUE INDEX mv_sale_intervals_by_year_year ON mv_sale_intervals_by_year (year);
@@ -0,0 +1,18 @@
+-- Sales per month of each year, behind tasks 3 and 6
+
+CREATE MATERIALIZED VIEW mv_sales_by_month AS
+SELECT
+	year,
+	month,
+	SUM(product_price * product_quantity) AS total_sales
+FROM
+	orders_table
+JOIN
+	dim_date_times on dim_date_times.date_uuid = orders_table.date_uuid
+JOIN
+	dim_products on dim_products.product_code = orders_table.product_code
+GROUP BY
+	year, month;
+
+-- A unique index lets the view be refreshed CONCURRENTLY, without blocking the queries reading it
+CREATE UNIQUE INDEX mv_sales_by_month_year_month ON mv_sales_by_month (year, month);
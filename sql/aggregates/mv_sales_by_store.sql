@@ -0,0 +1,23 @@
+-- Sales per store, behind tasks 4, 5 and 8
+-- Orders are joined to the products with a LEFT JOIN so that number_of_sales and product_quantity_count
+-- count every order of the store, as in task 4, while total_sales only sums the orders with a known price
+
+CREATE MATERIALIZED VIEW mv_sales_by_store AS
+SELECT
+	dim_store_details.store_code,
+	store_type,
+	country_code,
+	COUNT(orders_table.product_code) AS number_of_sales,
+	SUM(product_quantity) AS product_quantity_count,
+	SUM(product_price * product_quantity) AS total_sales
+FROM
+	orders_table
+JOIN
+	dim_store_details on dim_store_details.store_code = orders_table.store_code
+LEFT JOIN
+	dim_products on dim_products.product_code = orders_table.product_code
+GROUP BY
+	dim_store_details.store_code, store_type, country_code;
+
+-- A unique index lets the view be refreshed CONCURRENTLY, without blocking the queries reading it
+CREATE UNIQUE INDEX mv_sales_by_store_store_code ON mv_sales_by_store (store_code);
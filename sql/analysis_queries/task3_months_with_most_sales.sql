@@ -13,21 +13,18 @@
 -- +-------------+-------+
 
 SELECT 
-	ROUND(SUM(product_price * product_quantity)::NUMERIC, 2) AS total_sales, 
+	ROUND(SUM(total_sales)::NUMERIC, 2) AS total_sales, 
 	month
 FROM 
-	orders_table
-JOIN 
-	dim_products on dim_products.product_code = orders_table.product_code
-JOIN 
-	dim_date_times on dim_date_times.date_uuid = orders_table.date_uuid
+	mv_sales_by_month
 GROUP BY
 	month
 ORDER BY
 	total_sales DESC
 LIMIT
 	6;
-	
+
+
 -------- OUTPUT ---------
 
 -- 	"total_sales"	"month"
@@ -12,21 +12,20 @@
 -- 	+------------------+-------------------------+----------+
 
 SELECT
-	COUNT(orders_table.product_code) AS number_of_sales,
-	SUM(product_quantity) AS product_quantity_count,
+	SUM(number_of_sales) AS number_of_sales,
+	SUM(product_quantity_count) AS product_quantity_count,
 	CASE
 		WHEN store_type LIKE '%Web%' THEN 'Web'
 		ELSE 'Offline'
 	END AS location
 FROM 
-	orders_table
-JOIN 
-	dim_store_details on dim_store_details.store_code = orders_table.store_code
+	mv_sales_by_store
 GROUP BY 
 	location
 ORDER BY
-	location DESC
-	
+	location DESC;
+
+
 ----------- OUTPUT -----------
 
 -- 	"number_of_sales"	"product_quantity_count"	  "location"
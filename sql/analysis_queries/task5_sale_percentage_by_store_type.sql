@@ -18,13 +18,9 @@ WITH
 	cte_sales_by_store_type AS (
 		SELECT 
 			store_type,
-			ROUND( SUM( product_price * product_quantity )::NUMERIC, 2) AS total_sales
+			ROUND( SUM( total_sales )::NUMERIC, 2) AS total_sales
 		FROM 
-			orders_table
-		JOIN
-			dim_store_details on dim_store_details.store_code = orders_table.store_code
-		JOIN
-			dim_products on dim_products.product_code = orders_table.product_code
+			mv_sales_by_store
 		GROUP BY
 			store_type
 	), 
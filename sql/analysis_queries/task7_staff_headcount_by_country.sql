@@ -20,10 +20,10 @@ FROM
 GROUP BY
 	country_code
 ORDER BY
-	total_staff_numbers DESC
+	total_staff_numbers DESC;
 	
 ---------------- OUTPUT -------------------
-	"total_staff_numbers"	"country_code"
-			13307				"GB"
-			 6123				"DE"
-			 1384				"US"
\ No newline at end of file
+-- 	"total_staff_numbers"	"country_code"
+-- 			13307				"GB"
+-- 			 6123				"DE"
+-- 			 1384				"US"
\ No newline at end of file
@@ -14,25 +14,22 @@
 -- 	+--------------+-------------+--------------+
 
 SELECT
-	ROUND( SUM( product_price * product_quantity )::NUMERIC, 2) AS total_sales,
+	ROUND( SUM( total_sales )::NUMERIC, 2) AS total_sales,
 	store_type,
 	country_code
 FROM 
-	orders_table
-JOIN
-	dim_store_details on dim_store_details.store_code = orders_table.store_code
-JOIN
-	dim_products on dim_products.product_code = orders_table.product_code
+	mv_sales_by_store
 WHERE
-	dim_store_details.country_code = 'DE'
+	country_code = 'DE'
 GROUP BY
 	store_type, country_code
 ORDER BY
-	total_sales
+	total_sales;
+
 
 -------------------- OUTPUT ---------------------
- "total_sales"		"store_type"	"country_code"
-	198373.57		"Outlet"			"DE"
-	247634.20		"Mall Kiosk"		"DE"
-	384625.03		"Super Store"		"DE"
-	1109909.59		"Local"				"DE"
\ No newline at end of file
+--  "total_sales"		"store_type"	"country_code"
+-- 	198373.57		"Outlet"			"DE"
+-- 	247634.20		"Mall Kiosk"		"DE"
+-- 	384625.03		"Super Store"		"DE"
+-- 	1109909.59		"Local"				"DE"
\ No newline at end of file
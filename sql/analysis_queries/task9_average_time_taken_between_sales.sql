@@ -13,35 +13,17 @@
 -- 	 | 2008 | "hours": 2, "minutes": 13, "seconds": 2,  "millise... |
 -- 	 +------+-------------------------------------------------------+
 
-WITH 
-	cte_get_timestamp AS(
-		SELECT
-		year,
-		to_timestamp(CONCAT(year, '-', month, '-', day, ' ', timestamp), 'YYYY-MM-DD hh24:mi:ss')::timestamp as tt
-	FROM dim_date_times
-	GROUP BY
-		year, month, day, timestamp
-	ORDER BY
-		year, month, day DESC	
-	),
-	cte_time_diff As (
-	SELECT
-		year,
-		LEAD (tt) OVER( ORDER BY tt ) - tt AS diff
-		FROM cte_get_timestamp
-	)
 SELECT 	
 	year, 
-	AVG(diff) as actual_time_taken
+	actual_time_taken
 FROM
-	cte_time_diff
-GROUP BY
- 	year
+	mv_sale_intervals_by_year
 ORDER BY
  	actual_time_taken DESC
 LIMIT
 	5;
-	
+
+
 --------------- OUTPUT ---------------
 
 -- 	"year"	"actual_time_taken"
@@ -21,6 +21,8 @@ SELECT MAX(CHAR_LENGTH(product_code)) FROM orders_table;
 -- 11
 
 -- Set the data types for all columns
+-- NOTE: upload_to_db now creates orders_table with these types (TABLE_SCHEMAS in database_utils.py),
+--       so on a fresh load the ALTER COLUMN ... TYPE statements below change nothing and rewrite nothing
 
 -- Change data type of date_uuid to UUID
 ALTER TABLE orders_table
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+import pandas as pd
+
+class StoreSync:
+    """
+    On-disk state of the store details sync (see DataExtractor.sync_stores)
+
+    The state holds the last payload of each store with the SHA-256 of its content and the ETag the API sent with it,
+    in 'stores.json', and the table of all the stores normalised with pd.json_normalize, indexed by store number,
+    in 'stores.pkl'. The table is rebuilt from the payloads if it is missing, and the whole state is dropped
+    if it was synced from another API
+    """
+    def __init__(self, state_dir:str='.store_sync') -> None:
+        """
+        Parameters:
+        ----------
+        state_dir: string
+            Directory the state is stored in, created if it does not exist
+        """
+        self.state_dir = state_dir
+        self._stores_file = os.path.join(state_dir, 'stores.json')
+        self._table_file = os.path.join(state_dir, 'stores.pkl')
+        self._lock = threading.Lock()
+        os.makedirs(state_dir, exist_ok=True)
+
+    @staticmethod
+    def content_hash(content:bytes):
+        """
+        SHA-256 of the content of a response
+        """
+        return hashlib.sha256(content).hexdigest()
+
+    def load(self, api_url:str):
+        """
+        Load the state synced from 'api_url'
+
+        Returns:
+        --------
+        tuple
+            dict of {'hash', 'etag', 'payload'} per store number, and the normalised table of the stores
+            (None if there is no state for 'api_url')
+        """
+        try:
+            with open(self._stores_file, 'r') as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return {}, None
+        if state.get('api_url') != api_url:
+            return {}, None
+
+        stores = {int(store_number): entry for store_number, entry in state['stores'].items()}
+        try:
+            sync_id, table = pd.read_pickle(self._table_file)
+        except (OSError, ValueError, EOFError, TypeError):
+            sync_id, table = None, None
+        if sync_id != state.get('sync_id'):
+            table = self.normalise({store_number: entry['payload'] for store_number, entry in stores.items()})
+        return stores, table
+
+    def save(self, api_url:str, stores:dict, table):
+        """
+        Replace the state with the entries 'stores' and the table 'table' synced from 'api_url', each file atomically
+        """
+        # Both files carry the id of the sync they were saved by, a table saved by another sync is rebuilt
+        sync_id = uuid.uuid4().hex
+        with self._lock:
+            pd.to_pickle((sync_id, table), self._table_file + '.tmp')
+            with open(self._stores_file + '.tmp', 'w') as file:
+                json.dump({'api_url': api_url, 'sync_id': sync_id, 
+                           'stores': {str(store_number): entry for store_number, entry in stores.items()}}, file)
+            os.replace(self._table_file + '.tmp', self._table_file)
+            os.replace(self._stores_file + '.tmp', self._stores_file)
+
+    @staticmethod
+    def normalise(payloads:dict):
+        """
+        Normalise the store payloads, by store number, into a table indexed by store number
+        """
+        store_numbers = sorted(payloads)
+        table = pd.json_normalize([payloads[store_number] for store_number in store_numbers])
+        table.index = store_numbers
+        return table
+
+    def update_table(self, table, payloads:dict, store_numbers):
+        """
+        Rebuild the table of the stores 'store_numbers' from the previous 'table', normalising only the
+        stores in 'payloads' (new or changed, by store number)
+
+        Returns:
+        --------
+        <class 'pandas.core.frame.DataFrame'>
+            Table of the stores indexed by store number, in store number order
+        """
+        if table is None:
+            return self.normalise(payloads)
+
+        kept = table[table.index.isin(store_numbers) & ~table.index.isin(list(payloads))]
+        if not payloads:
+            return kept
+        return pd.concat([kept, self.normalise(payloads)]).sort_index()
@@ -0,0 +1,405 @@
+import argparse
+import string
+
+import numpy as np
+import pandas as pd
+
+# Share of the generated rows that are dirty by default, split between the kinds of dirt of each source
+DEFAULT_DIRT = 0.01
+
+# Formats of the dates in the sources, the first one is used for most rows and the others for the dirty ones
+DATE_FORMATS = ['%Y-%m-%d', '%Y/%m/%d', '%B %Y %d', '%Y %B %d']
+
+COUNTRIES = [('United Kingdom', 'GB'), ('Germany', 'DE'), ('United States', 'US')]
+FIRST_NAMES = np.array(['Sigfried', 'Guy', 'Harry', 'Darren', 'Garry', 'Sophie', 'Carol', 'Ida', 'Lena', 'Margaret', 'James', 'Mary'])
+LAST_NAMES = np.array(['Noack', 'Allen', 'Lawrence', 'Hussain', 'Stone', 'Jones', 'Evans', 'Schmidt', 'Becker', 'Smith', 'Brown'])
+COMPANIES = np.array(['Heydrich Junitz KG', 'Fox Ltd', 'Johnson, Jones and Harris', 'Klein GmbH', 'Cook LLC', 'Ward Group'])
+LOCALITIES = np.array(['Chapletown', 'Belper', 'Bushey', 'Exeter', 'High Wycombe', 'Arbroath', 'Rutherglen', 'Berlin', 'Miami'])
+STORE_TYPES = np.array(['Local', 'Super Store', 'Mall Kiosk', 'Outlet'])
+CARD_PROVIDERS = np.array(['Diners Club / Carte Blanche', 'American Express', 'JCB 16 digit', 'JCB 15 digit',
+                           'Maestro', 'Mastercard', 'Discover', 'VISA 19 digit', 'VISA 16 digit', 'VISA 13 digit'])
+PRODUCT_CATEGORIES = np.array(['toys-and-games', 'sports-and-leisure', 'pets', 'homeware', 'health-and-beauty', 'food-and-drink', 'diy'])
+TIME_PERIODS = np.array(['Late_Hours', 'Morning', 'Midday', 'Evening'])
+
+# Weights in the formats found in products.csv, including multiples and the ones the cleaning doesn't recognise
+WEIGHTS = np.array(['1.6kg', '0.45kg', '590g', '100g', '16oz', '400ml', '12 x 100g', '8 x 150g', '3 x 2g', '77g .',
+                    '2.5 kg', '1kg', '113g', '32oz', '15g', '1000', '9GO5DH8'])
+
+def _uuids(rng, num_rows:int):
+    """
+    Random UUID strings, built from random bytes without a Python loop
+    """
+    hex_chars = np.frombuffer(rng.bytes(16 * num_rows).hex().encode(), dtype='S1').reshape(num_rows, 32)
+    dash = np.full((num_rows, 1), b'-', dtype='S1')
+    parts = np.hstack([hex_chars[:, :8], dash, hex_chars[:, 8:12], dash, hex_chars[:, 12:16], dash, hex_chars[:, 16:20], dash, hex_chars[:, 20:]])
+    return np.ascontiguousarray(parts).view('S36').ravel().astype(str)
+
+def _codes(rng, num_rows:int, prefixes, digits:int, suffix:bool=True):
+    """
+    Random codes like 'BL-8387506C' or 'R7-3126933h', a prefix, a number of 'digits' digits and a letter
+    """
+    codes = pd.Series(rng.choice(prefixes, size=num_rows)) + '-' + pd.Series(rng.integers(0, 10**digits, size=num_rows)).astype(str).str.zfill(digits)
+    if suffix:
+        codes = codes + pd.Series(rng.choice(list(string.ascii_letters), size=num_rows))
+    return codes.to_numpy()
+
+def _dates(rng, num_rows:int, start:str, end:str):
+    """
+    Random dates between 'start' and 'end' as datetime64[D]
+    """
+    start, end = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+    return start + rng.integers(0, (end - start).astype(int), size=num_rows).astype('timedelta64[D]')
+
+def _date_strings(rng, dates, dirt:float):
+    """
+    Format 'dates' as 'YYYY-MM-DD', with a 'dirt' share of them in one of the other DATE_FORMATS
+    """
+    strings = np.datetime_as_string(dates, unit='D').astype(object)
+    mixed = np.flatnonzero(rng.random(len(dates)) < dirt)
+    if len(mixed):
+        formats = rng.choice(DATE_FORMATS[1:], size=len(mixed))
+        mixed_dates = pd.Series(pd.to_datetime(dates[mixed]))
+        for date_format in DATE_FORMATS[1:]:
+            selected = formats == date_format
+            strings[mixed[selected]] = mixed_dates[selected].dt.strftime(date_format).to_numpy()
+    return strings
+
+def _garbage(rng, num_rows:int):
+    """
+    Random strings of 10 capital letters, like the rows of the sources filled with the wrong information.
+    Made of letters only, so they never parse as a date or a number
+    """
+    letters = np.frombuffer(rng.choice(list(string.ascii_uppercase.encode()), size=num_rows * 10).astype('uint8').tobytes(), dtype='S10')
+    return letters.astype(str).astype(object)
+
+def _add_dirt(rng, df, dirt:float, columns:list, null_value='NULL'):
+    """
+    Overwrite all the 'columns' of a 'dirt' share of the rows of 'df': half of them with 'null_value',
+    the other half with garbage strings
+
+    Returns:
+    --------
+    <class 'numpy.ndarray'>
+        Positions of the rows that were left clean
+    """
+    dirty = rng.random(len(df)) < dirt
+    null_rows = dirty & (rng.random(len(df)) < 0.5)
+    garbage_rows = dirty & ~null_rows
+
+    for column in columns:
+        values = df[column].to_numpy(dtype=object, copy=True)
+        values[null_rows] = null_value
+        values[garbage_rows] = _garbage(rng, int(garbage_rows.sum()))
+        df[column] = values
+    return np.flatnonzero(~dirty)
+
+def generate_users(num_rows:int, seed:int=0, dirt:float=DEFAULT_DIRT, start_index:int=0):
+    """
+    Generate a synthetic 'legacy_users' table, as read from the RDS
+
+    Dirt: rows of 'NULL' strings and of garbage, dates in mixed formats, 'GGB' country codes,
+    duplicated users and join dates before the date of birth
+
+    Parameters:
+    ----------
+    num_rows: int
+        Number of rows to generate
+
+    seed: int
+        Seed for the random number generator, the same seed generates the same table
+
+    dirt: float
+        Share of the rows with each kind of dirt
+
+    start_index: int
+        Value of the 'index' column of the first row, to generate a table in chunks
+
+    Returns:
+    --------
+    <class 'pandas.core.frame.DataFrame'>
+        The generated table
+    """
+    rng = np.random.default_rng(seed)
+    country = rng.integers(0, len(COUNTRIES), size=num_rows)
+    first_names = rng.choice(FIRST_NAMES, size=num_rows)
+    last_names = rng.choice(LAST_NAMES, size=num_rows)
+    date_of_birth = _dates(rng, num_rows, '1940-01-01', '1990-01-01')
+    # A few users joined before they were born, they are flagged by the cleaning
+    join_date = np.where(rng.random(num_rows) < dirt, _dates(rng, num_rows, '1930-01-01', '1940-01-01'),
+                         _dates(rng, num_rows, '1992-01-01', '2023-01-01'))
+
+    df = pd.DataFrame({
+        'index': np.arange(start_index, start_index + num_rows),
+        'first_name': first_names,
+        'last_name': last_names,
+        'date_of_birth': _date_strings(rng, date_of_birth, dirt),
+        'company': rng.choice(COMPANIES, size=num_rows),
+        'email_address': pd.Series(first_names).str.lower() + '.' + pd.Series(last_names).str.lower() + '@example.com',
+        'address': pd.Series(rng.integers(1, 200, size=num_rows)).astype(str) + ' ' + rng.choice(LOCALITIES, size=num_rows) + ' Road',
+        'country': np.array([name for name, _ in COUNTRIES])[country],
+        'country_code': np.array([code for _, code in COUNTRIES])[country],
+        'phone_number': '+44 (0)' + pd.Series(rng.integers(10**9, 10**10, size=num_rows)).astype(str),
+        'join_date': _date_strings(rng, join_date, dirt),
+        'user_uuid': _uuids(rng, num_rows),
+    })
+
+    df.loc[rng.random(num_rows) < dirt, 'country_code'] = 'GGB'
+    clean_rows = _add_dirt(rng, df, dirt, [column for column in df.columns if column != 'index'])
+
+    # Repeat some clean users further down the table
+    duplicates = clean_rows[rng.random(len(clean_rows)) < dirt]
+    if len(duplicates):
+        targets = rng.choice(num_rows, size=len(duplicates))
+        df.iloc[targets, 1:] = df.iloc[duplicates, 1:].to_numpy()
+    return df
+
+def generate_cards(num_rows:int, seed:int=0, dirt:float=DEFAULT_DIRT, rows_per_page:int=50):
+    """
+    Generate synthetic card details, as the list of per-page DataFrames read from 'card_details.pdf'
+
+    Dirt: rows of 'NULL' strings and of garbage, card numbers prefixed with '?' and dates in mixed formats
+
+    Returns:
+    --------
+    list of <class 'pandas.core.frame.DataFrame'>
+        The generated card details, 'rows_per_page' rows per DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    card_numbers = pd.Series(rng.integers(10**15, 10**16, size=num_rows)).astype(str).to_numpy(dtype=object)
+    prefixed = rng.random(num_rows) < dirt
+    card_numbers[prefixed] = '???' + card_numbers[prefixed]
+    expiry = _dates(rng, num_rows, '2023-01-01', '2032-01-01')
+
+    df = pd.DataFrame({
+        'card_number': card_numbers,
+        'expiry_date': pd.Series(pd.to_datetime(expiry)).dt.strftime('%m/%y').to_numpy(),
+        'card_provider': rng.choice(CARD_PROVIDERS, size=num_rows),
+        'date_payment_confirmed': _date_strings(rng, _dates(rng, num_rows, '1992-01-01', '2023-01-01'), dirt),
+    })
+    _add_dirt(rng, df, dirt, list(df.columns))
+    return [df.iloc[start:start + rows_per_page].reset_index(drop=True) for start in range(0, num_rows, rows_per_page)]
+
+def generate_stores(num_rows:int, seed:int=0, dirt:float=DEFAULT_DIRT):
+    """
+    Generate synthetic store details, as the DataFrame built from the stores API by get_stores
+
+    Dirt: rows of 'NULL' strings and of garbage, letters typed into staff_numbers,
+    'eeEurope' and 'eeAmerica' continents, and a web portal store with 'N/A' location
+
+    Returns:
+    --------
+    <class 'pandas.core.frame.DataFrame'>
+        The generated store details
+    """
+    rng = np.random.default_rng(seed)
+    country = rng.integers(0, len(COUNTRIES), size=num_rows)
+    country_codes = np.array([code for _, code in COUNTRIES])[country]
+    staff_numbers = pd.Series(rng.integers(1, 100, size=num_rows)).astype(str).to_numpy(dtype=object)
+    typos = np.flatnonzero(rng.random(num_rows) < dirt)
+    staff_numbers[typos] = rng.choice(list(string.ascii_letters), size=len(typos)).astype(object) + staff_numbers[typos]
+    continents = np.where(country_codes == 'US', 'America', 'Europe').astype(object)
+    typoed = rng.random(num_rows) < dirt
+    continents[typoed] = 'ee' + continents[typoed]
+
+    df = pd.DataFrame({
+        'index': np.arange(num_rows),
+        'address': pd.Series(rng.integers(1, 200, size=num_rows)).astype(str) + ' ' + rng.choice(LOCALITIES, size=num_rows) + ' Street',
+        'longitude': np.round(rng.uniform(-10, 15, size=num_rows), 5).astype(str),
+        'lat': None,
+        'locality': rng.choice(LOCALITIES, size=num_rows),
+        'store_code': _codes(rng, num_rows, ['BL', 'MI', 'HI', 'EX', 'CH'], 7, suffix=True),
+        'staff_numbers': staff_numbers,
+        'opening_date': _date_strings(rng, _dates(rng, num_rows, '1990-01-01', '2023-01-01'), dirt),
+        'store_type': rng.choice(STORE_TYPES, size=num_rows),
+        'latitude': np.round(rng.uniform(35, 60, size=num_rows), 5).astype(str),
+        'country_code': country_codes,
+        'continent': continents,
+    })
+    _add_dirt(rng, df, dirt, [column for column in df.columns if column not in ('index', 'lat')])
+
+    # The first store is the web portal, which has no location
+    df.loc[0, ['address', 'longitude', 'latitude', 'locality']] = 'N/A'
+    df.loc[0, ['store_code', 'staff_numbers', 'opening_date', 'store_type', 'country_code', 'continent']] = \
+        ['WEB-1388012W', '325', '2010-06-12', 'Web Portal', 'GB', 'Europe']
+    return df
+
+def generate_products(num_rows:int, seed:int=0, dirt:float=DEFAULT_DIRT):
+    """
+    Generate a synthetic 'products.csv', as read from S3
+
+    Dirt: empty rows, rows of garbage, dates in mixed formats and weights in every format of the source,
+    including multiples ('12 x 100g') and ones that are not recognised ('77g .', '9GO5DH8')
+
+    Returns:
+    --------
+    <class 'pandas.core.frame.DataFrame'>
+        The generated products
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'product_name': 'Product ' + pd.Series(rng.integers(0, 10**6, size=num_rows)).astype(str),
+        'product_price': '£' + pd.Series(np.round(rng.uniform(0.5, 500, size=num_rows), 2)).map('{:.2f}'.format),
+        'weight': rng.choice(WEIGHTS, size=num_rows),
+        'category': rng.choice(PRODUCT_CATEGORIES, size=num_rows),
+        'EAN': pd.Series(rng.integers(10**12, 10**13, size=num_rows)).astype(str),
+        'date_added': _date_strings(rng, _dates(rng, num_rows, '1992-01-01', '2023-01-01'), dirt),
+        'uuid': _uuids(rng, num_rows),
+        'removed': np.where(rng.random(num_rows) < 0.1, 'Removed', 'Still_avaliable'),
+        'product_code': _codes(rng, num_rows, ['R7', 'C2', 'S1', 'D8', 'B3'], 7, suffix=True),
+    })
+    # Empty rows of products.csv are read as NaN rather than 'NULL'
+    _add_dirt(rng, df, dirt, list(df.columns), null_value=np.nan)
+    return df
+
+def generate_date_times(num_rows:int, seed:int=0, dirt:float=DEFAULT_DIRT):
+    """
+    Generate a synthetic 'date_details.json', as read from S3
+
+    Dirt: rows of 'NULL' strings and of garbage
+
+    Returns:
+    --------
+    <class 'pandas.core.frame.DataFrame'>
+        The generated date details
+    """
+    rng = np.random.default_rng(seed)
+    timestamps = pd.Series(_dates(rng, num_rows, '1992-01-01', '2023-01-01')).astype('datetime64[ns]') \
+        + pd.to_timedelta(rng.integers(0, 86400, size=num_rows), unit='s')
+
+    df = pd.DataFrame({
+        'timestamp': timestamps.dt.strftime('%H:%M:%S'),
+        'month': timestamps.dt.month.astype(str),
+        'year': timestamps.dt.year.astype(str),
+        'day': timestamps.dt.day.astype(str),
+        'time_period': TIME_PERIODS[np.digitize(timestamps.dt.hour, [6, 12, 17, 22]) % 4],
+        'date_uuid': _uuids(rng, num_rows),
+    })
+    _add_dirt(rng, df, dirt, list(df.columns))
+    return df
+
+def generate_orders(num_rows:int, seed:int=0, dirt:float=DEFAULT_DIRT, start_index:int=0):
+    """
+    Generate a synthetic 'orders_table', as read from the RDS
+
+    The foreign keys repeat like in the source: a few hundred stores, a few thousand products
+    and about eight orders per user and card. Dirt: the mostly empty 'first_name', 'last_name' and '1' columns
+    and the 'level_0' index left over from the source
+
+    Returns:
+    --------
+    <class 'pandas.core.frame.DataFrame'>
+        The generated orders
+    """
+    rng = np.random.default_rng(seed)
+    num_users = max(1, num_rows // 8)
+    users = _uuids(rng, num_users)
+    cards = pd.Series(rng.integers(10**15, 10**16, size=num_users)).astype(str).to_numpy()
+    stores = _codes(rng, 450, ['BL', 'MI', 'HI', 'EX', 'CH', 'WEB'], 7, suffix=True)
+    products = _codes(rng, 2000, ['R7', 'C2', 'S1', 'D8', 'B3'], 7, suffix=True)
+    user = rng.integers(0, num_users, size=num_rows)
+
+    def mostly_empty():
+        values = np.full(num_rows, None, dtype=object)
+        filled = rng.random(num_rows) < dirt
+        values[filled] = rng.choice(FIRST_NAMES, size=int(filled.sum()))
+        return values
+
+    index = np.arange(start_index, start_index + num_rows)
+    return pd.DataFrame({
+        'level_0': index,
+        'index': index,
+        'date_uuid': _uuids(rng, num_rows),
+        'first_name': mostly_empty(),
+        'last_name': mostly_empty(),
+        'user_uuid': users[user],
+        'card_number': cards[user],
+        'store_code': stores[rng.integers(0, len(stores), size=num_rows)],
+        'product_code': products[rng.integers(0, len(products), size=num_rows)],
+        '1': np.full(num_rows, np.nan),
+        'product_quantity': rng.integers(1, 14, size=num_rows),
+    })
+
+# Generator of each source, by the name of the table it is uploaded to
+GENERATORS = {
+    'dim_users': generate_users,
+    'dim_card_details': generate_cards,
+    'dim_store_details': generate_stores,
+    'dim_products': generate_products,
+    'dim_date_times': generate_date_times,
+    'orders_table': generate_orders,
+}
+
+def generate_chunks(table_name:str, num_rows:int, chunksize:int, seed:int=0, dirt:float=DEFAULT_DIRT):
+    """
+    Generator yielding a synthetic RDS table ('dim_users' or 'orders_table' source) in chunks of 'chunksize' rows,
+    so tables larger than memory can be generated. Each chunk has its own seed derived from 'seed'
+    """
+    generator = GENERATORS[table_name]
+    for number, start in enumerate(range(0, num_rows, chunksize)):
+        yield generator(min(chunksize, num_rows - start), seed=seed + number, dirt=dirt, start_index=start)
+
+class SyntheticExtractor:
+    """
+    Stand-in for DataExtractor that serves pre-generated synthetic sources,
+    so DataCleaning can be run and timed without the RDS, S3, the PDF or the stores API
+
+    It has the extraction methods DataCleaning calls, each returns a copy of the generated source
+    (or, for the RDS tables read in chunks, generates the chunks on the fly).
+    The RDS connector passed to read_rds_table is not used, so any placeholder can be given to DataCleaning
+    """
+    def __init__(self, num_rows:int, seed:int=0, dirt:float=DEFAULT_DIRT, tables:list=None) -> None:
+        """
+        Parameters:
+        ----------
+        num_rows: int
+            Number of rows of each generated source
+
+        seed: int
+            Seed for the random number generator
+
+        dirt: float
+            Share of the rows with each kind of dirt
+
+        tables: list of string
+            Tables whose sources are generated upfront, all by default
+        """
+        self.num_rows = num_rows
+        self.seed = seed
+        self.dirt = dirt
+        self.sources = {table_name: GENERATORS[table_name](num_rows, seed=seed, dirt=dirt)
+                        for table_name in (tables if tables is not None else GENERATORS)}
+
+    def _source(self, table_name:str):
+        source = self.sources[table_name]
+        return [df.copy() for df in source] if isinstance(source, list) else source.copy()
+
+    def read_rds_table(self, db_connector, table_name:str, chunksize:int=None):
+        table_name = {'legacy_users': 'dim_users'}.get(table_name, table_name)
+        if chunksize is not None:
+            return generate_chunks(table_name, self.num_rows, chunksize, seed=self.seed, dirt=self.dirt)
+        return self._source(table_name)
+
+    def retrieve_pdf_data(self, pdf_path:str):
+        return self._source('dim_card_details')
+
+    def get_stores(self, max_workers:int=None):
+        return self._source('dim_store_details')
+
+    def extract_from_s3(self, bucket_name:str, file_key:str, chunksize:int=None):
+        return self._source({'products.csv': 'dim_products', 'date_details.json': 'dim_date_times'}[file_key])
+
+    def extract_prefix_from_s3(self, bucket_name:str, prefix:str, max_workers:int=None):
+        return self._source('dim_date_times')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic version of each data source and print a sample")
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dirt', type=float, default=DEFAULT_DIRT)
+    args = parser.parse_args()
+
+    for table_name, generator in GENERATORS.items():
+        df = generator(args.rows, seed=args.seed, dirt=args.dirt)
+        df = pd.concat(df, ignore_index=True) if isinstance(df, list) else df
+        print(f"---- {table_name}: {len(df)} rows ----")
+        print(df.head())
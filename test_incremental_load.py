@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+
+from process_and_upload import _upload_and_count
+
+class InMemoryConnector:
+    """
+    Stands in for DatabaseConnector: upserts the uploaded rows into a dict on the natural key
+    and keeps the high-water marks in memory
+    """
+    def __init__(self, key:str) -> None:
+        self.key = key
+        self.rows = {}
+        self.watermarks = {}
+
+    def get_watermark(self, table_name):
+        return self.watermarks.get(table_name)
+
+    def set_watermark(self, table_name, column_name, high_water_mark):
+        self.watermarks[table_name] = high_water_mark
+
+    def upload_to_db(self, chunks, table_name, mode='replace'):
+        assert mode == 'upsert'
+        for chunk in chunks:
+            for row in chunk.to_dict('records'):
+                self.rows[row[self.key]] = row
+
+def _users(rows):
+    return pd.DataFrame({'user_uuid': [user_uuid for user_uuid, _ in rows],
+                         'join_date': pd.to_datetime([join_date for _, join_date in rows])})
+
+def test_rows_on_the_high_water_mark_date_are_loaded():
+    db_connector = InMemoryConnector('user_uuid')
+    first = [('a', '2023-04-30'), ('b', '2023-05-01')]
+    assert _upload_and_count(db_connector, _users(first), 'dim_users', 'incremental') == 2
+    assert db_connector.watermarks['dim_users'] == pd.Timestamp('2023-05-01')
+
+    # 'c' lands in the source on the high-water mark date after the first load
+    second = first + [('c', '2023-05-01')]
+    assert _upload_and_count(db_connector, _users(second), 'dim_users', 'incremental') == 2
+
+    assert sorted(db_connector.rows) == ['a', 'b', 'c']
+    assert db_connector.watermarks['dim_users'] == pd.Timestamp('2023-05-01')
+
+def test_rows_before_the_high_water_mark_are_skipped():
+    db_connector = InMemoryConnector('user_uuid')
+    db_connector.watermarks['dim_users'] = pd.Timestamp('2023-05-01').to_pydatetime()
+    df = pd.concat([_users([('a', '2023-04-30'), ('b', '2023-05-02')]),
+                    pd.DataFrame({'user_uuid': ['d'], 'join_date': [pd.NaT]})], ignore_index=True)
+
+    # Rows without a valid date are always upserted
+    assert _upload_and_count(db_connector, df, 'dim_users', 'incremental') == 2
+    assert sorted(db_connector.rows) == ['b', 'd']
+    assert db_connector.watermarks['dim_users'] == pd.Timestamp('2023-05-02')
@@ -0,0 +1,74 @@
+import gzip
+import io
+from contextlib import redirect_stdout
+
+import pandas as pd
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from benchmark import read_s3_buffered
+from data_extraction import DataExtractor
+
+BUCKET = 'test-bucket'
+
+def _compress(data:bytes, compression:str):
+    if compression == 'gz':
+        return gzip.compress(data)
+    if compression == 'zst':
+        zstandard = pytest.importorskip('zstandard')
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+def _serialise(df, file_type:str):
+    if file_type == 'csv':
+        return df.to_csv().encode()
+    if file_type == 'json':
+        return df.to_json().encode()
+    return df.to_json(orient='records', lines=True).encode()
+
+@pytest.fixture
+def s3():
+    mock_aws = getattr(moto, 'mock_aws', None) or moto.mock_s3
+    with mock_aws():
+        client = boto3.client('s3', region_name='eu-west-1')
+        client.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+        yield client
+
+@pytest.fixture
+def products():
+    return pd.DataFrame({
+        'product_name': [f"Product {i}" for i in range(2500)],
+        'product_price': [f"£{i % 100}.99" for i in range(2500)],
+        'weight': ['1.6kg', '2 x 200g', '500ml', '12oz', 'ZTDGUZVU'] * 500,
+        'EAN': [str(7425710935115 + i) for i in range(2500)],
+    })
+
+@pytest.mark.parametrize('compression', ['', 'gz', 'zst'])
+@pytest.mark.parametrize('file_type', ['csv', 'json', 'jsonl'])
+@pytest.mark.parametrize('ranged', [False, True])
+def test_streamed_read_matches_buffered_read(s3, products, file_type, compression, ranged):
+    file_key = f"products.{file_type}" + (f".{compression}" if compression else '')
+    s3.put_object(Bucket=BUCKET, Key=file_key, Body=_compress(_serialise(products, file_type), compression))
+    # A threshold of 0 downloads every object in parallel byte ranges
+    extractor = DataExtractor(s3_client=s3, s3_range_threshold=0 if ranged else 256 * 2**20, s3_range_size=4096)
+
+    with redirect_stdout(io.StringIO()):
+        streamed = extractor.extract_from_s3(BUCKET, file_key)
+    buffered = read_s3_buffered(s3, BUCKET, file_key)
+
+    assert len(buffered) == len(products)
+    pd.testing.assert_frame_equal(streamed, buffered)
+
+@pytest.mark.parametrize('compression', ['', 'gz'])
+@pytest.mark.parametrize('file_type', ['csv', 'jsonl'])
+def test_chunked_read_matches_buffered_read(s3, products, file_type, compression):
+    file_key = f"products.{file_type}" + (f".{compression}" if compression else '')
+    s3.put_object(Bucket=BUCKET, Key=file_key, Body=_compress(_serialise(products, file_type), compression))
+    extractor = DataExtractor(s3_client=s3)
+
+    chunks = list(extractor.extract_from_s3(BUCKET, file_key, chunksize=1000))
+
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 500]
+    pd.testing.assert_frame_equal(pd.concat(chunks), read_s3_buffered(s3, BUCKET, file_key))